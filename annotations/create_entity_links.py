@@ -9,10 +9,15 @@ author: orion.banks
 
 import argparse
 import numpy as np
+import os
 import pandas as pd
+import sys
 import synapseclient
 from synapseclient import File
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from provisioning_plan import build_plan, get_default_plan_path, load_plan, new_operation, run_plan, write_plan  # noqa: E402
+
 
 def get_args():
     """Set up command-line interface and get arguments."""
@@ -50,6 +55,20 @@ def get_args():
         type=str,
         help="The path to a csv containing metadata of the type indicated.",
     )
+    parser.add_argument(
+        "--plan",
+        type=str,
+        help="Path to write the planned link entities to. If provided, no changes are made in Synapse.",
+        required=False,
+        default=None
+    )
+    parser.add_argument(
+        "--apply",
+        type=str,
+        help="Path to a plan written with --plan, or by an earlier run, to apply. Links already created are skipped, so an interrupted run can be resumed.",
+        required=False,
+        default=None
+    )
     return parser.parse_args()
 
 
@@ -66,7 +85,7 @@ def get_names(name_column: str, target: str, link_column: str, manifest: str = N
     elif data is not None:
         df_path_target_list = [(pd.read_csv(data), data, target)]
 
-    for df, path, target in zip(df_path_target_list):
+    for df, path, target in df_path_target_list:
         names = df[f"{name_column}"].tolist()
         links = df[f"{link_column}"].tolist()
         path_name_link_target = path_name_link_target + [(path, name, link, target) for name, link in zip(names, links)]
@@ -74,23 +93,42 @@ def get_names(name_column: str, target: str, link_column: str, manifest: str = N
     return path_name_link_target
 
 
-def create_links(syn, path_name_link_target: list[tuple[str, str, str, str]]) -> list[tuple[str, str, str]]: 
+def create_link(syn, params: dict) -> dict:
+    """Plan handler: store a link entity and return its Synapse ID."""
+
+    entity = File(path=params["link"], name=params["name"], parent=params["target"], synapseStore=False)
+    entity = syn.store(entity)
+
+    return {"id": entity.id}
 
-    paths, names, links, targets = zip(*path_name_link_target)
 
-    path_name_id = []
+def plan_links(path_name_link_target: list[tuple[str, str, str, str]], context: dict) -> dict:
+    """Plan a link entity for each entry, with names cleaned for Synapse."""
 
-    for p, n, l, t in zip(paths, names, links, targets):
+    operations = [
+        new_operation(
+            f"link:{i}",
+            "create_link",
+            {"path": p, "name": n.translate(str.maketrans("", "", "[]:/!@#$<>")), "link": l, "target": t},
+        )
+        for i, (p, n, l, t) in enumerate(path_name_link_target)
+    ]
 
-        n = n.translate(str.maketrans("", "", "[]:/!@#$<>"))
+    return build_plan("create_entity_links", operations, context)
 
-        entity = File(path=l, name=n, parent=t, synapseStore=False)
-        entity = syn.store(entity)
-        id = entity.id
-        info = (p, n, id)
-        path_name_id.append(info)
 
-    return path_name_id
+def create_links(syn, plan: dict, plan_path: str) -> tuple[list[tuple[str, str, str]], dict]:
+    """Apply a link entity plan, return (path, name, Synapse ID) for each created link and failed operations."""
+
+    results, failed = run_plan(syn, plan, {"create_link": create_link}, plan_path)
+
+    path_name_id = [
+        (op["params"]["path"], op["params"]["name"], results[op["id"]]["id"])
+        for op in plan["operations"]
+        if op["id"] in results
+    ]
+
+    return path_name_id, failed
 
 
 def add_ids_to_manifests(path_name_id: list[tuple[str, str, str]], name_column: str, primary_key: str) -> None:
@@ -119,42 +157,66 @@ def main():
     args = get_args()
 
     manifest, data, data_type, name, link, target = args.m, args.d, args.t, args.n, args.l, args.p, 
+    plan_file, apply_file = args.plan, args.apply
 
-    if data_type == "DatasetView":
+    if apply_file is not None:
+        plan = load_plan(apply_file, "create_entity_links")
+        plan_path = apply_file
 
-        name_column = "Dataset Alias"
-        primary_key = "DatasetView_id"
-        link_column = "Dataset Url"
-        target_column = "folderIdDatasets"
+    else:
+        if data_type == "DatasetView":
 
-    elif data_type == "ToolView":
+            name_column = "Dataset Alias"
+            primary_key = "DatasetView_id"
+            link_column = "Dataset Url"
+            target_column = "folderIdDatasets"
 
-        name_column = "Tool Name"
-        primary_key = "ToolView_id"
-        link_column = "Tool Homepage"
-        target_column = "folderIdTools"
+        elif data_type == "ToolView":
 
-    elif data_type == "EducationalResource":
+            name_column = "Tool Name"
+            primary_key = "ToolView_id"
+            link_column = "Tool Homepage"
+            target_column = "folderIdTools"
 
-        name_column = "Resource Title"
-        primary_key = "EducationalResource_id"
-        link_column = "Resource Link"
-        target_column = "folderIdEducation"
+        elif data_type == "EducationalResource":
 
-    if manifest is not None:
-        print("Capturing information from " + data_type + " manifests...")
-        pnt = get_names(name_column, target_column, link_column, manifest=manifest)
-    elif data is not None:
-        pnt = get_names(name_column, target_column, link_column, data=data)
-    
-    else:
-        pnt = list((None, name, link, target))
+            name_column = "Resource Title"
+            primary_key = "EducationalResource_id"
+            link_column = "Resource Link"
+            target_column = "folderIdEducation"
+
+        if manifest is not None:
+            print("Capturing information from " + data_type + " manifests...")
+            pnt = get_names(name_column, target_column, link_column, manifest=manifest)
+        elif data is not None:
+            pnt = get_names(name_column, target_column, link_column, data=data)
+        
+        else:
+            pnt = [(None, name, link, target)]
+
+        context = {
+            "data_type": data_type,
+            "name_column": name_column,
+            "primary_key": primary_key,
+            "update_manifests": manifest is not None or data is not None,
+        }
+        plan = plan_links(pnt, context)
+
+        if plan_file is not None:
+            write_plan(plan, plan_file)
+            print(f"No changes made. Apply the plan with --apply {plan_file}")
+            return
+        plan_path = get_default_plan_path("create_entity_links")
+
+    data_type, name_column, primary_key = plan["context"]["data_type"], plan["context"]["name_column"], plan["context"]["primary_key"]
 
     print("Generating Synapse Link Entities for each set of " + data_type + " entries...")
-    pni = create_links(syn, pnt)
-    print(f"The following link entities were created:\n{[i for tup in pni for p,n,i in tup]}")
+    pni, failed = create_links(syn, plan, plan_path)
+    print(f"The following link entities were created:\n{[i for p, n, i in pni]}")
 
-    if manifest is not None or data is not None:
+    if failed:
+        print("Manifests were not updated, since some link entities were not created.")
+    elif plan["context"]["update_manifests"]:
         print(f"Adding Synapse IDs to {primary_key} column of {data_type} manifests")
         add_ids_to_manifests(pni, name_column, primary_key)
         print("Manifest(s) have been populated with Synapse IDs for link entities!")
@@ -1,10 +1,16 @@
 import argparse
+import io
+import os
+import sys
 from getpass import getpass
 
 import pandas as pd
 import synapseclient
 from attribute_dictionary import ATTRIBUTE_DICT
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from http_client import read_text  # noqa: E402
+
 
 def login() -> synapseclient.Synapse:
     """Log into Synapse. If env variables not found, prompt user."""
@@ -53,7 +59,7 @@ def map_legacy_terms_to_standard(vocab_csv: str) -> dict:
     Standard terms that do not have legacy terms will NOT be added
     to the dictionary.
     """
-    current_cv = pd.read_csv(vocab_csv)
+    current_cv = pd.read_csv(io.StringIO(read_text(vocab_csv)))
 
     # Only consider terms with legacy terms, then explode the list.
     filtered_cv = current_cv[current_cv["nonpreferred_values"].notna()]
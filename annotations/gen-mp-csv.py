@@ -7,7 +7,8 @@ This script will:
 - extract grant numbers from manifests
 - generate a CSV that contains manifest paths and target folder Synapse Ids, for use with upload-manifests.py
 
-Note that Synapse Ids to query are hardcoded:
+Grant and folder information comes from the local grant catalog (utils/grant_catalog.py),
+which is refreshed from Synapse when it is older than a day:
 - grant_table = syn21918972 (Grants - Merged from CCKP database)
 - folder_table = syn27210848 (All Files V2 from CCKP database)
 
@@ -19,34 +20,21 @@ import os
 import csv
 import pandas as pd
 import sys
-import synapseclient
 from datetime import datetime
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from grant_catalog import get_catalog, get_grant_folder_reference  # noqa: E402
+
 
 def query_synapse_for_folder_info(
-    ref_path: str, data_type: str, folder_id_column_name: str, grant_id_column_name: str
+    ref_path: str, folder_id_column_name: str, grant_id_column_name: str
 ) -> pd.DataFrame:
 
-    syn = synapseclient.login()
-
-    grant_table = (
-        syn.tableQuery(
-            f'SELECT "grantNumber", "grantId" AS {grant_id_column_name} FROM syn21918972'
-        )
-        .asDataFrame()
-        .fillna("")
-    )
-
-    folder_table = (
-        syn.tableQuery(
-            f"SELECT id AS {folder_id_column_name}, name, projectId AS {grant_id_column_name}  FROM syn27210848 WHERE name='{data_type}' AND parentId=projectId"
-        )
-        .asDataFrame()
-        .fillna("")
-    )
+    catalog = get_catalog()
 
-    grant_folder_reference = grant_table.merge(
-        folder_table, how="left", on=grant_id_column_name
+    grant_folder_reference = pd.DataFrame(
+        get_grant_folder_reference(catalog, folder_id_column_name, grant_id_column_name),
+        columns=["grantNumber", grant_id_column_name, folder_id_column_name],
     )
 
     grant_folder_reference.to_csv(ref_path, index=False)
@@ -70,7 +58,7 @@ def extract_ca_number(file_path: str) -> str:
 
 
 def get_folder_id_and_grant_id_from_csv(
-    grant_folder_reference, ca_number, folder_id_column_name, grant_id_column_name, mapping
+    grant_folder_reference, ca_number, folder_id_column_name, grant_id_column_name
 ):
     df = grant_folder_reference
 
@@ -78,19 +66,19 @@ def get_folder_id_and_grant_id_from_csv(
 
         match = df[df["grantNumber"] == ca_number]
 
-        if not match.empty:
-            folder_id = match[folder_id_column_name].values[0]
-            grant_id = match[grant_id_column_name].values[0]
-
-        if mapping is not None:
-            if ca_number in mapping.keys():
-                print(f"Entry {ca_number} contains values from mapping dictionary")
-                folder_id, grant_id = mapping[ca_number]
-            
-        else:
+        if match.empty:
             print(f"No match found for {ca_number}.")
             return None, None
-        
+
+        folder_id = match[folder_id_column_name].values[0]
+        grant_id = match[grant_id_column_name].values[0]
+
+        if not folder_id:
+            print(
+                f"Warning: {ca_number} has no {folder_id_column_name} folder in project {grant_id}. "
+                "Create the folder, then run 'python utils/grant_catalog.py' to update the catalog."
+            )
+
         print(
                 f"Matching {folder_id_column_name}: {folder_id}, Grant ID: {grant_id}"
             )
@@ -107,10 +95,8 @@ def get_folder_id_and_grant_id_from_csv(
 def write_file_paths_to_csv(
     file_paths: list[str],
     output_file: os.path,
-    data_type: str,
     folder_id_column_name: str,
     grant_id_column_name: str,
-    mapping: dict[str, str]
 ) -> None:
 
     ref_name = "".join(
@@ -119,7 +105,7 @@ def write_file_paths_to_csv(
     base_path = os.path.dirname(file_paths[0])
     ref_path = os.path.join(base_path, ref_name)
     grant_folder_reference = query_synapse_for_folder_info(
-        ref_path, data_type, folder_id_column_name, grant_id_column_name
+        ref_path, folder_id_column_name, grant_id_column_name
     )
 
     with open(output_file, "w", newline="") as csvfile:
@@ -133,7 +119,6 @@ def write_file_paths_to_csv(
                 ca_number,
                 folder_id_column_name,
                 grant_id_column_name,
-                mapping
             )
             csv_writer.writerow([file_path, folder_id, grant_id])
 
@@ -144,67 +129,35 @@ def main(folder_path, output_csv_file, data_type):
     if data_type == "publications":
         file_suffix = "_publication.csv"
         folder_id_column_name = "folderIdPublication"
-        folder_map = {"CA209997": "syn32698150",
-                      "CA209923": "syn43447063",
-                      "CAfiliatedNon-GrantAssociated": "syn52963310",
-                      "CA184898": "syn32698262"
-                   }
 
     elif data_type == "datasets":
         file_suffix = "_dataset.csv"
         folder_id_column_name = "folderIdDatasets"
-        folder_map = {"CA209997": "syn52744921",
-                      "CA209923": "syn43447065",
-                      "CAfiliatedNon-GrantAssociated": "syn52963225",
-                      "CA184898": "syn34577441"
-                   }
 
     elif data_type == "tools":
         file_suffix = "_tool.csv"
         folder_id_column_name = "folderIdTools"
-        folder_map = {"CA209997": "syn32698153",
-                      "CA209923": "syn43447067",
-                      "CAfiliatedNon-GrantAssociated": "syn52963223",
-                      "CA184898": "syn53478645"
-                   }
 
     elif data_type == "education":
         file_suffix = "_education.csv"
         folder_id_column_name = "folderIdEducation"
-        folder_map = {"CA209997": "syn53014160",
-                      "CA209923": "syn53014271",
-                      "CAfiliatedNon-GrantAssociated": "syn52963215",
-                      "CA184898": "syn53014135"
-                   }
 
     elif data_type == "grants":
         file_suffix = "_grant.csv"
         folder_id_column_name = "folderIdGrant"
-        folder_map = None
 
     else:
         print(
             "Invalid data type. Please provide one of 'publications', 'datasets', 'tools', 'education', or 'grants'."
         )
         return
-    
-    if folder_map is not None:
-        eq_mapping = {"CA209997": (folder_map["CA209997"], "syn7315802"),
-                  "CA209923": (folder_map["CA209923"], "syn43447051"),
-                  "CAfiliatedNon-GrantAssociated": (folder_map["CAfiliatedNon-GrantAssociated"], "syn52963211"),
-                   "CA184898": (folder_map["CA184898"], "syn9772917")
-                  }
-    else:
-        eq_mapping = None
 
     file_paths = get_csv_files_in_folder(folder_path, file_suffix)
     write_file_paths_to_csv(
         file_paths,
         output_csv_file,
-        data_type,
         folder_id_column_name,
         grant_id_column_name,
-        eq_mapping
     )
 
     print("CSV file with file paths, target IDs, and grant IDs generated.")
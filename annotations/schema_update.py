@@ -11,8 +11,12 @@ author: orion.banks
 
 import synapseclient
 import pandas as pd
+import os
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from grant_catalog import get_catalog, get_manifest_table_id  # noqa: E402
+
 syn = synapseclient.login()
 
 if len(sys.argv) != 3:
@@ -27,15 +31,10 @@ grantId_list = pd.read_csv(input_file_path)["grantId"].tolist()
 
 table_ids_list = []
 
+catalog = get_catalog(syn)
+
 for grantId in grantId_list:
-    try:
-        table_id = [
-            x
-            for x in syn.getChildren(grantId, includeTypes=["table"])
-            if x.get("name").startswith(entity_type.lower())
-        ][0].get("id")
-    except IndexError:
-        table_id = ""
+    table_id = get_manifest_table_id(syn, catalog, grantId, entity_type) or ""
 
     table_ids_list.append(table_id)
 
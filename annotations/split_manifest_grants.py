@@ -6,7 +6,9 @@ author: brynn.zalmanek
 author: orion.banks
 """
 
+import io
 import os
+import sys
 import argparse
 
 import pandas as pd
@@ -14,6 +16,9 @@ from openpyxl import Workbook
 from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.styles import Font
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from http_client import read_text  # noqa: E402
+
 
 def get_args():
     """Set up command-line interface and get arguments."""
@@ -115,7 +120,7 @@ def main():
     annots = ["assay", "tissue", "tumorType"]
 
     cv_file = "https://raw.githubusercontent.com/mc2-center/data-models/main/all_valid_values.csv"
-    cv_terms = pd.read_csv(cv_file)
+    cv_terms = pd.read_csv(io.StringIO(read_text(cv_file)))
     cv_terms = cv_terms.loc[
         cv_terms["category"].str.contains(manifest_type)
         | cv_terms["category"].isin(annots)
@@ -4,6 +4,16 @@ upload-manifests.py
 This script accepts a CSV file containing manifest file paths and their corresponding Synapse IDs for target folders. 
 It then performs a parallel validation check, after which it parallel uploads the manifests to Synapse
 
+Submits run concurrently, up to -w at a time, except that submits to the same table
+(same project and manifest type) run one after another.
+Each completed submit is recorded in a JSONL file next to the input CSV, so a run that
+fails or is interrupted can be started again and only submits manifests that were not
+yet submitted, or have changed since.
+
+Before submitting, each manifest is compared with the rows already in its target table,
+by the manifest's primary key (e.g. PublicationView_id). Manifests with no new or changed
+rows are not submitted. With --delta, only the new and changed rows are submitted.
+
 author: aditi.gopalan
 author: orion.banks
 
@@ -11,12 +21,25 @@ author: orion.banks
 
 import pandas as pd
 import synapseclient
-import multiprocessing
 import subprocess
 import sys
 import argparse
+import datetime
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from grant_catalog import forget_manifest_table, get_catalog, get_manifest_table_id  # noqa: E402
+
+DEFAULT_WORKERS = 4  # schematic commands run at the same time
+TABLE_COLUMNS_IGNORED = {"Id", "entityId", "ROW_ID", "ROW_VERSION", "ROW_ETAG"}  # added by schematic or Synapse, not in manifests
+
 
 def get_args():
     """Set up command-line interface and get arguments."""
@@ -44,6 +67,36 @@ def get_args():
         default=None,
         help="Boolean; if this flag is provided, validation will be skipped. Only use if your manifests have been previously validated.",
     )
+    parser.add_argument(
+        "-w",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Number of schematic validations or submits run at the same time. Submits to the same table always run one at a time. (Default: {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "-r",
+        type=str,
+        default=None,
+        help="Path to the JSONL record of submitted manifests. (Default: <input CSV name>_submitted.jsonl)",
+    )
+    parser.add_argument(
+        "--review",
+        action="store_true",
+        default=None,
+        help="Boolean; if this flag is provided, the submit plan is printed and must be confirmed before upload.",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        default=None,
+        help="Boolean; if this flag is provided, only new and changed rows of each manifest are submitted. The manifest file stored by schematic will then only contain those rows.",
+    )
+    parser.add_argument(
+        "--nodiff",
+        action="store_true",
+        default=None,
+        help="Boolean; if this flag is provided, manifests are submitted without comparing them to existing tables.",
+    )
     return parser.parse_args()
 
 
@@ -88,10 +141,9 @@ def validate_entry_worker(args, cf, mt, valid_only):
             return args  # Return the tuple
 
 
-def submit_entry_worker(args, cf):
-    fp, target_id, project_id = args  # Unpack the tuple
-    print(f"Submitting file: {fp} with target ID: {target_id}")
-    command = [
+def build_submit_command(fp, target_id, cf):
+    """Build the schematic command submitting a manifest to a target folder."""
+    return [
         "schematic",
         "model",
         "-c",
@@ -108,100 +160,339 @@ def submit_entry_worker(args, cf):
         "-tcn",
         "display_name"
     ]
+
+
+def submit_entry_worker(args, cf):
+    fp, target_id, project_id = args  # Unpack the tuple
+    print(f"Submitting file: {fp} with target ID: {target_id}")
+    command = build_submit_command(fp, target_id, cf)
     cmd_line = " ".join(command)
 
     print(cmd_line)
 
-    subprocess.run(command, stdout=sys.stdout, stderr=subprocess.STDOUT)
+    return subprocess.run(
+        command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+
+
+def get_record_path(csv_file):
+    """Return the default submit record path for an input CSV."""
+    return f"{os.path.splitext(csv_file)[0]}_submitted.jsonl"
+
+
+def get_manifest_hash(fp):
+    """Return the sha256 hex digest of a manifest file, so edited manifests are submitted again."""
+    with open(fp, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_submit_record(record_path):
+    """Read the submit record, return a (file path, target ID): manifest hash dictionary
+    of manifests that were submitted successfully."""
+    submitted = {}
+    if not os.path.exists(record_path):
+        return submitted
+
+    with open(record_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("returncode") == 0:
+                submitted[(entry["path"], entry["target_id"])] = entry["hash"]
+
+    return submitted
+
+
+def get_table_key(args, mt):
+    """Return the key of the table a submit writes to.
+    schematic stores one manifest table per data type in the project of the target folder."""
+    fp, target_id, project_id = args
+    return (project_id if project_id not in ("", "nan", "None") else target_id, mt)
+
+
+def plan_submits(submit_args_list, mt, submitted):
+    """Group manifests to submit by target table, skipping unchanged manifests already submitted.
+    Return a table key: list of (args, manifest hash, path to submit) dictionary and the number of skipped manifests."""
+    groups = {}
+    skipped = 0
+    for args in submit_args_list:
+        fp, target_id, project_id = args
+        manifest_hash = get_manifest_hash(fp)
+        if submitted.get((fp, target_id)) == manifest_hash:
+            skipped += 1
+            continue
+        groups.setdefault(get_table_key(args, mt), []).append((args, manifest_hash, fp))
+
+    return groups, skipped
+
+
+def append_submit_record(record_path, lock, args, manifest_hash, returncode, action):
+    """Append a completed submit, or a manifest found unchanged, to the submit record."""
+    fp, target_id, project_id = args
+    with lock:
+        with open(record_path, "a", encoding="utf-8") as record:
+            record.write(json.dumps({
+                "path": fp,
+                "target_id": target_id,
+                "project_id": project_id,
+                "hash": manifest_hash,
+                "returncode": returncode,
+                "action": action,
+                "submitted": datetime.datetime.now().isoformat(timespec="seconds"),
+            }) + "\n")
+
+
+def normalize_cell(value):
+    """Return a cell value as a comparable string.
+    List values and comma-separated strings are compared item by item, ignoring spaces after commas."""
+    if isinstance(value, (list, tuple)):
+        parts = [str(item) for item in value]
+    elif value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    elif isinstance(value, float) and value.is_integer():
+        parts = [str(int(value))]
+    else:
+        parts = str(value).split(",")
+    parts = [part.strip() for part in parts if part.strip()]
+    return ",".join(part.lower() if part.lower() in ("true", "false") else part for part in parts)
+
+
+def normalize_date(value):
+    """Return a DATE cell value as a comparable string, e.g. '2023-01-01' or '2023-01-01T12:30:00'.
+    Table values are epoch milliseconds, manifest values are date strings.
+    Values that cannot be read as a date are compared with normalize_cell."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        date = pd.to_datetime(value, unit="ms", utc=True, errors="coerce")
+    elif isinstance(value, str) and value.strip():
+        date = pd.to_datetime(value.strip(), utc=True, errors="coerce")
+    else:
+        date = pd.NaT
+    if pd.isna(date):
+        return normalize_cell(value)
+    return date.strftime("%Y-%m-%dT%H:%M:%S").removesuffix("T00:00:00")
+
+
+def get_date_columns(query_result):
+    """Return the names of DATE columns in a table query result."""
+    return [header["name"] for header in query_result.headers if header["columnType"] == "DATE"]
+
+
+def diff_manifest(manifest_df, table_df, key_column, date_columns=None):
+    """Compare manifest rows with table rows by primary key,
+    return a boolean Series marking manifest rows that are new or changed.
+    Values in date_columns are compared as dates, since the table holds them as epoch milliseconds.
+    Rows without a key, and rows with values in columns the table does not have yet, count as changed."""
+    if table_df is None or key_column not in manifest_df.columns or key_column not in table_df.columns:
+        return pd.Series(True, index=manifest_df.index)
+
+    compare_cols = [col for col in manifest_df.columns if col in table_df.columns and col not in TABLE_COLUMNS_IGNORED]
+    new_cols = [col for col in manifest_df.columns if col not in table_df.columns and col not in TABLE_COLUMNS_IGNORED]
+
+    date_cols = [col for col in compare_cols if col in (date_columns or [])]
+    manifest_values = manifest_df[compare_cols].map(normalize_cell)
+    table_values = table_df[compare_cols].map(normalize_cell)
+    for col in date_cols:
+        manifest_values[col] = manifest_df[col].map(normalize_date)
+        table_values[col] = table_df[col].map(normalize_date)
+    table_values = table_values.drop_duplicates(subset=key_column, keep="last")
+    merged = manifest_values.merge(
+        table_values, on=key_column, how="left", suffixes=("", "__table"), indicator=True
+    )
+    merged.index = manifest_df.index
+
+    changed = (merged["_merge"] == "left_only") | (merged[key_column] == "")
+    for col in compare_cols:
+        if col != key_column:
+            changed |= merged[col] != merged[f"{col}__table"]
+    for col in new_cols:
+        changed |= manifest_df[col].map(normalize_cell) != ""
+
+    return changed
+
+
+def get_delta_path(fp):
+    """Return the path for the new and changed rows of a manifest."""
+    root, ext = os.path.splitext(fp)
+    return f"{root}_delta{ext}"
+
+
+def query_manifest_table(syn, catalog, project_id, mt, retry=True):
+    """Return the ID, rows and DATE column names of a project's manifest table, or (None, None, []) if it has none.
+    A cached table ID that Synapse reports missing is dropped from the catalog and looked up again."""
+    table_id = get_manifest_table_id(syn, catalog, project_id, mt)
+    if not table_id:
+        return None, None, []
+    try:
+        query_result = syn.tableQuery(f"SELECT * FROM {table_id}")
+    except synapseclient.core.exceptions.SynapseHTTPError as error:
+        if not retry or getattr(getattr(error, "response", None), "status_code", None) != 404:
+            raise
+        print(f"Table {table_id} no longer exists, looking up the {mt} table of {project_id} again")
+        forget_manifest_table(catalog, project_id, table_id)
+        return query_manifest_table(syn, catalog, project_id, mt, retry=False)
+    return table_id, query_result.asDataFrame(), get_date_columns(query_result)
+
+
+def diff_table_group(syn, catalog, table_key, entries, mt, delta, record_path, lock):
+    """Compare each manifest of a table group with the table's current rows.
+    Unchanged manifests are recorded and dropped. With delta, changed manifests are
+    replaced by a file holding only their new and changed rows.
+    Return the entries left to submit."""
+    project_id, _ = table_key
+    table_id, table_df, date_columns = query_manifest_table(syn, catalog, project_id, mt)
+    key_column = f"{mt}_id"
+
+    to_submit = []
+    for args, manifest_hash, submit_path in entries:
+        fp = args[0]
+        manifest_df = pd.read_csv(fp, dtype=str, keep_default_na=False)
+        changed = diff_manifest(manifest_df, table_df, key_column, date_columns)
+        print(f"{fp}: {int(changed.sum())} of {len(manifest_df)} rows new or changed in {table_id or 'new table'}")
+
+        if not changed.any():
+            append_submit_record(record_path, lock, args, manifest_hash, 0, "unchanged")
+        elif delta and not changed.all():
+            submit_path = get_delta_path(fp)
+            manifest_df[changed].to_csv(submit_path, index=False)
+            to_submit.append((args, manifest_hash, submit_path))
+        else:
+            to_submit.append((args, manifest_hash, submit_path))
+
+    return to_submit
+
+
+def diff_submits(syn, groups, mt, delta, record_path, workers):
+    """Compare manifests with their target tables, fetching each table once, concurrently.
+    Return the groups with unchanged manifests removed, and the number removed."""
+    lock = threading.Lock()
+    catalog = get_catalog(syn)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            table_key: executor.submit(diff_table_group, syn, catalog, table_key, entries, mt, delta, record_path, lock)
+            for table_key, entries in groups.items()
+        }
+        diffed = {table_key: future.result() for table_key, future in futures.items()}
+
+    unchanged = sum(len(entries) for entries in groups.values()) - sum(len(entries) for entries in diffed.values())
+
+    return {table_key: entries for table_key, entries in diffed.items() if entries}, unchanged
+
+
+def format_duration(seconds):
+    """Format a number of seconds as h:mm:ss."""
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+def submit_table_group(entries, cf, record_path, progress):
+    """Submit manifests that write to the same table one after another,
+    recording each completed submit and printing progress with an ETA."""
+    for args, manifest_hash, submit_path in entries:
+        fp, target_id, project_id = args
+        result = submit_entry_worker((submit_path, target_id, project_id), cf)
+        append_submit_record(
+            record_path, progress["lock"], args, manifest_hash, result.returncode,
+            "delta" if submit_path != fp else "full"
+        )
+        with progress["lock"]:
+            progress["done"] += 1
+            if result.returncode != 0:
+                progress["failed"].append(fp)
+            elapsed = time.time() - progress["start"]
+            remaining = elapsed / progress["done"] * (progress["total"] - progress["done"])
+            print(result.stdout)
+            print(
+                f"[{progress['done']}/{progress['total']}] {'Submitted' if result.returncode == 0 else 'FAILED'}: {submit_path} "
+                f"(elapsed {format_duration(elapsed)}, ETA {format_duration(remaining)})"
+            )
+
+
+def submit_manifests(groups, cf, record_path, workers):
+    """Run submits for each table concurrently, up to workers at a time.
+    Return the list of manifests that failed to submit."""
+    progress = {
+        "lock": threading.Lock(),
+        "done": 0,
+        "total": sum(len(entries) for entries in groups.values()),
+        "failed": [],
+        "start": time.time(),
+    }
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(submit_table_group, entries, cf, record_path, progress)
+            for entries in groups.values()
+        ]
+        for future in futures:
+            future.result()
+
+    return progress["failed"]
 
 
 def main():
 
-    # syn = login()
     args = get_args()
     csv_file = args.m if args.m else "input.csv"
     config_file = args.c
     manifest_type = args.t
     submit_valid = args.v
     skip_validation = args.skip
-    single = True
+    workers = args.w
+    record_path = args.r if args.r else get_record_path(csv_file)
 
-    df = pd.read_csv(csv_file)
+    df = pd.read_csv(csv_file, dtype=str)
     pd.set_option("display.max_colwidth", 90)
 
-    num_processes = multiprocessing.cpu_count()  # Number of CPU cores
-    
-    validation_args_list = list(df.to_records(index=False))
+    validation_args_list = [tuple(str(value) for value in row) for row in df.itertuples(index=False, name=None)]
 
     if skip_validation is not None:
         submit_args_list = validation_args_list
 
     if skip_validation is None:
 
-        pool = multiprocessing.Pool(processes=num_processes)
-
-        validated_files = pool.map(
-            partial(
-                validate_entry_worker,
-                cf=config_file,
-                mt=manifest_type,
-                valid_only=submit_valid,
-            ),
-            validation_args_list,
-        )
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            validated_files = list(pool.map(
+                partial(
+                    validate_entry_worker,
+                    cf=config_file,
+                    mt=manifest_type,
+                    valid_only=submit_valid,
+                ),
+                validation_args_list,
+            ))
         print("/n ####VALIDATED FILES##### /n", validated_files)
 
-        pool.close()
-        pool.join()
-
         validated_files = [tup for tup in validated_files if tup is not None]
         submit_args_list = [tup for tup in validated_files]
 
-    submit_pool = multiprocessing.Pool(processes=num_processes)
-    
-    print(pd.DataFrame(submit_args_list))
+    groups, skipped = plan_submits(submit_args_list, manifest_type, load_submit_record(record_path))
 
-    choice = input(
-        "\n\nReview the printed list of arguments for errors in path and target matches. Type 'upload' to continue or 'end' if you see an error\n\n"
-    )
+    if args.nodiff is None and groups:
+        syn = login()
+        groups, unchanged = diff_submits(syn, groups, manifest_type, args.delta, record_path, workers)
+        print(f"\n\n{unchanged} manifests have no new or changed rows and will not be submitted.")
 
-    if choice == "upload":
-        
-        if single:
-            print("Single upload mode is active. Manifests will be uploaded one-by-one.")
-            cf = config_file
-            for fp, target_id, project_id in submit_args_list:
-                command = [
-                "schematic",
-                "model",
-                "-c",
-                cf,
-                "submit",
-                "-mp",
-                fp,
-                "-d",
-                target_id,
-                "-mrt",
-                "table_and_file",
-                "-tm",
-                "upsert",
-                "-tcn",
-                "display_name"
-                ]
-
-                cmd_line = " ".join(command)
-                print(cmd_line)
-                subprocess.run(command, stdout=sys.stdout, stderr=subprocess.STDOUT)
+    to_submit = [(submit_path, target_id, project_id) for entries in groups.values() for (_, target_id, project_id), _, submit_path in entries]
 
-        else:
-            submit_pool.map(partial(submit_entry_worker, cf=config_file), submit_args_list)
+    print(pd.DataFrame(to_submit, columns=df.columns) if to_submit else "\n\nNo manifests to submit.")
+    print(
+        f"\n\n{len(to_submit)} manifests will be submitted to {len(groups)} tables, up to {workers} at a time. "
+        f"{skipped} manifests were already submitted and have not changed (see {record_path})."
+    )
+
+    if args.review is not None:
+        choice = input(
+            "\n\nReview the printed list of arguments for errors in path and target matches. Type 'upload' to continue or 'end' if you see an error\n\n"
+        )
+        if choice != "upload":
+            print("\n\nManifests will NOT be uploaded. Exiting now.")
+            return
 
-        submit_pool.close()
-        submit_pool.join()
+    failed = submit_manifests(groups, config_file, record_path, workers)
 
-    elif choice == "end":
-        print("\n\nManifests will NOT be uploaded. Exiting now.")
-        exit
+    if failed:
+        print(f"\n\n{len(failed)} manifests could not be submitted: {failed}\nRun again to retry them.")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
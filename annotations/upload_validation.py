@@ -8,8 +8,13 @@ import synapseclient
 import pandas as pd
 import csv
 import argparse
+import os
+import sys
 from datetime import datetime
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from grant_catalog import get_catalog, get_folder_project, get_project_name as get_catalog_project_name  # noqa: E402
+
 def get_folder_type_argument():
     parser = argparse.ArgumentParser(description="Process Synapse folders and create a manifest.")
     parser.add_argument("csv_file_path", help="Path to the input CSV file.")
@@ -34,7 +39,11 @@ def get_folder_id_column(folder_type):
         return "folderIdGrant"
     
 
-def get_project_name(syn, folder_id):
+def get_project_name(syn, folder_id, catalog=None):
+    if catalog is not None:
+        project_name = get_catalog_project_name(catalog, get_folder_project(catalog, folder_id) or "")
+        if project_name:
+            return project_name
     try:
         folder = syn.get(folder_id)
         project = syn.get(folder.parentId)
@@ -48,6 +57,7 @@ def main():
     
     syn = synapseclient.Synapse()
     syn.login()
+    catalog = get_catalog(syn)
 
     df = pd.read_csv(csv_file_path)
     results = []
@@ -56,7 +66,7 @@ def main():
         folder_synapse_id = str(row[get_folder_id_column(folder_type)])
         
         if pd.notna(folder_synapse_id) and folder_synapse_id.lower() != 'nan':
-            project_name = get_project_name(syn, folder_synapse_id)
+            project_name = get_project_name(syn, folder_synapse_id, catalog)
             if project_name != 'ERROR':
                 try:
                     folder_children = syn.getChildren(folder_synapse_id)
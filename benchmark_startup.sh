@@ -0,0 +1,30 @@
+#/usr/bin/bash
+
+#Usage: bash benchmark_startup.sh [MAX_IMPORT_MS]
+
+#This script measures module import time for the TTL build scripts via python -X importtime
+#It fails if a script imports rdflib or a visualization library at startup,
+#or, if MAX_IMPORT_MS is provided, if total import time exceeds MAX_IMPORT_MS
+
+
+max_ms="$1"
+heavy_modules="rdflib|matplotlib|networkx|PIL|pydot|pydotplus|IPython"
+status=0
+
+for script in utils/csv_to_ttl.py utils/build_template_ttl.py; do
+	log=$(python -X importtime "$script" -h 2>&1 >/dev/null)
+	total_us=$(echo "$log" | awk -F'|' '/^import time:/ && $3 !~ /^ {2,}/ && $2 ~ /[0-9]/ {sum += $2} END {print sum + 0}')
+	total_ms=$((total_us / 1000))
+	echo "$script: ${total_ms} ms of imports at startup"
+	loaded=$(echo "$log" | awk -F'|' '/^import time:/ {gsub(/ /, "", $3); print $3}' | grep -E "^($heavy_modules)(\.|$)" | sed "s/\..*//" | sort -u | tr '\n' ' ')
+	if [ -n "$loaded" ]; then
+		echo "❗ $script imports graph dependencies at startup: $loaded"
+		status=1
+	fi
+	if [ -n "$max_ms" ] && [ "$total_ms" -gt "$max_ms" ]; then
+		echo "❗ $script import time exceeds ${max_ms} ms"
+		status=1
+	fi
+done
+
+exit $status
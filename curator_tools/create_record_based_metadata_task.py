@@ -16,6 +16,8 @@ Users can also set arguments using the global variables below,
 """
 
 import argparse
+import os
+import sys
 import tempfile
 import pandas as pd
 from pprint import pprint
@@ -27,6 +29,9 @@ from synapseclient import Synapse
 from synapseclient.models import RecordSet, CurationTask, RecordBasedMetadataTaskProperties, Grid
 from synapseclient.services.json_schema import JsonSchemaService
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from model_cache import load_model  # noqa: E402
+
 PROJECT_ID = "" # The Synapse ID of the project where the folder exists
 FOLDER_ID = ""  # The Synapse ID of the folder to upload to
 DCC = ""  # Data Coordination Center
@@ -96,6 +101,7 @@ def extract_schema_properties_from_dict(schema_data: Dict[str, Any]) -> pd.DataF
 def extract_schema_properties_from_file(json_file_path: str) -> pd.DataFrame:
     """
     Process a JSON schema file and return a DataFrame with property titles as columns.
+    The schema is compiled once per file hash and cached, see utils/model_cache.py.
     Args:
         json_file_path: Path to the JSON schema file
     Returns:
@@ -106,10 +112,10 @@ def extract_schema_properties_from_file(json_file_path: str) -> pd.DataFrame:
         ValueError: If the file doesn't contain a valid schema structure
     """
     try:
-        with open(json_file_path, 'r', encoding='utf-8') as file:
-            schema_data = json.load(file)
+        compiled_schema = load_model(json_file_path)
+        titles = [attribute["title"] for attribute in compiled_schema["attributes"].values()]
 
-        return extract_schema_properties_from_dict(schema_data)
+        return create_dataframe_from_titles(titles)
 
     except FileNotFoundError as e:
         raise FileNotFoundError(f"JSON schema file not found: {json_file_path}") from e
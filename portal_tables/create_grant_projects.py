@@ -6,12 +6,25 @@ team with "Can edit" permissions.
 """
 
 import argparse
+import os
 import pandas as pd
 import re
+import sys
 
 import synapseclient
 from synapseclient import Project, Wiki, Folder, Team
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from provisioning_plan import (  # noqa: E402
+    build_plan,
+    get_default_plan_path,
+    load_plan,
+    new_operation,
+    ref,
+    run_plan,
+    write_plan,
+)
+
 PERMISSIONS = {
     "view": ["READ"],
     "download": ["READ", "DOWNLOAD"],
@@ -28,6 +41,8 @@ PERMISSIONS = {
         "CHANGE_PERMISSIONS",
     ],
 }
+DEFAULT_WORKERS = 8  # operations applied concurrently
+DEFAULT_MAX_RATE = 5.0  # operations started per second, shared by all grants
 
 
 def _syn_prettify(name):
@@ -69,13 +84,75 @@ def get_args():
         help=("Add grants to this specified table. " "(Default: syn21918972)"),
     )
     parser.add_argument("--dryrun", action="store_true")
+    parser.add_argument(
+        "--plan",
+        type=str,
+        default=None,
+        help=("Write the planned projects, wikis, folders and teams to this path, without making changes."),
+    )
+    parser.add_argument(
+        "--apply",
+        type=str,
+        default=None,
+        help=(
+            "Apply a plan written with --plan, or by an earlier run. "
+            "Operations already applied are skipped, so an interrupted run can be resumed."
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=(f"Number of provisioning operations applied concurrently. (Default: {DEFAULT_WORKERS})"),
+    )
+    parser.add_argument(
+        "--max_rate",
+        type=float,
+        default=DEFAULT_MAX_RATE,
+        help=(f"Maximum number of provisioning operations started per second. (Default: {DEFAULT_MAX_RATE})"),
+    )
     return parser.parse_args()
 
 
-def create_wiki_pages(syn, project_id, grant):
-    """Create main Wiki page for the Project."""
+PROJECT_FOLDERS = [
+    "biospecimens",
+    "datasets",
+    "education",
+    "governance",
+    "individuals",
+    "models",
+    "publications",
+    "sharing_plans",
+    "studies",
+    "tools",
+]
+PI_WIKI_TITLE = "Project Investigators"
+
+
+def get_existing_wiki_id(syn, project_id, title=None):
+    """Find a Wiki page of the Project, by title, or the main page if no title is given.
+
+    Returns the Wiki ID, or None if the page does not exist.
+    """
+    try:
+        headers = syn.getWikiHeaders(project_id)
+    except synapseclient.core.exceptions.SynapseHTTPError:
+        return None  # the Project has no Wiki yet
+    for header in headers:
+        if title is None and not header.get("parentId"):
+            return header["id"]
+        if title is not None and header.get("title") == title:
+            return header["id"]
+    return None
+
+
+def create_main_wiki(syn, project_id, grant):
+    """Create main Wiki page for the Project, unless it already exists."""
+
+    existing_id = get_existing_wiki_id(syn, project_id)
+    if existing_id is not None:
+        return existing_id
 
-    # Main Wiki page
     consortium = grant["Grant Consortium Name"]
     grant_type = grant["Grant Type"]
     title = grant["Grant Institution Alias"]
@@ -100,83 +177,156 @@ def create_wiki_pages(syn, project_id, grant):
     )
     main_wiki = Wiki(title=grant["Grant Name"], owner=project_id, markdown=content)
     main_wiki = syn.store(main_wiki)
+    return main_wiki.id
+
+
+def create_pi_wiki(syn, project_id, main_wiki_id, grant):
+    """Create the Project Investigators sub-page of the main Wiki page, unless it already exists."""
+
+    existing_id = get_existing_wiki_id(syn, project_id, PI_WIKI_TITLE)
+    if existing_id is not None:
+        return existing_id
 
-    # Sub-wiki page: Project Investigators
     pis = [pi.strip(" ") for pi in grant["Grant Investigator"].split(",")]
     pi_markdown = "* " + "\n* ".join(pis)
     pi_wiki = Wiki(
-        title="Project Investigators",
+        title=PI_WIKI_TITLE,
         owner=project_id,
         markdown=pi_markdown,
-        parentWikiId=main_wiki.id,
+        parentWikiId=main_wiki_id,
     )
     pi_wiki = syn.store(pi_wiki)
+    return pi_wiki.id
 
 
-def create_folders(syn, project_id):
-    """Create top-levels expected for resource and metadata management.
-
-    Folders:
-        - biospecimens
-        - datasets
-        - education
-        - governance
-        - individuals
-        - models
-        - publications
-        - sharing_plans
-        - studies
-        - tools
-    """
-    for name in ["biospecimens", "datasets", "education", "governance", "individuals", "models", "publications", "sharing_plans", "studies", "tools"]:
-        syn.store(Folder(name, parent=project_id))
+def create_folder(syn, project_id, name):
+    """Create a top-level Folder expected for resource and metadata management,
+    unless it already exists. See PROJECT_FOLDERS."""
 
+    existing_id = syn.findEntityId(name, parent=project_id)
+    if existing_id is not None:
+        return existing_id
+    return syn.store(Folder(name, parent=project_id)).id
 
-def create_team(syn, project_id, grant, access_type="edit"):
-    """Create team for new grant project."""
+
+def get_team_name(grant):
+    """Build the Synapse team name for a grant."""
     consortia = _join_listlike_col(grant["Grant Consortium Name"])
     center = _join_listlike_col(grant["Grant Institution Alias"])
-    team_name = f"{consortia} {center} {grant['Grant Type']} {grant['Grant Number']}"
+    return f"{consortia} {center} {grant['Grant Type']} {grant['Grant Number']}"
+
+
+def create_team(syn, project_id, grant, access_type="edit"):
+    """Create team for new grant project, or reuse the team if it already exists."""
+    team_name = get_team_name(grant)
     try:
-        new_team = Team(name=team_name, canPublicJoin=False)
-        new_team = syn.store(new_team)
-        syn.setPermissions(
-            project_id, principalId=new_team.id, accessType=PERMISSIONS.get(access_type)
-        )
-        return new_team.id
-    except ValueError as err:
-        if err.__context__.response.status_code == 409:
-            print(f"Team already exists: {team_name}")
-        else:
-            print(f"Something went wrong! Team: {team_name}")
-        return None
+        team = syn.getTeam(team_name)
+        print(f"Team already exists: {team_name}")
+    except (ValueError, synapseclient.core.exceptions.SynapseHTTPError):
+        team = syn.store(Team(name=team_name, canPublicJoin=False))
+    syn.setPermissions(
+        project_id, principalId=team.id, accessType=PERMISSIONS.get(access_type)
+    )
+    return team.id
+
+
+def apply_create_project(syn, params):
+    """Plan handler: create the grant Project, or reuse it if it already exists,
+    and give the admin team access."""
+    project_id = syn.findEntityId(params["name"])
+    if project_id is None:
+        project_id = syn.store(Project(params["name"])).id
+    syn.setPermissions(
+        project_id, principalId=3450948, accessType=PERMISSIONS.get("admin")
+    )
+    return {"id": project_id}
+
+
+def apply_create_main_wiki(syn, params):
+    """Plan handler: create the main Wiki page for the grant Project."""
+    return {"id": create_main_wiki(syn, params["project"], params["grant"])}
+
+
+def apply_create_pi_wiki(syn, params):
+    """Plan handler: create the Project Investigators Wiki page."""
+    return {"id": create_pi_wiki(syn, params["project"], params["main_wiki"], params["grant"])}
+
+
+def apply_create_folder(syn, params):
+    """Plan handler: create a top-level Folder in the grant Project."""
+    return {"id": create_folder(syn, params["project"], params["name"])}
 
 
-def create_grant_projects(syn, grants):
-    """Create a new Synapse project for each grant and populate its Wiki."""
+def apply_create_team(syn, params):
+    """Plan handler: create the grant team."""
+    return {"id": create_team(syn, params["project"], params["grant"])}
+
+
+GRANT_HANDLERS = {
+    "create_project": apply_create_project,
+    "create_main_wiki": apply_create_main_wiki,
+    "create_pi_wiki": apply_create_pi_wiki,
+    "create_folder": apply_create_folder,
+    "create_team": apply_create_team,
+}
+
+
+def plan_grant_projects(grants):
+    """Plan a new Synapse project, Wiki, Folders and team for each grant.
+
+    Wiki pages, Folders and the team of a grant only depend on its project,
+    so they are created concurrently, and several grants are provisioned at once.
+    """
+
+    operations = []
+    for grant in grants.to_dict("records"):
+        grant_id = grant["GrantView_id"]
+        project_op = f"project:{grant_id}"
+        wiki_op = f"wiki:{grant_id}"
+        operations.extend([
+            new_operation(project_op, "create_project", {"name": _syn_prettify(grant["Grant Name"])}),
+            new_operation(wiki_op, "create_main_wiki", {"project": ref(project_op), "grant": grant}, [project_op]),
+            new_operation(
+                f"pi_wiki:{grant_id}",
+                "create_pi_wiki",
+                {"project": ref(project_op), "main_wiki": ref(wiki_op), "grant": grant},
+                [project_op, wiki_op],
+            ),
+            new_operation(f"team:{grant_id}", "create_team", {"project": ref(project_op), "grant": grant}, [project_op]),
+        ])
+        operations.extend([
+            new_operation(f"folder:{grant_id}:{name}", "create_folder", {"project": ref(project_op), "name": name}, [project_op])
+            for name in PROJECT_FOLDERS
+        ])
+
+    return build_plan("create_grant_projects", operations)
+
+
+def create_grant_projects(syn, plan, plan_path, workers=DEFAULT_WORKERS, max_rate=DEFAULT_MAX_RATE):
+    """Apply a grant project plan, with up to `workers` operations at a time
+    and at most `max_rate` operations started per second across all grants.
+
+    Returns a GrantView_id: (project Synapse ID, team ID) dictionary,
+    with "None" for grants whose project could not be created.
+    """
+    results, _ = run_plan(syn, plan, GRANT_HANDLERS, plan_path, workers, max_rate)
 
     grant_info_dict = {}
-    for _, row in grants.iterrows():
-        name = _syn_prettify(row["Grant Name"])
-        try:
-            project = Project(name)
-            project = syn.store(project)
-            syn.setPermissions(
-                project.id, principalId=3450948, accessType=PERMISSIONS.get("admin")
-            )
-
-            create_wiki_pages(syn, project.id, row)
-            create_folders(syn, project.id)
-            team_id = create_team(syn, project.id, row)
-            grant_info_dict[row["GrantView_id"]] = (project.id, team_id)
-        except synapseclient.core.exceptions.SynapseHTTPError:
-            print(f"Skipping: {name}")
-            grant_info_dict[row["GrantView_id"]] = ("None", "None")
-    
+    for op in plan["operations"]:
+        if op["action"] != "create_project":
+            continue
+        grant_id = op["id"].split(":", 1)[1]
+        if op["id"] in results:
+            team = results.get(f"team:{grant_id}", {}).get("id")
+            grant_info_dict[grant_id] = (results[op["id"]]["id"], team if team is not None else "None")
+        else:
+            print(f"Skipping: {op['params']['name']}")
+            grant_info_dict[grant_id] = ("None", "None")
+
     return grant_info_dict
 
 
-def process_new_grants(new = None, current = None, dryrun = None):
+def process_new_grants(new = None, current = None, dryrun = None, plan_file = None, apply_file = None):
     """Main function."""
     syn = synapseclient.Synapse()
     syn.login(silent=True)
@@ -185,6 +335,8 @@ def process_new_grants(new = None, current = None, dryrun = None):
     manifest = new if new is not None else args.manifest
     portal_table = current if current is not None else args.portal_table
     dryrun = dryrun if dryrun is not None else args.dryrun
+    plan_file = plan_file if plan_file is not None else args.plan
+    apply_file = apply_file if apply_file is not None else args.apply
 
     manifest = syn.tableQuery(f"SELECT * FROM {manifest}").asDataFrame()
     curr_manifest = syn.tableQuery(f"SELECT * FROM {portal_table}").asDataFrame()
@@ -192,7 +344,7 @@ def process_new_grants(new = None, current = None, dryrun = None):
 
     # Generate manifest containing grants not currently on CCKP
     new_grants = manifest[~manifest["Grant Number"].isin(curr_grants)]
-    grant_info_dict = {grant : ("None", "None") for grant in new_grants["Grant Number"].to_list() if grant}
+    grant_info_dict = {grant : ("None", "None") for grant in new_grants["GrantView_id"].to_list() if grant}
     
     # Only add grants not currently in the Grants table.
     if new_grants.empty:
@@ -202,9 +354,17 @@ def process_new_grants(new = None, current = None, dryrun = None):
         if dryrun:
             print("\u26A0", "WARNING:", "dryrun is enabled (no updates will be done)\n")
             print(new_grants)
+        elif apply_file is not None:
+            print(f"Adding new grants from plan {apply_file}...")
+            plan = load_plan(apply_file, "create_grant_projects")
+            grant_info_dict.update(create_grant_projects(syn, plan, apply_file, args.workers, args.max_rate))
+        elif plan_file is not None:
+            write_plan(plan_grant_projects(new_grants), plan_file)
+            print(f"No changes made. Apply the plan with --apply {plan_file}")
         else:
             print("Adding new grants...")
-            grant_info_dict = create_grant_projects(syn, new_grants)
+            plan = plan_grant_projects(new_grants)
+            grant_info_dict.update(create_grant_projects(syn, plan, get_default_plan_path("create_grant_projects"), args.workers, args.max_rate))
             
     manifest = manifest.rename(columns={
         "GrantView_id" : "grantViewId",
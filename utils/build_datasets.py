@@ -4,12 +4,17 @@ This script will provision Datasets as needed and add files to created/existing
 information provided in a Data Sharing Plan CSV or a Data Sharing Plan table Synapse Id.
 
 Usage:
-python build_datasets.py -d [DataDSP filepath] -n [Name for DSP CSV output] -f -a -c [Default version number]
+python build_datasets.py -d [DataDSP filepath] -n [Name for DSP CSV output] -f -a -c [Default version number] -v [File view Synapse Id] -w [Parallel DSP entries] --plan [Plan output path]
+python build_datasets.py --apply [Plan path]
+
+Changes are planned first and written to a plan file, then applied. Each applied change is recorded
+in a journal next to the plan, so a run that fails partway can be resumed with --apply.
 
 author: orion.banks
 """
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 from dateutil.parser import isoparse
 import os
@@ -20,6 +25,11 @@ import synapseclient
 from synapseclient import Dataset
 import synapseutils
 
+from dataset_items import get_dataset_items, merge_dataset_items, reconcile_dataset_items
+from provisioning_plan import build_plan, get_default_plan_path, load_plan, new_operation, run_plan, write_plan
+
+VIEW_PAGE_SIZE = 50000  # rows per page of a file view query
+VIEW_BATCH_SIZE = 500  # folder Synapse Ids per WHERE ... IN (...) clause
 
 def get_args():
     """Set up command-line interface and get arguments."""
@@ -27,8 +37,8 @@ def get_args():
     parser.add_argument(
         "-d",
         type=str,
-        help="Path or Table Synapse Id associated with a Data Sharing Plan.",
-        required=True,
+        help="Path or Table Synapse Id associated with a Data Sharing Plan. Not needed with --apply.",
+        required=False,
         default=None,
     )
     parser.add_argument(
@@ -66,6 +76,34 @@ def get_args():
         required=False,
         default=None
     )
+    parser.add_argument(
+        "-v",
+        type=str,
+        help="Synapse Id of a file view that includes the files in DSP scopes. If provided, scope files are listed with paged view queries, instead of retrieving each file. Default: None",
+        required=False,
+        default=None
+    )
+    parser.add_argument(
+        "-w",
+        type=int,
+        help="Number of DSP entries processed in parallel. Default: 4",
+        required=False,
+        default=4
+    )
+    parser.add_argument(
+        "--plan",
+        type=str,
+        help="Path to write the planned Dataset changes to. If provided, no changes are made in Synapse. Default: None",
+        required=False,
+        default=None
+    )
+    parser.add_argument(
+        "--apply",
+        type=str,
+        help="Path to a plan written with --plan, or by an earlier run, to apply. Operations already applied are skipped, so an interrupted run can be resumed. Default: None",
+        required=False,
+        default=None
+    )
     return parser.parse_args()
 
 
@@ -78,9 +116,13 @@ def get_table(syn, source_id: str) -> pd.DataFrame:
     return table
 
 
-def filter_files_in_folder(syn, scope: str, formats: list[str], folder_or_files: str, cutoff_date: str, after_date: bool, check_version: bool, default_version: int) -> list:
+def filter_files_in_folder(syn, scope: str, formats: list[str], folder_or_files: str, cutoff_date: str, after_date: bool, check_version: bool, default_version: int, view_id: str | None = None) -> list:
     """Capture all files in provided scope and select files that match a list of formats,
-    return list of dataset items"""
+    return list of dataset items.
+    If a file view Synapse Id is provided, files are listed and filtered with filter_files_in_view."""
+
+    if view_id is not None:
+        return filter_files_in_view(syn, view_id, scope, formats, folder_or_files, cutoff_date, after_date, check_version, default_version)
 
     dataset_items = []
     walk_path = synapseutils.walk(syn, scope, ["file"])
@@ -105,6 +147,74 @@ def filter_files_in_folder(syn, scope: str, formats: list[str], folder_or_files:
         print(f"--> {dataset_len} files found...")
     return dataset_items
 
+def list_scope_folders(syn, scope: str) -> list[str]:
+    """Return the Synapse Ids of a scope container and all folders within it."""
+
+    return [container_id for (_, container_id), *_ in synapseutils.walk(syn, scope, ["folder"])]
+
+
+def query_scope_files(syn, view_id: str, scope: str) -> pd.DataFrame:
+    """Query a file view for all files in a scope, in pages of VIEW_PAGE_SIZE rows,
+    return a Dataframe with columns id, name, versionNumber and createdOn."""
+
+    folder_ids = list_scope_folders(syn, scope)
+    pages = []
+    for start in range(0, len(folder_ids), VIEW_BATCH_SIZE):
+        folder_string = ", ".join([f"'{folder_id}'" for folder_id in folder_ids[start:start + VIEW_BATCH_SIZE]])
+        offset = 0
+        while True:
+            query = (
+                f"SELECT id, name, versionNumber, createdOn FROM {view_id} "
+                f"WHERE parentId IN ({folder_string}) AND type = 'file' "
+                f"LIMIT {VIEW_PAGE_SIZE} OFFSET {offset}"
+            )
+            page = syn.tableQuery(query).asDataFrame()
+            pages.append(page)
+            if len(page) < VIEW_PAGE_SIZE:
+                break
+            offset += VIEW_PAGE_SIZE
+
+    listing = pd.concat(pages, ignore_index=True) if pages else pd.DataFrame(columns=["id", "name", "versionNumber", "createdOn"])
+    print(f"--> {len(listing)} files listed from {len(folder_ids)} folders in {view_id}...")
+
+    return listing
+
+
+def get_cutoff_timestamp(set_date: str) -> pd.Timestamp:
+    """Convert a cutoff date in YYYY-MM-DD format to a UTC timestamp at 00:00:00."""
+
+    return pd.Timestamp(datetime.datetime.strptime(set_date, "%Y-%m-%d"), tz="UTC")
+
+
+def filter_files_in_view(syn, view_id: str, scope: str, formats: list[str], folder_or_files: str, cutoff_date: str, after_date: bool, check_version: bool, default_version: int) -> list:
+    """List all files in provided scope with a file view query and select files that match
+    a list of formats and the cutoff date, return list of dataset items.
+    Versions are taken from the view's versionNumber column when check_version is True."""
+
+    listing = query_scope_files(syn, view_id, scope)
+
+    if folder_or_files == "files":
+        listing = listing[listing["name"].str.endswith(tuple(formats))]  # only select files of desired format
+
+    if cutoff_date is not None:
+        created_on = listing["createdOn"]
+        if pd.api.types.is_numeric_dtype(created_on):
+            created_on = pd.to_datetime(created_on, unit="ms", utc=True)  # DATE columns are returned as epoch milliseconds
+        else:
+            created_on = pd.to_datetime(created_on, utc=True, format="ISO8601")
+        cutoff_timestamp = get_cutoff_timestamp(cutoff_date)
+        listing = listing[created_on > cutoff_timestamp] if after_date else listing[created_on < cutoff_timestamp]
+
+    versions = listing["versionNumber"].astype(int) if check_version else pd.Series(default_version, index=listing.index)
+    dataset_items = [
+        {"entityId": entity_id, "versionNumber": int(version)}
+        for entity_id, version in zip(listing["id"], versions)
+    ]
+    print(f"--> {len(dataset_items)} files found...")
+
+    return dataset_items
+
+
 def filter_files_by_date(created_on_iso: str, set_date: str, after_date: bool) -> bool:
     """Check if file should be included based createdOn date, using a provided cutoff date.
     Cutoff date is expected in YYYY-MM-DD format and will automatically be
@@ -134,20 +244,51 @@ def filter_files_by_date(created_on_iso: str, set_date: str, after_date: bool) -
     
     return include_in_list
 
-def create_dataset_entity(syn, name: str, grant: str, multi_dataset: bool, scope: list) -> Dataset:
-    """Create an empty Synapse Dataset using the
+def get_grant_project_id(syn, grant: str) -> str:
+    """Return the Synapse Id of the Project associated with a grant."""
+
+    query = f"SELECT grantId FROM syn21918972 WHERE grantViewId='{grant}'"
+
+    return syn.tableQuery(query).asDataFrame().iat[0, 0]
+
+
+def create_dataset_entity(syn, name: str, project_id: str, scope: list) -> Dataset:
+    """Create a Synapse Dataset with the provided items, using the
     Project associated with the applicable grant number as parent.
     Return the Dataset object."""
 
-    query = f"SELECT grantId FROM syn21918972 WHERE grantViewId='{grant}'"
-    project_id = syn.tableQuery(query).asDataFrame().iat[0, 0]
-    if multi_dataset:
-        name = f"{name}-{random.randint(1000, 9999)}"  # append random number to name for multi-dataset
     dataset = Dataset(name=name, parent=project_id, dataset_items=scope)
     dataset = syn.store(dataset)
 
     return dataset
 
+
+def apply_create_dataset(syn, params: dict) -> dict:
+    """Plan handler: create a Dataset, return its Synapse Id and name."""
+
+    dataset = create_dataset_entity(syn, params["name"], params["parent"], params["items"])
+    print(f"--> {len(params['items'])} files added to new Dataset {dataset.id}")
+
+    return {"id": dataset.id, "name": dataset.name}
+
+
+def apply_update_dataset(syn, params: dict) -> dict:
+    """Plan handler: add items to an existing Dataset, return its Synapse Id and name."""
+
+    dataset = syn.get(params["dataset_id"], downloadFile=False)
+    desired_items = merge_dataset_items(get_dataset_items(dataset), params["items"])
+    added_items, removed_items = reconcile_dataset_items(syn, dataset, desired_items)
+    print(f"--> {len(added_items)} files added to existing Dataset {dataset.id} ({len(removed_items)} previous versions replaced, {len(params['items']) - len(added_items)} already present)")
+
+    return {"id": dataset.id, "name": dataset.name}
+
+
+DATASET_HANDLERS = {
+    "create_dataset": apply_create_dataset,
+    "update_dataset": apply_update_dataset,
+}
+
+
 def chunk_files_for_dataset(scope_files: list[str], file_max: int, dataset_total: int) -> list[list[str]]:
     """Chunk files into lists of size file_max for Dataset creation."""
     file_groups = []
@@ -162,133 +303,197 @@ def chunk_files_for_dataset(scope_files: list[str], file_max: int, dataset_total
             file_groups.append(scope_files[(i - 1) * file_max:i * file_max])
     return file_groups
 
+def plan_dsp_row(syn, row_index: int, row: pd.Series, filter_by_date: bool | None, after_date: bool, check_version: bool, default_version: int, files_to_remove_list: list | None, view_id: str | None, file_max: int) -> dict:
+    """Plan the Datasets for one DSP row: list files from its scope and
+    plan an update of its existing Dataset and/or the creation of new Datasets.
+    Messages are collected and returned with the plan, so rows processed in parallel print together.
+    Return a dictionary with keys:
+    'operations', the plan operations for the row (empty if the row was skipped), and 'messages'."""
+
+    messages = []
+    log = messages.append
+
+    grant_id = row["GrantView Key"]
+    dataset_id = row["DatasetView Key"]
+    scope_id = row["DSP Dataset Alias"]
+    dataset_name = row["DSP Dataset Name"]
+    formats = re.split(", |,", row["DSP Dataset File Formats"])
+    level = row["DSP Dataset Level"]
+    cutoff_date = row["DSP Planned Upload Date"] if filter_by_date is not None else None
+    if level in ["Metadata", "Auxiliary", "Not Applicable"]:
+        log(f"Skipping Dataset {dataset_name} of type {level}")
+        return {"operations": [], "messages": messages}  # move to next table entry if not data files
+
+    create_dataset = False
+    multi_dataset = False
+    operations = []
+
+    if formats:  # only filter files if formats were specified
+        log(f"--> Filtering files from {scope_id}")
+        log(f"--> Only files of format {formats} will be included")
+        folder_or_files = "files"  # filter files by extension/format
+    else:
+        folder_or_files = "folder"  # whole folder should be added, don't filter files
+
+    if cutoff_date:
+        log(f"--> Filtering files based on cutoff date: {cutoff_date}")
+        log(" ".join(["--> Files created", "after" if after_date is True else "before", "cutoff date will be added to dataset"]))
+
+    if check_version:
+        log("--> Current versions of files will be added to dataset")
+    else:
+        log(f"--> Only version {default_version} files will be added to dataset.\n--> If mixed file versions are expected, pass '-c 0' at runtime.")
+
+    scope_files = filter_files_in_folder(syn, scope_id, formats, folder_or_files, cutoff_date, after_date, check_version, default_version, view_id)
+    if files_to_remove_list is not None:
+        files_to_remove_set = set(files_to_remove_list)
+        scope_files = [synId for synId in scope_files if synId["entityId"] not in files_to_remove_set]
+        log(f"--> Requested files removed from scope!")
+    log(f"--> Scope processing complete!")
+
+    if len(scope_files) > file_max:
+        new_dataset_count = (len(scope_files) // file_max)
+        dataset_total = 1 + new_dataset_count
+        multi_dataset = True
+        create_dataset = True
+        log(
+            f"--> File count exceeds file max (n={file_max}). {new_dataset_count} Datasets will be created.\n--> {len(scope_files)} files from {scope_id} will be added to a total of {dataset_total} Datasets."
+        )
+        file_scope_list = chunk_files_for_dataset(scope_files, file_max, new_dataset_count)
+
+    else:
+        file_scope_list = [scope_files]  # single dataset, no chunking needed
+
+    if dataset_id:
+        operations.append(new_operation(
+            f"dataset:{row_index}:0",
+            "update_dataset",
+            {"row": row_index, "dataset_id": dataset_id, "items": file_scope_list[0]},
+        ))
+        log(f"--> {len(file_scope_list[0])} files will be added to existing Dataset {dataset_id}")
+        file_scope_list = file_scope_list[1:]  # remove first item, already added
+    else:
+        create_dataset = True
+
+    if create_dataset:
+        project_id = get_grant_project_id(syn, grant_id)
+        for scope in file_scope_list:
+            name = f"{dataset_name}-{random.randint(1000, 9999)}" if multi_dataset else dataset_name  # append random number to name for multi-dataset
+            operations.append(new_operation(
+                f"dataset:{row_index}:{len(operations)}",
+                "create_dataset",
+                {"row": row_index, "name": name, "parent": project_id, "items": scope},
+            ))
+            log(f"--> {len(scope)} files will be added to new Dataset {name}")
+
+    return {"operations": operations, "messages": messages}
+
+
+def build_updated_dsp(plan: dict, results: dict) -> tuple[pd.DataFrame, bool]:
+    """Build the updated DSP from a plan and the results of applying it,
+    with the DSP row repeated for each populated Dataset.
+    Return the updated DSP and True if any new Dataset was created."""
+
+    columns = plan["context"]["dsp_columns"]
+    operations_by_row = {}
+    for op in plan["operations"]:
+        operations_by_row.setdefault(op["params"]["row"], []).append(op)
+
+    created = False
+    updated_records = []
+    for row_index, row in enumerate(plan["context"]["dsp_rows"]):
+        records = []
+        for op in operations_by_row.get(row_index, []):
+            if op["id"] in results:
+                record = dict(row)
+                record["DatasetView Key"] = results[op["id"]]["id"]
+                record["DSP Dataset Name"] = results[op["id"]]["name"]
+                records.append(record)
+                created = created or op["action"] == "create_dataset"
+        updated_records.extend(records if records else [row])
+
+    updated_df = pd.DataFrame.from_records(updated_records, columns=columns)
+    has_key = updated_df["DatasetView Key"] != ""
+    updated_df = pd.concat([
+        updated_df[has_key].drop_duplicates(subset=["DatasetView Key"], keep="last"),
+        updated_df[~has_key],
+    ]).sort_index().reset_index(drop=True)
+
+    return updated_df, created
+
+
 def main():
 
     syn = synapseclient.login()
 
     args = get_args()
 
-    dsp, new_name, filter_by_date, after_date, default_version, files_to_remove = args.d, args.n, args.f, args.a, args.c, args.r
-    
-    update_dsp_sheet = None
-    create_dataset = False
-    multi_dataset = False
+    dsp, new_name, filter_by_date, after_date, default_version, files_to_remove, view_id, workers = args.d, args.n, args.f, args.a, args.c, args.r, args.v, args.w
+    plan_file, apply_file = args.plan, args.apply
+
     check_version = True if default_version == 0 else False
     file_max = 20000  # maximum number of files per Dataset; set to 5000 to avoid web page latency issues
 
-    if os.path.exists(dsp):
-        dsp_df = pd.read_csv(dsp, keep_default_na=False, header=0)
-        print("\nData Sharing Plan read successfully!")
-    elif "syn" in dsp:
-        dsp_df = get_table(syn, dsp)
-        print(f"Data Sharing Plan acquired from Synapse table {dsp}!")
-    else:
-        print(
-            f"❗❗❗ {dsp} is not a valid Data Sharing Plan identifier. Please check your inputs and try again."
-        )
-        exit()
-
-    if dsp_df.iat[0, 0] == "DataDSP":
-        updated_df = pd.DataFrame(columns=dsp_df.columns)
-        count = 0
-        for _, row in dsp_df.iterrows():
-            grant_id = row["GrantView Key"]
-            dataset_id = row["DatasetView Key"]
-            scope_id = row["DSP Dataset Alias"]
-            dataset_name = row["DSP Dataset Name"]
-            formats = re.split(", |,", row["DSP Dataset File Formats"])
-            level = row["DSP Dataset Level"]
-            cutoff_date = row["DSP Planned Upload Date"] if filter_by_date is not None else None
-            if level in ["Metadata", "Auxiliary", "Not Applicable"]:
-                print(f"Skipping Dataset {dataset_name} of type {level}")
-                continue  # move to next table entry if not data files
-            
-            dataset_total = 1
-            dataset_id_list = []
-            file_scope_list = []
-            dataset_name_list = []
-            
-            if formats:  # only filter files if formats were specified
-                print(f"--> Filtering files from {scope_id}")
-                print(f"--> Only files of format {formats} will be included")
-                folder_or_files = "files"  # filter files by extension/format
-            else:
-                folder_or_files = "folder"  # whole folder should be added, don't filter files
-            
-            if cutoff_date:
-                print(f"--> Filtering files based on cutoff date: {cutoff_date}")
-                print(" ".join(["--> Files created", "after" if after_date is True else "before", "cutoff date will be added to dataset"]))
-
-            if check_version:
-                print("--> Current versions of files will be added to dataset")
-            else:
-                print(f"--> Only version {default_version} files will be added to dataset.\n--> If mixed file versions are expected, pass '-c 0' at runtime.")
-            
-            scope_files = filter_files_in_folder(syn, scope_id, formats, folder_or_files, cutoff_date, after_date, check_version, default_version)
-            if files_to_remove is not None:
-                files_to_remove_df = pd.read_csv(files_to_remove, header=0)
-                files_to_remove_list = files_to_remove_df["files"].tolist()
-                scope_files = [synId for synId in scope_files if synId["entityId"] not in files_to_remove_list]
-                print(f"--> Requested files removed from scope!")
-            print(f"--> Scope processing complete!")
-            
-            if len(scope_files) > file_max:
-                new_dataset_count = (len(scope_files) // file_max)
-                dataset_total = dataset_total + new_dataset_count
-                multi_dataset = True
-                update_dsp_sheet = True
-                create_dataset = True
-                print(
-                    f"--> File count exceeds file max (n={file_max}). {new_dataset_count} Datasets will be created.\n--> {len(scope_files)} files from {scope_id} will be added to a total of {dataset_total} Datasets."
-                )
-                file_scope_list = chunk_files_for_dataset(scope_files, file_max, new_dataset_count)
-                
-            else:
-                file_scope_list = [scope_files]  # single dataset, no chunking needed
-
-            if dataset_id:
-                dataset = syn.get(dataset_id, downloadFile=False)
-                dataset_id_list.append(dataset.id)
-                dataset_name_list.append(dataset.name)
-                dataset.add_items(dataset_items=file_scope_list[0], force=True)
-                syn.store(dataset)
-                print(f"--> {len(file_scope_list[0])} files added to existing Dataset {dataset.id}")
-                file_scope_list = file_scope_list[1:]  # remove first item, already added
-            else:
-                create_dataset = True
-                update_dsp_sheet = True
-
-            if create_dataset:
-                for scope in file_scope_list:
-                    dataset = create_dataset_entity(syn, dataset_name, grant_id, multi_dataset, scope)
-                    print(f"--> {len(scope)} files added to new Dataset {dataset.id}")
-                    dataset_id_list.append(dataset.id)
-                    dataset_name_list.append(dataset.name)
-                    dataset_total += 1
-            
-            count += 1
-
-            dataset_tuples = zip(dataset_id_list, dataset_name_list)
-
-            if update_dsp_sheet is not None:
-                print(f"Adding information for {dataset_total - 1} Datasets ")
-                for populated_dataset_id, name in dataset_tuples:
-                    temp_df = dsp_df.copy()
-                    temp_df.iloc[[_]] = row
-                    temp_df.at[_, "DatasetView Key"] = populated_dataset_id
-                    temp_df.at[_, "DSP Dataset Name"] = name
-                    updated_df = pd.concat([updated_df, temp_df], ignore_index=True)
-            updated_df.drop_duplicates(subset=["DatasetView Key"], keep="last", inplace=True)
+    if apply_file is not None:
+        plan = load_plan(apply_file, "build_datasets")
+        plan_path = apply_file
+        new_name = plan["context"]["new_name"]
+        print(f"\nApplying Dataset plan {apply_file}")
 
     else:
-        print(
-            f"❗❗❗ The table provided does not appear to be a Dataset Sharing Plan.❗❗❗\nPlease check its contents and try again."
-        )
-        exit()
-    
+        if dsp is None:
+            print("❗❗❗ A Data Sharing Plan (-d) is required unless a plan is applied with --apply.")
+            exit()
+        elif os.path.exists(dsp):
+            dsp_df = pd.read_csv(dsp, keep_default_na=False, header=0)
+            print("\nData Sharing Plan read successfully!")
+        elif "syn" in dsp:
+            dsp_df = get_table(syn, dsp)
+            print(f"Data Sharing Plan acquired from Synapse table {dsp}!")
+        else:
+            print(
+                f"❗❗❗ {dsp} is not a valid Data Sharing Plan identifier. Please check your inputs and try again."
+            )
+            exit()
+
+        if dsp_df.iat[0, 0] != "DataDSP":
+            print(
+                f"❗❗❗ The table provided does not appear to be a Dataset Sharing Plan.❗❗❗\nPlease check its contents and try again."
+            )
+            exit()
+
+        files_to_remove_list = pd.read_csv(files_to_remove, header=0)["files"].tolist() if files_to_remove is not None else None
+        operations = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(plan_dsp_row, syn, row_index, row, filter_by_date, after_date, check_version, default_version, files_to_remove_list, view_id, file_max)
+                for row_index, (_, row) in enumerate(dsp_df.iterrows())
+            ]
+            for future in futures:  # collect plans in DSP order
+                row_plan = future.result()
+                print("\n".join(row_plan["messages"]))
+                operations.extend(row_plan["operations"])
+
+        context = {
+            "dsp_columns": dsp_df.columns.tolist(),
+            "dsp_rows": dsp_df.to_dict("records"),
+            "new_name": new_name,
+        }
+        plan = build_plan("build_datasets", operations, context)
+
+        if plan_file is not None:
+            write_plan(plan, plan_file)
+            print(f"\nNo changes made. Apply the plan with --apply {plan_file}")
+            return
+        plan_path = get_default_plan_path("build_datasets")
+
+    results, failed = run_plan(syn, plan, DATASET_HANDLERS, plan_path, workers)
+    updated_df, update_dsp_sheet = build_updated_dsp(plan, results)
+    count = len({op["params"]["row"] for op in plan["operations"]})
+
     print(f"\n\nDONE ✅\n{count} DSP entries processed")
 
-    if update_dsp_sheet is not None:
+    if update_dsp_sheet:
         dsp_path = f"{os.getcwd()}/{new_name}.csv"
         updated_df.to_csv(path_or_buf=dsp_path, index=False)
         print(f"\nDSP sheet has been updated\nPath: {dsp_path}")
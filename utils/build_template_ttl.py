@@ -4,12 +4,23 @@ build_template_ttl.py
 Converts a metadata template CSV info to a ttl file defining the template.
 ttl file can be used as input for the arachne agent and would be available as a target.
 
-usage: build_template_ttl.py [-h] [-t TEMPLATE] [-o OUTPUT] [-g ORG_NAME] [-b BASE_TAG] [-r BASE_REF] [-v VERSION] [-bg]
+Column identifiers are uuid5 values derived from org, template, version, column position and raw column name,
+so output is stable across runs and each column of each template version has its own identifier.
+In batch mode (-d), templates are compiled in parallel and templates whose inputs have not changed since the last build are skipped.
+
+usage: build_template_ttl.py [-h] [-t TEMPLATE] [-d TEMPLATE_DIR] [-e EXTENSION] [-w WORKERS] [-c] [-o OUTPUT] [-g ORG_NAME] [-b BASE_TAG] [-r BASE_REF] [-v VERSION] [-bg]
 
 options:
   -h, --help            show this help message and exit
   -t TEMPLATE, --template TEMPLATE
                         Path to metadata template in tabular format (Default: None)
+  -d TEMPLATE_DIR, --template_dir TEMPLATE_DIR
+                        Path to a folder of metadata templates to compile in one batch (Default: None)
+  -e EXTENSION, --extension EXTENSION
+                        File extension of templates to select from the template folder (Default: 'csv')
+  -w WORKERS, --workers WORKERS
+                        Maximum number of templates compiled in parallel in batch mode (Default: number of CPUs)
+  -c, --combined        Boolean. Pass this flag in batch mode to also write all template TTLs to a single file (Default: None)
   -o OUTPUT, --output OUTPUT
                         Path to folder where graph should be stored (Default: current directory)
   -g ORG_NAME, --org_name ORG_NAME
@@ -26,16 +37,16 @@ author: orion.banks
 """
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 import io
 import os
-import pandas as pd
-import pydot
-import rdflib
 
+from model_cache import hash_file, load_model
 from pathlib import Path
-from PIL import Image
-from rdflib.tools import rdf2dot
-from uuid import uuid4
+from uuid import NAMESPACE_URL, UUID, uuid5
+
+TEMPLATE_TTL_VERSION = 1  # increase when the TTL written for a template changes, so unchanged templates are rebuilt
 
 def get_args():
 	"""Set up command-line interface and get arguments."""
@@ -46,6 +57,38 @@ def get_args():
         type=str,
         help="Path to metadata template in tabular format (Default: None)",
         required=False
+    )
+	parser.add_argument(
+        "-d",
+		"--template_dir",
+        type=str,
+        help="Path to a folder of metadata templates to compile in one batch (Default: None)",
+        required=False,
+		default=None
+    )
+	parser.add_argument(
+        "-e",
+		"--extension",
+        type=str,
+        help="File extension of templates to select from the template folder (Default: 'csv')",
+        required=False,
+		default="csv"
+    )
+	parser.add_argument(
+        "-w",
+		"--workers",
+        type=int,
+        help="Maximum number of templates compiled in parallel in batch mode (Default: number of CPUs)",
+        required=False,
+		default=None
+    )
+	parser.add_argument(
+        "-c",
+		"--combined",
+        help="Boolean. Pass this flag in batch mode to also write all template TTLs to a single file (Default: None)",
+		action="store_true",
+        required=False,
+		default=None
     )
 	parser.add_argument(
         "-o",
@@ -103,18 +146,76 @@ def format_uri(column_name):
 	return column_name.strip().lower().replace(" ", "_")
 
 
-def main():
-	
-	args = get_args()
+def build_graph_image(ttl_path, image_path):
+	"""Parse a template TTL and render it as a PNG.
+	Graph dependencies are imported here so they are only loaded when -bg is passed."""
+
+	import pydot
+	import rdflib
+	from PIL import Image
+	from rdflib.tools import rdf2dot
+
+	model_graph = rdflib.Graph().parse(ttl_path, format="turtle")
+	dot_stream = io.StringIO()
+	rdf2dot.rdf2dot(model_graph, dot_stream)
+	dot_string = dot_stream.getvalue()
+	dg = pydot.graph_from_dot_data(dot_string)
+	dg[0].write_png(image_path)
+	image = Image.open(image_path)
+	image.show()
+	print(f"Success! Graph visualization is available at {image_path}")
+
+
+def get_template_output(template_path: str, output: str, org_name: str, version: str) -> tuple[str, str, str]:
+	"""Derive the template name, version and output TTL path for a template file.
+	GC data loading templates carry their name and version in the file name."""
+
+	template_name = Path(template_path).stem
+
+	if template_name.startswith("GC_Data_Loading_Template"):
+		template_name_split = template_name.split("_")
+		template_name = template_name_split[-2]
+		version = template_name_split[-1]
+
+	out_file = "/".join([output, f"{org_name}_{template_name}_{version}.ttl"])
+
+	return template_name, version, out_file
 
-	base_tag = args.base_tag
-	base_ref = args.base_ref
-	build_graph = args.build_graph
 
-	org_tag = args.org_name
+def get_column_uuid(org_name: str, template_name: str, version: str, col_position: int, col: str) -> UUID:
+	"""Return a deterministic identifier for a template column, so rebuilds produce identical TTL.
+	Version, position and raw column name are included, so columns that clean to the same name,
+	or the same column in another template version, do not share a position node."""
+
+	return uuid5(NAMESPACE_URL, "/".join([org_name, template_name, version, str(col_position), col]))
+
+
+def hash_template_inputs(template_path: str, settings: tuple[str, ...]) -> str:
+	"""Hash a template file together with the settings that affect its TTL."""
+
+	salt = "|".join([str(TEMPLATE_TTL_VERSION)] + [str(setting) for setting in settings])
+
+	return hashlib.sha256(f"{salt}|{hash_file(template_path)}".encode("utf-8")).hexdigest()
+
+
+def write_template_ttl(template_path: str, output: str, org_name: str, base_tag: str, base_ref: str, version: str, skip_unchanged: bool = False) -> tuple[str, int | None]:
+	"""Write the TTL definition of one metadata template.
+	A hash of the template and settings is stored next to the TTL. With skip_unchanged,
+	templates whose hash matches the stored one are not rebuilt.
+	Args:
+		template_path (str): Path to metadata template in tabular format.
+		output (str): Path to folder where the TTL should be stored.
+		org_name (str): Abbreviation for org, used in RDF prefixes.
+		base_tag (str): The tag that will be used as a prefix in RDF.
+		base_ref (str): The prefix that will be used to represent the base_tag.
+		version (str): Version applied to output ttl filename.
+		skip_unchanged (bool): Skip templates whose inputs have not changed since the last build.
+	Returns:
+		tuple[str, int | None]: Output TTL path and number of columns written, None if the template was skipped."""
+
+	org_tag = org_name
 	conform_tag = "conformsTo"
 	int_tag = "integer"
-	version = args.version
 	template_tag = "Template"
 	col_tag = "hasColumn"
 	pos_tag = "ColumnPosition"
@@ -138,23 +239,19 @@ def main():
 		value_tag : (base_ref, f"<{base_tag}/>"),
 		def_val_tag: (base_ref, f"<{base_tag}/>")
 		}
-	
-	if args.template:
-		print(f"Processing model [{args.template}] to template.ttl...")
-		template_path = Path(args.template)
-		template_name = template_path.stem
-		sep = "," if template_path.suffix == ".csv" else "\t" 
-		template_df = pd.read_csv(args.template, header=0, keep_default_na=True, sep=sep)
 
-	if template_name.startswith("GC_Data_Loading_Template"):
-		template_name_split = template_name.split("_")
-		template_name = template_name_split[-2]
-		version = template_name_split[-1]
+	template_name, version, out_file = get_template_output(template_path, output, org_name, version)
+	hash_file_path = f"{out_file}.sha256"
+	input_hash = hash_template_inputs(template_path, (org_name, base_tag, base_ref, version))
 
-	out_file = "/".join([args.output, f"{args.org_name}_{template_name}_{version}.ttl"])
+	if skip_unchanged and os.path.exists(out_file) and os.path.exists(hash_file_path):
+		with open(hash_file_path, "r") as f:
+			if f.read().strip() == input_hash:
+				return out_file, None
+
+	template_columns = list(load_model(template_path)["attributes"])
 
 	with open(out_file, "w+") as f:
-		print(f"Building RDF triples and serializing to TTL...")
 		prefix_set = [prefix for prefix in tag_dict.keys()]
 		first_lines = [f"@prefix {tag_dict[prefix][0]}: {tag_dict[prefix][1]}"+" .\n" for prefix in prefix_set]
 		template_name_tag = f"@prefix {template_name}: <{tag_dict[template_tag][0]}:{template_name}/>"+" .\n\n"
@@ -169,9 +266,9 @@ def main():
 		# write column definitions
 		# set col position counter
 		col_position = 0
-		for col in template_df.columns:
+		for col in template_columns:
 			clean_col = format_uri(col)
-			col_uuid = uuid4()
+			col_uuid = get_column_uuid(org_name, template_name, version, col_position, col)
 			if col in ["Component", "type"]:
 				f.write(f'{template_name}:{clean_col} {tag_dict[def_val_tag][0]}:{def_val_tag} "{template_name}" .'+"\n")
 			f.write(f"{tag_dict[template_tag][0]}:{template_name} {tag_dict[col_tag][0]}:{col_tag} {template_name}:{clean_col} ."+"\n")
@@ -181,22 +278,74 @@ def main():
 			f.write("\t"+f'{tag_dict[header_tag][0]}:{header_tag} "{clean_col}" ;'+"\n")
 			f.write("\t"+f'{tag_dict[value_tag][0]}:{value_tag} "{col_position}"^^{tag_dict[int_tag][0]}:{int_tag} .'+"\n")
 			col_position += 1
+
+	with open(hash_file_path, "w+") as f:
+		f.write(input_hash)
+
+	return out_file, col_position
+
+
+def build_template_batch(template_paths: list[str], output: str, org_name: str, base_tag: str, base_ref: str, version: str, workers: int | None = None) -> list[tuple[str, str, int | None]]:
+	"""Write TTL definitions for many templates in parallel, skipping templates that have not changed.
+	Returns:
+		list[tuple[str, str, int | None]]: (template path, output TTL path, columns written or None if skipped), in input order."""
+
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		futures = [
+			executor.submit(write_template_ttl, template_path, output, org_name, base_tag, base_ref, version, True)
+			for template_path in template_paths
+		]
+		results = [(template_path, *future.result()) for template_path, future in zip(template_paths, futures)]
+
+	return results
+
+
+def write_combined_ttl(ttl_paths: list[str], combined_path: str) -> None:
+	"""Concatenate template TTLs into a single file."""
+
+	with open(combined_path, "w+") as combined:
+		for ttl_path in ttl_paths:
+			with open(ttl_path, "r") as f:
+				combined.write(f.read())
+
+
+def main():
 	
-	print(f"Done ✅")
-	print(f"{out_file} was written with {col_position} attributes!")
-
-	if build_graph is not None:
-		g = rdflib.Graph()
-		model_graph = g.parse(out_file, format="turtle")
-		image_path = "/".join([args.output, f"{args.org_name}_{template_name}_{version}.png"])
-		dot_stream = io.StringIO()
-		rdf2dot.rdf2dot(model_graph, dot_stream)
-		dot_string = dot_stream.getvalue()
-		dg = pydot.graph_from_dot_data(dot_string)
-		dg[0].write_png(image_path)
-		image = Image.open(image_path)
-		image.show()
-		print(f"Success! Graph visualization is available at {image_path}")
+	args = get_args()
+
+	if args.template_dir:
+		template_paths = sorted([str(path) for path in Path(args.template_dir).glob(f"*.{args.extension}") if path.is_file()])
+		print(f"Processing {len(template_paths)} templates from [{args.template_dir}] to template.ttl files...")
+		results = build_template_batch(template_paths, args.output, args.org_name, args.base_tag, args.base_ref, args.version, args.workers)
+		for template_path, out_file, col_count in results:
+			if col_count is None:
+				print(f"--> {template_path} unchanged, kept {out_file}")
+			else:
+				print(f"--> {out_file} was written with {col_count} attributes!")
+		built = [out_file for _, out_file, col_count in results if col_count is not None]
+		print(f"Done ✅\n{len(built)} templates built, {len(results) - len(built)} unchanged templates skipped")
+		if args.combined:
+			combined_path = "/".join([args.output, f"{args.org_name}_{args.version}_all_templates.ttl"])
+			write_combined_ttl([out_file for _, out_file, _ in results], combined_path)
+			print(f"{combined_path} was written with {len(results)} templates!")
+		graph_files = built
+
+	elif args.template:
+		print(f"Processing model [{args.template}] to template.ttl...")
+		print(f"Building RDF triples and serializing to TTL...")
+		out_file, col_count = write_template_ttl(args.template, args.output, args.org_name, args.base_tag, args.base_ref, args.version)
+		print(f"Done ✅")
+		print(f"{out_file} was written with {col_count} attributes!")
+		graph_files = [out_file]
+
+	else:
+		print("❗❗❗ Please provide a template (-t) or a folder of templates (-d).")
+		exit()
+
+	if args.build_graph is not None:
+		for out_file in graph_files:
+			image_path = f"{os.path.splitext(out_file)[0]}.png"
+			build_graph_image(out_file, image_path)
 		
 
 if __name__ == "__main__":
@@ -3,22 +3,39 @@
 This script uses the unpaywall APIs (https://unpaywall.org/products/api)
 to check for Open-Access statuses of previously paywalled publications
 and returns information of previously inaccessible publications as CSV.
+
+DOIs are checked concurrently, and the result of each check is kept in a
+local history file. A DOI that is still closed is only checked again after
+a wait that doubles with each closed result (--recheck_days, up to
+MAX_RECHECK_DAYS), so most DOIs are not requested on every run.
+With --sync_history, the history file is downloaded from the results folder
+before the run and uploaded to it afterwards, so runs on fresh machines
+(e.g. the monthly workflow) share it.
 """
 
 import os
 import sys
 import argparse
+import asyncio
 import json
-from datetime import datetime
-import requests
+import shutil
+from datetime import datetime, timedelta
+import httpx
+import http_client
 
-import pandas as pd
 import synapseclient
 from synapseclient import File
 
 sys.path.insert(0, "./annotations")
 from attribute_dictionary import PUBLICATION_DICT
 
+UNPAYWALL_URL = "https://api.unpaywall.org/v2"
+HISTORY_FILE_NAME = "mc2_unpaywall_history.json"  # name of the history file in the results folder
+DEFAULT_HISTORY = os.path.join(os.path.expanduser("~"), ".cache", HISTORY_FILE_NAME)
+DEFAULT_CONCURRENCY = 10  # Unpaywall requests in flight at the same time
+DEFAULT_RECHECK_DAYS = 7  # wait before checking a closed DOI again, doubled for each closed result
+MAX_RECHECK_DAYS = 90  # longest wait before checking a closed DOI again
+
 
 def get_args():
     """Set up command-line interface and get arguments."""
@@ -52,35 +69,161 @@ def get_args():
     parser.add_argument(
         "--send_email", type=str, nargs="+", help="Send email report to listed persons."
     )
+    parser.add_argument(
+        "--history",
+        type=str,
+        default=DEFAULT_HISTORY,
+        help="Path to JSON file recording when each DOI was last checked. "
+        f"(Default: {DEFAULT_HISTORY})",
+    )
+    parser.add_argument(
+        "--sync_history",
+        action="store_true",
+        default=None,
+        help="Boolean. If provided, the history file is downloaded from --folder_id "
+        "before checking and uploaded to it afterwards. (Default: None)",
+    )
+    parser.add_argument(
+        "--recheck_days",
+        type=int,
+        default=DEFAULT_RECHECK_DAYS,
+        help="Days to wait before checking a closed DOI again, doubled for each "
+        f"closed result, up to {MAX_RECHECK_DAYS}. 0 checks every DOI. "
+        f"(Default: {DEFAULT_RECHECK_DAYS})",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"Number of Unpaywall requests made at the same time. (Default: {DEFAULT_CONCURRENCY})",
+    )
     return parser.parse_args()
 
 
-def status_check(syn, query, colname, email, publication_dict):
+def load_check_history(history_path):
+    """Read the DOI check history, a dictionary of DOI: last check."""
+    if not os.path.exists(history_path):
+        return {}
+    with open(history_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_check_history(history, history_path):
+    """Write the DOI check history to a JSON file."""
+    os.makedirs(os.path.dirname(os.path.abspath(history_path)), exist_ok=True)
+    temp_path = f"{history_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(history, f, indent=1, sort_keys=True)
+    os.replace(temp_path, history_path)
+
+
+def download_check_history(syn, folder_id, history_path):
+    """Copy the history file stored in a Synapse folder to history_path, if there is one."""
+    entity_id = syn.findEntityId(name=HISTORY_FILE_NAME, parent=folder_id)
+    if entity_id is None:
+        print(f"No {HISTORY_FILE_NAME} in {folder_id}, every DOI will be checked.")
+        return
+    history_file = syn.get(entity_id)
+    os.makedirs(os.path.dirname(os.path.abspath(history_path)), exist_ok=True)
+    shutil.copyfile(history_file.path, history_path)
+
+
+def upload_check_history(syn, folder_id, history_path):
+    """Store the history file in a Synapse folder, as a new version if it is already there."""
+    history_file = File(history_path, name=HISTORY_FILE_NAME, parent=folder_id)
+    return syn.store(history_file).id
+
+
+def is_check_due(entry, now, recheck_days):
+    """Return True if a DOI should be checked on this run.
+    DOIs never checked, or open at their last check, are always checked."""
+    if not entry or entry.get("is_oa") or not recheck_days:
+        return True
+    wait_days = min(recheck_days * 2 ** (entry["closed_checks"] - 1), MAX_RECHECK_DAYS)
+    return datetime.fromisoformat(entry["checked"]) + timedelta(days=wait_days) <= now
+
+
+async def check_doi(client, semaphore, doi, email):
+    """
+    Check the Open-Access status of one DOI with Unpaywall. Throttled
+    requests, server errors and connection failures are retried by http_client.
+    Return True if open, False if closed or unknown to Unpaywall,
+    None if the check failed.
+    """
+    async with semaphore:
+        try:
+            response = await http_client.aget(
+                client, f"{UNPAYWALL_URL}/{doi}", params={"email": email}
+            )
+        except httpx.TransportError:
+            return None
+    if response.status_code in http_client.RETRY_STATUS:
+        return None
+    try:
+        response.raise_for_status()
+        return bool(response.json().get("is_oa"))
+    except (httpx.HTTPStatusError, json.JSONDecodeError):
+        # Assumption: DOI does not exist yet; treat as closed.
+        return False
+
+
+async def check_dois(dois, email, concurrency=DEFAULT_CONCURRENCY):
+    """Check a list of DOIs with Unpaywall concurrently, return a DOI: status dictionary."""
+    semaphore = asyncio.Semaphore(concurrency)
+    async with http_client.new_async_client() as client:
+        statuses = await asyncio.gather(
+            *[check_doi(client, semaphore, doi, email) for doi in dois]
+        )
+    return dict(zip(dois, statuses))
+
+
+def update_check_history(history, statuses, now):
+    """Record completed checks in the history. Failed checks are not recorded."""
+    for doi, is_open in statuses.items():
+        if is_open is None:
+            continue
+        closed_checks = history.get(doi, {}).get("closed_checks", 0)
+        history[doi] = {
+            "checked": now.isoformat(timespec="seconds"),
+            "is_oa": is_open,
+            "closed_checks": 0 if is_open else closed_checks + 1,
+        }
+
+
+def status_check(
+    syn,
+    query,
+    colname,
+    email,
+    publication_dict,
+    history_path=DEFAULT_HISTORY,
+    recheck_days=DEFAULT_RECHECK_DAYS,
+    concurrency=DEFAULT_CONCURRENCY,
+):
     """
     Check availability of publications and return df of open/accessible
     publications and their current annotations on the portal.
     """
     df = syn.tableQuery(query).asDataFrame()
-    doi_list = df[~df[colname].isnull()]["doi"]
-    ready_for_review = []
-    with requests.Session() as session:
-        for doi in doi_list:
-            unpaywall_url = f"https://api.unpaywall.org/v2/{doi}?email={email}"
-            try:
-                check_oa_status = session.get(unpaywall_url)
-                check_oa_status.raise_for_status()
-                is_open = json.loads(check_oa_status.content).get("is_oa")
-                if is_open:
-                    row = df[df[colname] == doi]
-                    row.loc[row.index, "accessibility"] = "Open Access"
-                    ready_for_review.append(row)
-            except (requests.exceptions.HTTPError, json.JSONDecodeError):
-                # Assumption: DOI does not exist yet; skip.
-                pass
-    if ready_for_review:
-        ready_for_review = pd.concat(ready_for_review)
-    else:
-        ready_for_review = pd.DataFrame(columns=df.columns)
+    doi_keys = df[colname].where(df[colname].isnull(), df[colname].astype(str).str.strip())
+    doi_list = doi_keys.dropna().unique().tolist()
+
+    history = load_check_history(history_path)
+    now = datetime.now()
+    to_check = [doi for doi in doi_list if is_check_due(history.get(doi), now, recheck_days)]
+    print(f"Checking {len(to_check)} of {len(doi_list)} DOIs with Unpaywall...")
+
+    statuses = asyncio.run(check_dois(to_check, email, concurrency))
+    update_check_history(history, statuses, now)
+    write_check_history(history, history_path)
+
+    failed = [doi for doi, is_open in statuses.items() if is_open is None]
+    if failed:
+        print(f"{len(failed)} DOIs could not be checked and will be checked next run.")
+
+    open_dois = {doi for doi, is_open in statuses.items() if is_open}
+    ready_for_review = df[doi_keys.isin(open_dois)].copy()
+    ready_for_review["accessibility"] = "Open Access"
 
     # Switch column name dictionary key/value pairs
     column_names = {value: key for key, value in publication_dict.items()}
@@ -119,7 +262,22 @@ def main():
         f"WHERE accessibility = 'Restricted Access'"
     )
     email = "mc2center@sagebase.org"
-    ready_for_review = status_check(syn, query, args.colname, email, PUBLICATION_DICT)
+    if args.sync_history:
+        download_check_history(syn, args.folder_id, args.history)
+    ready_for_review = status_check(
+        syn,
+        query,
+        args.colname,
+        email,
+        PUBLICATION_DICT,
+        args.history,
+        args.recheck_days,
+        args.concurrency,
+    )
+
+    if args.sync_history:
+        history_id = upload_check_history(syn, args.folder_id, args.history)
+        print(f"Check history ID: {history_id}")
 
     file_id = upload_results(syn, ready_for_review, args.folder_id)
     print(f"Results ID: {file_id}")
@@ -1,6 +1,5 @@
 import argparse
 import pandas as pd
-import re
 
 
 def get_args():
@@ -20,35 +19,26 @@ def get_args():
 
 def extract_for_filtering(report_df):
 
-    column_info = [("grant", "CA\d{6}", "project_num"), ("year", "(?:-(\d{2}))", "project_num")]
-    for tup in column_info:
-        col_name = "_".join([tup[0], "num"])
-        extract_name = "_".join([tup[0], "extracted"])
-        pattern = re.compile(tup[1])
-        report_df[col_name] = ""
-        for _, row in report_df.iterrows():
-            extract_name = []
-            extract = pattern.findall(row[tup[2]])
-            extract_name.append(extract[0])
-            report_df.at[_, col_name] = extract_name[0]
+    column_info = [("grant", r"(CA\d{6})", "project_num"), ("year", r"-(\d{2})", "project_num")]
+    for name, pattern, source_col in column_info:
+        col_name = "_".join([name, "num"])
+        report_df[col_name] = report_df[source_col].str.extract(pattern, expand=False)
+
     return report_df
 
 
 def filter_report(report):
 
-    groups = report.groupby(["grant_num", "year_num"], as_index=False)
-    max_year_table = report.loc[
-        report.groupby(["grant_num"])["year_num"].idxmax()
-    ].sort_values(by=["grant_num", "year_num"])
-    entries_to_keep = []
-    for _, row in max_year_table.iterrows():
-        g = row["year_num"]
-        n = row["grant_num"]
-        for name, group in groups:
-            if name[0] == n and name[1] == g:
-                entries_to_keep.append(group)
-                print(f"{name} matches {n} and {g} - added to entry list")
-    filtered_report = pd.concat(entries_to_keep).reset_index(drop=True).drop_duplicates()
+    # Keep every entry from the most recent year of each grant
+    max_year = report.groupby("grant_num")["year_num"].transform("max")
+    filtered_report = (
+        report[report["year_num"] == max_year]
+        .sort_values(by=["grant_num", "year_num"], kind="stable")
+        .drop_duplicates()
+        .reset_index(drop=True)
+    )
+
+    print(f"Kept {len(filtered_report)} of {len(report)} entries, from {filtered_report['grant_num'].nunique()} grants")
 
     return filtered_report
 
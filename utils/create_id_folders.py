@@ -11,8 +11,13 @@ import synapseclient
 from synapseclient import Folder
 import synapseutils
 import argparse
+import os
 import pandas as pd
 import numpy as np
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from provisioning_plan import build_plan, get_default_plan_path, load_plan, new_operation, run_plan, write_plan  # noqa: E402
 
 
 def get_args():
@@ -29,6 +34,16 @@ def get_args():
         choices=["DatasetView", "EducationalResource", "PublicationView", "ToolView"],
         help="Type of manifest being submitted",
     )
+    parser.add_argument(
+        "--plan",
+        type=str,
+        help="Path to write the planned folders to. If provided, no changes are made in Synapse.",
+    )
+    parser.add_argument(
+        "--apply",
+        type=str,
+        help="Path to a plan written with --plan, or by an earlier run, to apply. Folders already created are skipped, so an interrupted run can be resumed.",
+    )
     return parser.parse_args()
 
 
@@ -55,24 +70,52 @@ def get_names(manifest, name_column):
     return path_name_target
 
 
-def add_folders(syn, path_name_target):
+def create_id_folder(syn, params):
+    """Plan handler: create and delete a folder, returning its Synapse ID."""
+
+    folder = Folder(params["name"], parent=params["target"])
+    folder = syn.store(folder)
+    syn.delete(folder.id)
 
-    paths, names, targets = zip(*path_name_target)
+    return {"id": folder.id}
 
-    path_name_id = []
 
-    for p, n, t in zip(paths, names, targets):
+def plan_folders(path_name_target, context):
+    """Plan a folder for each entry, with names cleaned for Synapse.
+    Entries with the same name and target folder are chained, so each one
+    creates and deletes its own folder and gets its own Synapse ID."""
 
-        n = n.translate(str.maketrans("", "", "[]:/!@#$<>"))
+    operations = []
+    last_op = {}  # (target, name): id of the last operation using that folder name
 
-        folder = Folder(n, parent=t)
-        folder = syn.store(folder)
-        id = folder.id
-        info = (p, n, id)
-        path_name_id.append(info)
-        syn.delete(id)
+    for i, (p, n, t) in enumerate(path_name_target):
+        name = n.translate(str.maketrans("", "", "[]:/!@#$<>"))
+        key = (str(t), name)
+        op_id = f"folder:{i}"
+        operations.append(
+            new_operation(
+                op_id,
+                "create_id_folder",
+                {"path": p, "name": name, "target": t},
+                [last_op[key]] if key in last_op else None,
+            )
+        )
+        last_op[key] = op_id
 
-    return path_name_id
+    return build_plan("create_id_folders", operations, context)
+
+
+def add_folders(syn, plan, plan_path):
+
+    results, failed = run_plan(syn, plan, {"create_id_folder": create_id_folder}, plan_path)
+
+    path_name_id = [
+        (op["params"]["path"], op["params"]["name"], results[op["id"]]["id"])
+        for op in plan["operations"]
+        if op["id"] in results
+    ]
+
+    return path_name_id, failed
 
 
 def add_ids_to_manifests(path_name_id, name_column, primary_key):
@@ -85,6 +128,7 @@ def add_ids_to_manifests(path_name_id, name_column, primary_key):
 
     for name, group in path_groups:
 
+        name = name[0]
         base_df = pd.read_csv(name, index_col=False, dtype=str)
         info_df = group[[f"{name_column}", f"{primary_key}"]]
         info_df = info_df.set_index(keys=np.arange(stop=len(info_df)))
@@ -100,28 +144,45 @@ def main():
 
     args = get_args()
 
-    manifest, data_type = args.m, args.t
+    manifest, data_type, plan_file, apply_file = args.m, args.t, args.plan, args.apply
+
+    if apply_file is not None:
+        plan = load_plan(apply_file, "create_id_folders")
+        plan_path = apply_file
+        data_type, name_column, primary_key = plan["context"]["data_type"], plan["context"]["name_column"], plan["context"]["primary_key"]
 
-    if data_type == "DatasetView":
+    else:
+        if data_type == "DatasetView":
 
-        name_column = "Dataset Name"
-        primary_key = "DatasetView_id"
+            name_column = "Dataset Name"
+            primary_key = "DatasetView_id"
 
-    elif data_type == "ToolView":
+        elif data_type == "ToolView":
 
-        name_column = "Tool Name"
-        primary_key = "ToolView_id"
+            name_column = "Tool Name"
+            primary_key = "ToolView_id"
 
-    elif data_type == "EducationalResource":
+        elif data_type == "EducationalResource":
 
-        name_column = "Resource Title"
-        primary_key = "EducationalResource_id"
+            name_column = "Resource Title"
+            primary_key = "EducationalResource_id"
 
-    print("Capturing information from " + data_type + " manifests...")
-    pnt = get_names(manifest, name_column)
+        print("Capturing information from " + data_type + " manifests...")
+        pnt = get_names(manifest, name_column)
+        plan = plan_folders(pnt, {"data_type": data_type, "name_column": name_column, "primary_key": primary_key})
+
+        if plan_file is not None:
+            write_plan(plan, plan_file)
+            print(f"No changes made. Apply the plan with --apply {plan_file}")
+            return
+        plan_path = get_default_plan_path("create_id_folders")
 
     print("Generating Synapse IDs for each set of " + data_type + " entries...")
-    pni = add_folders(syn, pnt)
+    pni, failed = add_folders(syn, plan, plan_path)
+
+    if failed:
+        print("Manifests were not updated, since some folders were not created.")
+        return
 
     print(
         "Adding Synapse IDs to "
@@ -6,7 +6,7 @@ Serializes triples to a ttl file - ttl file can be used as a graph input for the
 For schematic-based models, conditional dependencies are extracted and added to the data model graph.
 Optionally generates a data model diagram and an interactive model viewer (WIP)
 
-usage: csv_to_ttl.py [-h] [-m MODEL] [-p MAPPING] [-o OUTPUT] [-g ORG_NAME] [-r {schematic,crdc}] [-b BASE_TAG] [-f BASE_REF] [-v VERSION] [-s SUBSET] [-bg] [-ig]
+usage: csv_to_ttl.py [-h] [-m MODEL] [-p MAPPING] [-o OUTPUT] [-g ORG_NAME] [-r {schematic,crdc}] [-b BASE_TAG] [-f BASE_REF] [-v VERSION] [-s SUBSET] [-pg PREVIOUS_GRAPH] [-bg] [-gm {full,summary}] [-ig] [-np]
 
 options:
   -h, --help            show this help message and exit
@@ -30,27 +30,38 @@ options:
   -s SUBSET, --subset SUBSET
                         The name of one or more data types to extract from the model. Provide multiple as a quoted comma-separated list, e.g., 'Study, Biospecimen' (Default:
                         None)
+  -pg PREVIOUS_GRAPH, --previous_graph PREVIOUS_GRAPH
+                        Path to a TTL previously written by this script, next to its .nodes.json manifest of node hashes. Triples for nodes whose
+                        content hash is unchanged are copied from it, and
+                        added, removed and changed attributes are reported. If not provided, a previous build at the output path is used when
+                        available (Default: None)
   -bg, --build_graph    Boolean. Pass this flag to generate a PNG of the input model (Default: None)
+  -gm {full,summary}, --graph_mode {full,summary}
+                        Rendering mode for -bg. 'full' renders every triple in one graph. 'summary' renders an overview of components with
+                        attribute counts and key edges, plus one graph per component, rendered in parallel and cached by content hash (Default: 'full')
   -ig, --interactive_graph
                         Boolean. Pass this flag to generate an interactive visualization of the input model (Default: None)
+  -np, --no_parse       Boolean. Pass this flag to skip re-parsing the output TTL with rdflib when no graph output is requested (Default: None)
 
 author: orion.banks
 """
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import io
-from IPython.display import display, Image
-import matplotlib.pyplot as plt
-import networkx as nx
+import json
 import os
+from model_cache import load_model
 import pandas as pd
-from pathlib import Path
-from PIL import Image
-import pydotplus
-import rdflib
-from rdflib.extras.external_graph_libs import rdflib_to_networkx_multidigraph
-from rdflib.tools import rdf2dot
 import re
+import shutil
+import subprocess
+import time
+
+# rdflib and graph visualization libraries are imported in the functions that use them
+
+TTL_MANIFEST_VERSION = 2  # increase when the TTL written for a node changes, so previous builds are not reused
 
 
 def get_args():
@@ -126,6 +137,14 @@ def get_args():
         help="The name of one or more data types to extract from the model. Provide multiple as a quoted comma-separated list, e.g., 'Study, Biospecimen' (Default: None)",
         required=False,
 		default=None
+    )
+	parser.add_argument(
+        "-pg",
+		"--previous_graph",
+        type=str,
+        help="Path to a TTL previously written by this script. Triples for nodes whose content hash is unchanged are reused from it, and added, removed and changed attributes are reported. If not provided, a previous build at the output path is used when available (Default: None)",
+        required=False,
+		default=None
     )
 	parser.add_argument(
         "-bg",
@@ -134,6 +153,15 @@ def get_args():
 		action="store_true",
         required=False,
 		default=None
+    )
+	parser.add_argument(
+        "-gm",
+		"--graph_mode",
+        type=str,
+		choices=["full", "summary"],
+        help="Rendering mode for -bg. 'full' renders every triple in one graph. 'summary' renders an overview of components with attribute counts and key edges, plus one graph per component, rendered in parallel and cached by content hash (Default: 'full')",
+        required=False,
+		default="full"
     )
 	parser.add_argument(
         "-ig",
@@ -142,6 +170,14 @@ def get_args():
 		action="store_true",
         required=False,
 		default=None
+    )
+	parser.add_argument(
+        "-np",
+		"--no_parse",
+        help="Boolean. Pass this flag to skip re-parsing the output TTL with rdflib when no graph output is requested (Default: None)",
+		action="store_true",
+        required=False,
+		default=None
     )
 	return parser.parse_args()
 
@@ -219,29 +255,32 @@ def convert_crdc_model_to_ttl_format(input_df: pd.DataFrame, org_name: str) -> t
 	Returns:
 		tuple[pd.DataFrame, list[str]]: Output TTL DataFrame and list of node names.
 	"""
-	out_df = pd.DataFrame()
-	
-	out_df["term"] = input_df.apply(
-		lambda row: format_uri(row["Node"], row["Property"]), axis=1)
+	out_df = pd.DataFrame(index=input_df.index)
+
+	nodes = input_df["Node"].astype(str)
+	enum_values = input_df["Acceptable Values"].fillna("")
+	is_enum = enum_values.str.contains(",", regex=False)  # more than one acceptable value
+	cde_names = input_df["CDEFullName"].astype(str)
+	cde_codes = input_df["CDECode"].fillna("")
+
+	out_df["term"] = format_uri_column(nodes) + ":" + format_uri_column(input_df["Property"].astype(str))
 	out_df["label"] = '"' + input_df["Property"].fillna('') + '"'
-	out_df["description"] = input_df["Description"].fillna("")
-	out_df["node"] = input_df["Node"].apply(
-		lambda x: f"{org_name}:{x.strip().lower().replace(' ', '_')}")
-	out_df["maps_to"] = input_df["CDECode"].fillna("").apply(lambda x: ":".join(["CDE", str(x).split(".")[0]]) if x not in ["", "TBD"] else "")
-	out_df["is_key"] = input_df["Key Property"].apply(lambda x: str(x)).replace(["FALSE", "True"], ["", "true"])
-	out_df["required_by"] = input_df["Required"].apply(lambda x: str(x))
-	out_df["type"] = input_df["Type"].apply(lambda x: str(x))
-	out_df["has_enum"] = input_df["Acceptable Values"].fillna("").apply(lambda x: x.split(","))
-	out_df["cde_name"] = input_df["CDEFullName"].apply(lambda x: str(x))
-	node_list = input_df["Node"].to_list()
+	out_df["node"] = f"{org_name}:" + nodes.str.strip().str.lower().str.replace(" ", "_", regex=False)
+	out_df["maps_to"] = ("CDE:" + cde_codes.astype(str).str.split(".").str[0]).where(~cde_codes.isin(["", "TBD"]), "")
+	out_df["is_key"] = input_df["Key Property"].astype(str).replace(["FALSE", "True"], ["", "true"])
+	out_df["required_by"] = out_df["node"].where(input_df["Required"].astype(str) == "required", "")
 
-	for _, row in out_df.iterrows():
-		col_type = row["type"]
-		is_enum = True if len(row["has_enum"]) > 1 else False
-		out_df.at[_, "type"] = '"' + str(convert_gc_column_type(col_type, is_enum)) + '"'
-		out_df.at[_, "required_by"] = row["node"] if row["required_by"] == "required" else ""
-		out_df.at[_, "has_enum"] = (''.join(['"[', ', '.join(row["has_enum"]).replace('"', '').replace('[', '').replace(']', ''), ']"'])) if is_enum else ""
-		out_df.at[_, "description"] = '"' + ''.join([f'{str(row["cde_name"])}: ' if str(row["cde_name"]) != "" else "", row["description"]]).replace('"', '') + '"'
+	# column types repeat heavily across properties, so convert each distinct (type, is_enum) pair once
+	type_pairs = pd.Series(list(zip(input_df["Type"].astype(str), is_enum)), index=input_df.index)
+	type_map = {pair: f'"{convert_gc_column_type(*pair)}"' for pair in set(type_pairs)}
+	out_df["type"] = type_pairs.map(type_map)
+
+	enum_strings = enum_values.str.replace(",", ", ", regex=False).str.replace(r'["\[\]]', "", regex=True)
+	out_df["has_enum"] = ('"[' + enum_strings + ']"').where(is_enum, "")
+
+	description_prefix = (cde_names + ": ").where(cde_names != "", "")
+	out_df["description"] = '"' + (description_prefix + input_df["Description"].fillna("")).str.replace('"', '', regex=False) + '"'
+	node_list = input_df["Node"].to_list()
 
 	final_cols = ["term", "label", "description", "node", "type", "required_by", "maps_to", "is_key", "has_enum"]
 	return out_df[final_cols], node_list
@@ -261,6 +300,17 @@ def format_uri(node:str, attribute:str) -> str:
 	return f"{node_segment}:{attr_segment}"
 
 
+def format_uri_column(values: pd.Series) -> pd.Series:
+	"""Format a column of node or attribute names as URI segments.
+	Column-wise equivalent of the segment formatting in format_uri.
+	Args:
+		values (pd.Series): Node or attribute names.
+	Returns:
+		pd.Series: Formatted URI segments."""
+
+	return values.str.strip().str.lower().str.replace(" ", "_", regex=False).str.replace("10x_", "", regex=False)
+
+
 def convert_schematic_column_type(type:str, validation: str, is_enum:bool) -> str: 
 	"""Convert schematic column type to TTL-compatible format.
 	Args:
@@ -356,6 +406,371 @@ def subset_model(model_df: pd.DataFrame, nodes: str) -> pd.DataFrame:
 	return node_subset_df
 
 
+def parse_ttl_graph(ttl_path: str):
+	"""Parse a TTL file into an rdflib Graph.
+	Args:
+		ttl_path (str): Path to the TTL file.
+	Returns:
+		rdflib.Graph: The parsed graph."""
+
+	import rdflib
+
+	return rdflib.Graph().parse(ttl_path, format="turtle")
+
+
+def build_graph_image(model_graph, base_tag: str, image_path: str) -> None:
+	"""Render a PNG of the model graph with graphviz dot and open it.
+	acceptableValues triples are dropped to keep the rendering manageable.
+	If rendering fails, the DOT string is written to graph_string_error.txt.
+	Args:
+		model_graph (rdflib.Graph): The parsed model graph.
+		base_tag (str): url applied to the beginning of internal tags.
+		image_path (str): Path where the PNG should be written."""
+
+	import pydotplus
+	import rdflib
+	from PIL import Image
+	from rdflib.tools import rdf2dot
+
+	retry = 1
+	image = None
+	while image is None:
+		if retry > 0:
+			value_tag = rdflib.URIRef(f"{base_tag}/acceptableValues")
+			model_graph = model_graph.remove((None, value_tag, None))
+		dot_stream = io.StringIO()
+		rdf2dot.rdf2dot(model_graph, dot_stream)
+		dot_string = dot_stream.getvalue()
+		graph = pydotplus.graph_from_dot_data(dot_string)
+		try:
+			graph.write_png(image_path, prog="dot")
+			image = Image.open(image_path)
+			image.show()
+			print(f"Success! Graph visualization is available at {image_path}")
+			image = True
+		except:
+			print("Failed to generate a visualization of the graph. Retrying with fewer triples...")
+			retry += 1
+			if retry == 2:
+				print("Failed to generate a visualization of the graph. Skipping.")
+				with open("graph_string_error.txt", "w+") as f:
+					f.write(graph.to_string())
+				break
+
+
+def summarize_components(ttl_df: pd.DataFrame) -> pd.DataFrame:
+	"""Count attributes per component in the TTL precursor DataFrame.
+	Args:
+		ttl_df (pd.DataFrame): Output TTL DataFrame.
+	Returns:
+		pd.DataFrame: One row per component node URI with attribute, required, key and enum counts."""
+
+	counts = pd.DataFrame({
+		"node": ttl_df["node"],
+		"attributes": 1,
+		"required": (ttl_df["required_by"] != "").astype(int),
+		"keys": (ttl_df["is_key"] == "true").astype(int),
+		"enums": (~ttl_df["has_enum"].isin(["", '"[]"'])).astype(int),
+	})
+
+	return counts.groupby("node", sort=True).sum()
+
+
+def get_component_edges(key_tuple_list: list[tuple[str, str, str]] | None, org_name: str, components: set[str]) -> set[tuple[str, str, str]]:
+	"""Collect key relationships between components.
+	Args:
+		key_tuple_list (list[tuple[str, str, str]] | None): Key tuples from convert_schematic_model_to_ttl_format.
+		org_name (str): Organization name for URI formatting.
+		components (set[str]): Component node URIs present in the model.
+	Returns:
+		set[tuple[str, str, str]]: Edges as (component with the key attribute, referenced component, attribute term)."""
+
+	edges = set()
+	if key_tuple_list is None:
+		return edges
+
+	for primary, schema, foreign in key_tuple_list:
+		if "id" in primary.split("_"):
+			target = f"{org_name}:{str(primary).split('_')[0].lower()}"
+			if schema in components and target in components and schema != target:
+				edges.add((schema, target, foreign))
+
+	return edges
+
+
+def format_dot_label(value: str) -> str:
+	"""Strip TTL quoting from a value and escape it for use in a DOT label."""
+
+	return str(value).strip('"').replace("\\", "\\\\").replace('"', '\\"')
+
+
+def build_summary_dot(summary_df: pd.DataFrame, edges: set[tuple[str, str, str]]) -> str:
+	"""Build a DOT graph with one node per component and one edge per key relationship.
+	Args:
+		summary_df (pd.DataFrame): Output of summarize_components.
+		edges (set[tuple[str, str, str]]): Output of get_component_edges.
+	Returns:
+		str: DOT string."""
+
+	lines = ["digraph model {", "\trankdir=LR;", '\tnode [shape=box, style=rounded, fontname="Helvetica"];']
+	for node, row in summary_df.iterrows():
+		label = "\\n".join([
+			format_dot_label(node),
+			f"{row['attributes']} attributes ({row['required']} required)",
+			f"{row['keys']} keys, {row['enums']} with valid values",
+		])
+		lines.append(f'\t"{format_dot_label(node)}" [label="{label}"];')
+	for source, target, term in sorted(edges):
+		lines.append(f'\t"{format_dot_label(source)}" -> "{format_dot_label(target)}" [label="{format_dot_label(term)}", fontsize=8];')
+	lines.append("}")
+
+	return "\n".join(lines) + "\n"
+
+
+def build_component_dot(component: str, component_df: pd.DataFrame) -> str:
+	"""Build a DOT graph of a single component and its attributes.
+	Args:
+		component (str): Component node URI.
+		component_df (pd.DataFrame): Rows of the TTL precursor DataFrame for this component.
+	Returns:
+		str: DOT string."""
+
+	lines = ["digraph component {", "\trankdir=LR;", '\tnode [shape=box, fontname="Helvetica", fontsize=10];']
+	lines.append(f'\t"{format_dot_label(component)}" [shape=box, style="rounded,filled", fillcolor=lightgrey];')
+	attribute_df = component_df[["term", "label", "type", "required_by", "is_key"]].sort_values("term")  # stable order keeps the content hash stable
+	for term, label, col_type, required_by, is_key in attribute_df.itertuples(index=False):
+		attribute_label = "\\n".join([format_dot_label(label), format_dot_label(col_type)])
+		style = "bold" if required_by else "solid"
+		shape = "doubleoctagon" if is_key == "true" else "box"
+		lines.append(f'\t"{format_dot_label(term)}" [label="{attribute_label}", style={style}, shape={shape}];')
+		lines.append(f'\t"{format_dot_label(component)}" -> "{format_dot_label(term)}";')
+	lines.append("}")
+
+	return "\n".join(lines) + "\n"
+
+
+def render_dot(dot_string: str, image_path: str, cache_dir: str) -> bool:
+	"""Render a DOT string to PNG with graphviz dot.
+	Renders are cached in cache_dir by a hash of the DOT string, so unchanged graphs are copied instead of re-rendered.
+	If rendering fails, the DOT string is written next to image_path for debugging.
+	Args:
+		dot_string (str): DOT string to render.
+		image_path (str): Path where the PNG should be written.
+		cache_dir (str): Folder holding previously rendered PNGs.
+	Returns:
+		bool: True if the PNG was written."""
+
+	dot_hash = hashlib.sha256(dot_string.encode("utf-8")).hexdigest()
+	cached_path = os.path.join(cache_dir, f"{dot_hash}.png")
+
+	if not os.path.exists(cached_path):
+		temp_path = f"{cached_path}.{os.getpid()}.tmp"
+		try:
+			subprocess.run(["dot", "-Tpng", "-o", temp_path], input=dot_string, text=True, check=True, capture_output=True)
+		except (OSError, subprocess.CalledProcessError) as e:
+			print(f"Failed to render {image_path}: {getattr(e, 'stderr', None) or e}")
+			with open(f"{os.path.splitext(image_path)[0]}.dot", "w+") as f:
+				f.write(dot_string)
+			return False
+		os.replace(temp_path, cached_path)
+
+	shutil.copyfile(cached_path, image_path)
+
+	return True
+
+
+def build_summary_graph_images(ttl_df: pd.DataFrame, key_tuple_list: list[tuple[str, str, str]] | None, org_name: str, image_path: str, workers: int | None = None) -> None:
+	"""Render a component-level overview of the model and one graph per component.
+	The overview is written to image_path, component graphs to a folder named after image_path.
+	Graphs are rendered in parallel and cached by content hash in a .graph_cache folder next to image_path.
+	Args:
+		ttl_df (pd.DataFrame): Output TTL DataFrame.
+		key_tuple_list (list[tuple[str, str, str]] | None): Key tuples from convert_schematic_model_to_ttl_format.
+		org_name (str): Organization name for URI formatting.
+		image_path (str): Path where the overview PNG should be written.
+		workers (int | None): Maximum number of concurrent renders. Defaults to the CPU count, up to 8."""
+
+	start = time.time()
+	image_root = os.path.splitext(image_path)[0]
+	component_dir = f"{image_root}_components"
+	cache_dir = os.path.join(os.path.dirname(image_path) or ".", ".graph_cache")
+	os.makedirs(component_dir, exist_ok=True)
+	os.makedirs(cache_dir, exist_ok=True)
+
+	summary_df = summarize_components(ttl_df)
+	edges = get_component_edges(key_tuple_list, org_name, set(summary_df.index))
+
+	render_jobs = [(build_summary_dot(summary_df, edges), image_path)]
+	for component, component_df in ttl_df.groupby("node", sort=True):
+		component_file = re.sub(r"[^A-Za-z0-9_.-]", "_", str(component))
+		render_jobs.append((build_component_dot(component, component_df), os.path.join(component_dir, f"{component_file}.png")))
+
+	workers = workers or min(8, os.cpu_count() or 1)
+	with ThreadPoolExecutor(max_workers=workers) as executor:  # rendering runs in dot subprocesses
+		results = list(executor.map(lambda job: render_dot(job[0], job[1], cache_dir), render_jobs))
+
+	print(f"{sum(results)} of {len(render_jobs)} graphs rendered in {time.time() - start:.1f}s")
+	if results[0]:
+		print(f"Success! Component summary is available at {image_path}")
+	print(f"Component graphs are available in {component_dir}")
+
+
+def build_interactive_graph(model_graph) -> None:
+	"""Draw the model graph with networkx and show it in a matplotlib window.
+	Args:
+		model_graph (rdflib.Graph): The parsed model graph."""
+
+	import matplotlib.pyplot as plt
+	import networkx as nx
+	from rdflib.extras.external_graph_libs import rdflib_to_networkx_multidigraph
+
+	print("Generating interactive plot...")
+	model_graph = rdflib_to_networkx_multidigraph(model_graph)
+	nx.draw_networkx(model_graph, arrows=False, with_labels=True, font_size=4, node_size=200)
+	plt.show()
+
+
+def build_ttl_entry(row: dict, tag_dict: dict) -> tuple[str, list[str]]:
+	"""Build the TTL statements for one row of the TTL precursor DataFrame.
+	Args:
+		row (dict): Row of the TTL precursor DataFrame.
+		tag_dict (dict): Tag name: (prefix, namespace) dictionary.
+	Returns:
+		tuple[str, list[str]]: TTL text for the row and the tag names it uses."""
+
+	label, desc, node, type, reqby, key, enum = "label", "description", "node", "type", "requiredBy", "isKey", "acceptableValues"
+
+	props = None
+	ttl_dict = {
+	label: row["label"],
+	desc: row["description"],
+	node: row["node"],
+	type: row["type"],
+	reqby: row["required_by"],
+	key: row["is_key"],
+	enum: row["has_enum"]
+	}
+	
+	if row["maps_to"]:
+		props = {f"{mapping.split(':')[0].upper()}":f"{mapping.split(':')[1]}" for mapping in row["maps_to"].split(", ")}
+		ttl_dict.update(props)
+
+	lines = ["\n"]
+	lines.append(f"{row['term']} {tag_dict[label][0]}:{label} {ttl_dict[label]};"+"\n")
+	lines.append("\t"+f"{tag_dict[desc][0]}:{desc} {ttl_dict[desc]};"+"\n")
+	lines.append("\t"+f"{tag_dict[node][0]}:{node} {ttl_dict[node]};"+"\n")
+	if ttl_dict[type] != "":
+		line_end = ";" if ttl_dict[reqby] or ttl_dict[key] or props or ttl_dict[enum] not in ['"[]"', ""] else " ."
+		lines.append("\t"+f"{tag_dict[type][0]}:{type} {ttl_dict[type]}{line_end}"+"\n")
+	if ttl_dict[reqby]:
+		line_end = ";\n" if ttl_dict[key] or props or ttl_dict[enum] not in ['"[]"', ""] else " .\n"
+		lines.append("\t"+f"{tag_dict[reqby][0]}:{reqby} {''.join([ttl_dict[reqby], line_end])}")
+	if ttl_dict[key]:
+		line_end = ";\n" if props or ttl_dict[enum] not in ['"[]"', ""] else " .\n"
+		lines.append("\t"+f"{tag_dict[key][0]}:{key} {''.join([ttl_dict[key], line_end])}")
+	if ttl_dict[enum] not in ['"[]"', ""]:
+		line_end = ";\n" if props else " .\n"
+		lines.append("\t"+f"{tag_dict[enum][0]}:{enum} {''.join([ttl_dict[enum], line_end])}")
+	if props:
+		end = len(props)
+		i = 0
+		for prop in props:
+			i += 1
+			line_end = ";\n" if i < end else " .\n"
+			if props[prop] and props[prop] != "TBD":
+				lines.append("\t"+f"{tag_dict[prop][0]}:{prop} {''.join([props[prop], line_end])}")
+
+	return "".join(lines), [item for item in ttl_dict]
+
+
+def hash_ttl_nodes(ttl_df: pd.DataFrame, settings: tuple[str, ...]) -> tuple[dict[str, str], dict[str, dict[str, str]]]:
+	"""Compute content hashes for each attribute and node in the TTL precursor DataFrame.
+	An attribute hash covers everything written for that attribute (label, description, type, requirement, key, valid values and mappings).
+	A node hash covers the hashes of all of its attributes, plus the settings used to build tags.
+	Args:
+		ttl_df (pd.DataFrame): Output TTL DataFrame.
+		settings (tuple[str, ...]): Values that change the TTL output for every node, e.g. org name and base tag.
+	Returns:
+		tuple[dict[str, str], dict[str, dict[str, str]]]: Node URI: node hash and Node URI: {term: attribute hash} dictionaries."""
+
+	hash_cols = ["term", "label", "description", "node", "type", "required_by", "maps_to", "is_key", "has_enum"]
+	row_hashes = pd.util.hash_pandas_object(ttl_df[hash_cols].astype(str), index=False).map("{:016x}".format)
+	hashed_df = pd.DataFrame({"node": ttl_df["node"], "term": ttl_df["term"], "hash": row_hashes})
+
+	salt = "|".join([str(TTL_MANIFEST_VERSION)] + [str(setting) for setting in settings])
+	node_hashes = {}
+	attribute_hashes = {}
+	for node_uri, node_df in hashed_df.groupby("node", sort=False):
+		pairs = sorted(zip(node_df["term"], node_df["hash"]))
+		attribute_hashes[node_uri] = dict(pairs)
+		node_hashes[node_uri] = hashlib.sha256("\n".join([salt] + [f"{term}:{row_hash}" for term, row_hash in pairs]).encode("utf-8")).hexdigest()
+
+	return node_hashes, attribute_hashes
+
+
+def load_node_manifest(manifest_path: str) -> tuple[dict, str | None]:
+	"""Load per-node hashes written by a previous build, and the hash of the TTL file they describe.
+	Returns an empty dictionary if no compatible manifest exists."""
+
+	if not os.path.exists(manifest_path):
+		return {}, None
+	with open(manifest_path, "r") as f:
+		manifest = json.load(f)
+	if manifest.get("manifest_version") != TTL_MANIFEST_VERSION:
+		print(f"Ignoring node manifest {manifest_path}, it was written by an incompatible version of this script")
+		return {}, None
+
+	return manifest["nodes"], manifest["ttl_hash"]
+
+
+def write_node_manifest(manifest_path: str, nodes: dict, ttl_text: str) -> None:
+	"""Write per-node hashes, tag names and statement positions next to the output TTL, for use by the next build."""
+
+	ttl_hash = hashlib.sha256(ttl_text.encode("utf-8")).hexdigest()
+	with open(manifest_path, "w+") as f:
+		json.dump({"manifest_version": TTL_MANIFEST_VERSION, "ttl_hash": ttl_hash, "nodes": nodes}, f)
+
+
+def load_previous_ttl(ttl_path: str, ttl_hash: str | None) -> str | None:
+	"""Read the TTL a node manifest was written for.
+	Returns None if the file is missing or was changed after the manifest was written."""
+
+	if ttl_hash is None or not os.path.exists(ttl_path):
+		return None
+	with open(ttl_path, "r") as f:
+		ttl_text = f.read()
+	if hashlib.sha256(ttl_text.encode("utf-8")).hexdigest() != ttl_hash:
+		print(f"Not reusing triples from {ttl_path}, it was changed after it was built")
+		return None
+
+	return ttl_text
+
+
+def report_model_diff(previous_nodes: dict, attribute_hashes: dict[str, dict[str, str]]) -> None:
+	"""Print attributes added, removed and changed since a previous build.
+	Args:
+		previous_nodes (dict): Nodes from a previous node manifest.
+		attribute_hashes (dict[str, dict[str, str]]): Node URI: {term: attribute hash} dictionary for the current build."""
+
+	previous_attributes = {term: attribute_hash for node_info in previous_nodes.values() for term, attribute_hash in node_info["attributes"].items()}
+	current_attributes = {term: attribute_hash for node_attributes in attribute_hashes.values() for term, attribute_hash in node_attributes.items()}
+
+	added = sorted(current_attributes.keys() - previous_attributes.keys())
+	removed = sorted(previous_attributes.keys() - current_attributes.keys())
+	changed = sorted([term for term in current_attributes.keys() & previous_attributes.keys() if current_attributes[term] != previous_attributes[term]])
+	added_nodes = sorted(attribute_hashes.keys() - previous_nodes.keys())
+	removed_nodes = sorted(previous_nodes.keys() - attribute_hashes.keys())
+
+	print(f"Model changes: {len(added)} attributes added, {len(removed)} removed, {len(changed)} changed")
+	for node_uri in added_nodes:
+		print(f"  + node {node_uri}")
+	for node_uri in removed_nodes:
+		print(f"  - node {node_uri}")
+	for symbol, terms in [("+", added), ("-", removed), ("~", changed)]:
+		for term in terms:
+			print(f"  {symbol} {term}")
+
+
 def main():
 	
 	args = get_args()
@@ -393,8 +808,7 @@ def main():
 	
 	elif args.model:
 		print(f"Processing model [{args.model}] to RDF triples precursor dataframe...")
-		sep = "," if Path(args.model).suffix == ".csv" else "\t" 
-		model_df = pd.read_csv(args.model, header=0, keep_default_na=False, na_values="nan", sep=sep, dtype=str)
+		model_df = load_model(args.model)["table"]
 		ref = args.reference_type
 		if ref is None:
 			if str(args.org_name).lower() in ["new_org", "mc2", "nf", "adkp", "htan", "ada"]:
@@ -417,113 +831,96 @@ def main():
 	node_name = "_".join(args.subset.split(", ")) if args.subset is not None else "all"
 	out_file = "/".join([args.output, f"{args.org_name}_{node_name}_{args.version}.ttl"])
 
-	prefix_list = []
+	manifest_path = f"{out_file}.nodes.json"
+	previous_ttl_path = args.previous_graph if args.previous_graph is not None else out_file
+	previous_path = f"{previous_ttl_path}.nodes.json"
+	previous_nodes, previous_ttl_hash = load_node_manifest(previous_path)
+	previous_ttl = load_previous_ttl(previous_ttl_path, previous_ttl_hash) if previous_nodes else None
+	node_hashes, attribute_hashes = hash_ttl_nodes(ttl_df, (args.org_name, base_tag, base_ref))
+	if previous_nodes:
+		print(f"Comparing model to previous graph build [{previous_path}]...")
+		report_model_diff(previous_nodes, attribute_hashes)
+
+	print(f"Building RDF triples and serializing to TTL...")
+	# Statements are written in model row order. A node whose hash and term order are unchanged
+	# takes its statements from the previous TTL, using the positions recorded in its manifest.
+	rows = ttl_df.to_dict("records")
+	node_terms = {}
+	for row in rows:
+		node_terms.setdefault(row["node"], []).append(row["term"])
+	reused_nodes = set()
+	if previous_ttl is not None:
+		reused_nodes = {
+			node_uri for node_uri, terms in node_terms.items()
+			if previous_nodes.get(node_uri, {}).get("hash") == node_hashes[node_uri]
+			and [term for term, _, _ in previous_nodes[node_uri]["spans"]] == terms
+		}
+	previous_spans = {node_uri: iter(previous_nodes[node_uri]["spans"]) for node_uri in reused_nodes}
+	node_prefixes = {node_uri: set(previous_nodes[node_uri]["prefixes"]) for node_uri in reused_nodes}
+
+	entries = []
+	for row in rows:
+		if row["node"] in reused_nodes:
+			_, start, end = next(previous_spans[row["node"]])
+			entries.append(previous_ttl[start:end])
+		else:
+			entry, prefixes = build_ttl_entry(row, tag_dict)
+			entries.append(entry)
+			node_prefixes.setdefault(row["node"], set()).update(prefixes)
+
+	print(f"Triples regenerated for {len(node_terms) - len(reused_nodes)} of {len(node_terms)} nodes ({len(reused_nodes)} unchanged nodes reused)")
+	prefix_list = [prefix for prefixes in node_prefixes.values() for prefix in prefixes]
+
+	prefix_set = set(prefix_list)
+	node_set = set(node_list)
+	first_lines = [f"@prefix {tag_dict[prefix][0]}: {tag_dict[prefix][1]}"+" .\n" for prefix in prefix_set]
+	org_line = f"@prefix {args.org_name}: <{base_ref}:{args.org_name}/> .\n"
+	node_lines = "".join([f"@prefix {node_type.lower().replace(' ', '_').replace('10x_', '')}: <{args.org_name}:{node_type.lower().replace(' ', '_').replace('10x_', '')}/> .\n" for node_type in node_set])
+	first_lines_set = "".join(set(first_lines))
+	header = first_lines_set + org_line + node_lines
+	key_lines = ""
+	if key_tuple_list is not None:
+		for primary, schema, foreign in key_tuple_list:
+			if "id" in primary.split("_"):
+				key_lines += f"{':'.join([str(primary).split('_')[0].lower(), str(primary).lower()])} {str(schema).lower()} {str(foreign).lower()} .\n"
+	ttl_text = header + "".join(entries) + "\n" + key_lines
 
 	with open(out_file, "w+") as f:
-		print(f"Building RDF triples and serializing to TTL...")
-		for _, row in ttl_df.iterrows():
-			props = None
-			ttl_dict = {
-			label: row["label"],
-			desc: row["description"],
-			node: row["node"],
-			type: row["type"],
-			reqby: row["required_by"],
-			key: row["is_key"],
-			enum: row["has_enum"]
-			}
-			
-			if row["maps_to"]:
-				props = {f"{mapping.split(':')[0].upper()}":f"{mapping.split(':')[1]}" for mapping in row["maps_to"].split(", ")}
-				ttl_dict.update(props)
-
-			new_prefixes = [item for item in ttl_dict]
-			prefix_list = prefix_list + new_prefixes
-				
-			f.write("\n")
-			f.write(f"{row['term']} {tag_dict[label][0]}:{label} {ttl_dict[label]};"+"\n")
-			f.write("\t"+f"{tag_dict[desc][0]}:{desc} {ttl_dict[desc]};"+"\n")
-			f.write("\t"+f"{tag_dict[node][0]}:{node} {ttl_dict[node]};"+"\n")
-			if ttl_dict[type] != "":
-				line_end = ";" if ttl_dict[reqby] or ttl_dict[key] or props or ttl_dict[enum] not in ['"[]"', ""] else " ."
-				f.write("\t"+f"{tag_dict[type][0]}:{type} {ttl_dict[type]}{line_end}"+"\n")
-			if ttl_dict[reqby]:
-				line_end = ";\n" if ttl_dict[key] or props or ttl_dict[enum] not in ['"[]"', ""] else " .\n"
-				f.write("\t"+f"{tag_dict[reqby][0]}:{reqby} {''.join([ttl_dict[reqby], line_end])}")
-			if ttl_dict[key]:
-				line_end = ";\n" if props or ttl_dict[enum] not in ['"[]"', ""] else " .\n"
-				f.write("\t"+f"{tag_dict[key][0]}:{key} {''.join([ttl_dict[key], line_end])}")
-			if ttl_dict[enum] not in ['"[]"', ""]:
-				line_end = ";\n" if props else " .\n"
-				f.write("\t"+f"{tag_dict[enum][0]}:{enum} {''.join([ttl_dict[enum], line_end])}")
-			if props:
-				end = len(props)
-				i = 0
-				for prop in props:
-					i += 1
-					line_end = ";\n" if i < end else " .\n"
-					if props[prop] and props[prop] != "TBD":
-						f.write("\t"+f"{tag_dict[prop][0]}:{prop} {''.join([props[prop], line_end])}")
-	
-	with open(out_file, "r") as f:
-		current_lines = f.read()
-	
-	with open(out_file, "w+") as f:
-		prefix_set = set(prefix_list)
-		node_set = set(node_list)
-		first_lines = [f"@prefix {tag_dict[prefix][0]}: {tag_dict[prefix][1]}"+" .\n" for prefix in prefix_set]
-		org_line = f"@prefix {args.org_name}: <{base_ref}:{args.org_name}/> .\n"
-		node_lines = "".join([f"@prefix {node_type.lower().replace(' ', '_').replace('10x_', '')}: <{args.org_name}:{node_type.lower().replace(' ', '_').replace('10x_', '')}/> .\n" for node_type in node_set])
-		first_lines_set = "".join(set(first_lines))
-		f.write(first_lines_set)
-		f.write(org_line)
-		f.write(node_lines)
-		f.write(current_lines)
-		f.write("\n")
-		if key_tuple_list is not None:
-			for primary, schema, foreign in key_tuple_list:
-				if "id" in primary.split("_"):
-					line = f"{':'.join([str(primary).split('_')[0].lower(), str(primary).lower()])} {str(schema).lower()} {str(foreign).lower()} .\n"
-					f.write(line)
+		f.write(ttl_text)
+
+	current_nodes = {
+		node_uri: {
+			"hash": node_hashes[node_uri],
+			"attributes": attribute_hashes[node_uri],
+			"prefixes": sorted(node_prefixes.get(node_uri, set())),
+			"spans": [],
+		}
+		for node_uri in node_terms
+	}
+	position = len(header)
+	for row, entry in zip(rows, entries):
+		current_nodes[row["node"]]["spans"].append([row["term"], position, position + len(entry)])
+		position += len(entry)
+	write_node_manifest(manifest_path, current_nodes, ttl_text)
 	
 	print(f"Done ✅")
 	print(f"{out_file} was written with {len(ttl_df)} triples!")
 	
-	g = rdflib.Graph()
-	model_graph = g.parse(out_file, format="turtle")
-	image_path = "/".join([args.output, f"{args.org_name}_{node_name}_{args.version}.png"])
+	full_graph = args.build_graph is not None and args.graph_mode == "full"
+	if args.no_parse is not None and not full_graph and args.interactive_graph is None:
+		print("Skipping TTL re-parse, no graph output was requested.")
+	else:
+		model_graph = parse_ttl_graph(out_file)
 
 	if args.build_graph is not None:
-		retry = 1
-		image = None
-		while image is None:
-			if retry > 0:
-				value_tag = rdflib.URIRef(f"{base_tag}/acceptableValues")
-				model_graph = model_graph.remove((None, value_tag, None))
-			dot_stream = io.StringIO()
-			rdf2dot.rdf2dot(model_graph, dot_stream)
-			dot_string = dot_stream.getvalue()
-			graph = pydotplus.graph_from_dot_data(dot_string)
-			try:
-				graph.write_png(image_path, prog="dot")
-				image = Image.open(image_path)
-				image.show()
-				print(f"Success! Graph visualization is available at {image_path}")
-				image = True
-			except:
-				print("Failed to generate a visualization of the graph. Retrying with fewer triples...")
-				retry += 1
-				if retry == 2:
-					print("Failed to generate a visualization of the graph. Skipping.")
-					with open("graph_string_error.txt", "w+") as f:
-						f.write(graph.to_string())
-					break
+		image_path = "/".join([args.output, f"{args.org_name}_{node_name}_{args.version}.png"])
+		if args.graph_mode == "summary":
+			build_summary_graph_images(ttl_df, key_tuple_list, args.org_name, image_path)
+		else:
+			build_graph_image(model_graph, base_tag, image_path)
 		
 	if args.interactive_graph is not None:
-		print("Generating interactive plot...")
-		model_graph = rdflib_to_networkx_multidigraph(model_graph)
-		nx.draw_networkx(model_graph, arrows=False, with_labels=True, font_size=4, node_size=200)
-		plt.show()
+		build_interactive_graph(model_graph)
 	
 	print(f"Done ✅")
 		
@@ -0,0 +1,72 @@
+"""dataset_items.py
+
+Reconcile the items of a Synapse Dataset with a desired list of items.
+
+Items are compared as (entityId, versionNumber) pairs using sets, so updating a large
+Dataset costs one pass over its items, and the Dataset is only stored when items
+were actually added or removed.
+
+Used by build_datasets.py and trim_datasets.py.
+"""
+
+
+def item_key(item: dict) -> tuple[str, int]:
+    """Return the (entityId, versionNumber) pair identifying a Dataset item."""
+
+    return item["entityId"], int(item["versionNumber"])
+
+
+def get_dataset_items(dataset) -> list[dict]:
+    """Return the current items of a Synapse Dataset entity."""
+
+    return list(dataset.properties.get("datasetItems") or [])
+
+
+def merge_dataset_items(current_items: list[dict], new_items: list[dict]) -> list[dict]:
+    """Return current items updated with new items.
+    A new item replaces a current item with the same entityId, as Dataset.add_items(force=True) does."""
+
+    new_ids = {item["entityId"] for item in new_items}
+
+    return [item for item in current_items if item["entityId"] not in new_ids] + list(new_items)
+
+
+def drop_dataset_items(current_items: list[dict], entity_ids) -> list[dict]:
+    """Return current items, without items whose entityId is in entity_ids."""
+
+    entity_ids = set(entity_ids)
+
+    return [item for item in current_items if item["entityId"] not in entity_ids]
+
+
+def diff_dataset_items(current_items: list[dict], desired_items: list[dict]) -> tuple[list[dict], list[dict]]:
+    """Compare current and desired Dataset items by (entityId, versionNumber),
+    return the items to add and the items to remove."""
+
+    current_keys = {item_key(item) for item in current_items}
+    desired_keys = {item_key(item) for item in desired_items}
+
+    additions = [item for item in desired_items if item_key(item) not in current_keys]
+    removals = [item for item in current_items if item_key(item) not in desired_keys]
+
+    return additions, removals
+
+
+def reconcile_dataset_items(syn, dataset, desired_items: list[dict]) -> tuple[list[dict], list[dict]]:
+    """Update a Synapse Dataset entity so its items match desired_items,
+    applying only additions and removals, and store it if anything changed.
+    Return the items added and the items removed."""
+
+    current_items = get_dataset_items(dataset)
+    additions, removals = diff_dataset_items(current_items, desired_items)
+
+    if not additions and not removals:
+        return additions, removals
+
+    removal_keys = {item_key(item) for item in removals}
+    dataset.properties.datasetItems = [
+        item for item in current_items if item_key(item) not in removal_keys
+    ] + [{"entityId": item["entityId"], "versionNumber": int(item["versionNumber"])} for item in additions]
+    syn.store(dataset)
+
+    return additions, removals
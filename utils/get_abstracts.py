@@ -1,8 +1,16 @@
 import synapseclient
 from synapseclient import Table
 import argparse
-import requests
-from time import sleep
+import asyncio
+import json
+import os
+import httpx
+import http_client
+
+PUBTATOR_URL = "https://www.ncbi.nlm.nih.gov/research/pubtator-api/publications/export/pubtator"
+BATCH_SIZE = 100  # PMIDs per PubTator request, the export endpoint accepts comma-separated lists
+MAX_CONCURRENT_REQUESTS = 3  # PubTator requests in flight at the same time
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "mc2_pubtator_abstracts.json")
 
 
 ### Login to Synapse ###
@@ -20,6 +28,34 @@ def get_args():
     parser.add_argument(
         "table_id", type=str, help="Synapse table id to upload manifest to."
     )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        type=str,
+        default=DEFAULT_CACHE,
+        help=f"Path to JSON file caching abstracts by PMID (Default: {DEFAULT_CACHE})",
+    )
+    parser.add_argument(
+        "-u",
+        "--url",
+        type=str,
+        default=PUBTATOR_URL,
+        help="PubTator export endpoint (Default: NCBI PubTator API)",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch_size",
+        type=int,
+        default=BATCH_SIZE,
+        help=f"Number of PMIDs per PubTator request (Default: {BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "-r",
+        "--refresh",
+        action="store_true",
+        default=None,
+        help="Fetch abstracts for every PMID, replacing abstracts already in the table or cache",
+    )
 
     return parser.parse_args()
 
@@ -40,26 +76,125 @@ def get_pmids(pubs_df):
     return pmid_list
 
 
-def get_abstracts(pmid_list, pubs_df):
+def normalize_pmid(pmid) -> str:
+    """Return a PMID as a string, e.g. 12345678.0 -> "12345678"."""
+
+    pmid = str(pmid).strip()
+
+    return pmid[:-2] if pmid.endswith(".0") else pmid
+
+
+def load_abstract_cache(cache_path: str) -> dict[str, str]:
+    """Read cached abstracts, return a PMID: abstract dictionary."""
+
+    if not os.path.exists(cache_path):
+        return {}
+
+    with open(cache_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
 
-    total_count = len(pmid_list)
-    counter = 0
+def write_abstract_cache(cache: dict[str, str], cache_path: str) -> None:
+    """Write cached abstracts to a JSON file."""
 
-    for pmid in pmid_list:
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(temp_path, cache_path)
 
-        endpoint = f"https://www.ncbi.nlm.nih.gov/research/pubtator-api/publications/export/pubtator?pmids={pmid}&concepts=none"
-        response = requests.get(endpoint)
-        response_string = response.text
-        # Parse text to extract only the abstract
-        index = response_string.find("|a|") + 3
-        abstract = response_string[index:]
 
-        # Add abstracts to publications data frame
-        pubs_df.loc[pubs_df["pubMedId"] == pmid, "abstract"] = abstract
-        counter += 1
-        print(f"Getting {counter} of {total_count} total abstracts...")
+def parse_pubtator_abstracts(response_string: str) -> dict[str, str]:
+    """Parse PubTator export text for one or more publications,
+    return a PMID: abstract dictionary.
+    Each publication has a "PMID|t|title" line and a "PMID|a|abstract" line."""
 
-        sleep(0.34)
+    abstracts = {}
+    for line in response_string.splitlines():
+        parts = line.split("|", 2)
+        if len(parts) == 3 and parts[1] == "a":
+            abstracts[parts[0]] = parts[2].strip()
+
+    return abstracts
+
+
+async def fetch_abstract_batch(client, semaphore, url, pmids):
+    """Request abstracts for a batch of PMIDs from PubTator,
+    return a PMID: abstract dictionary. Failed batches return an empty dictionary.
+    Requests are rate limited and retried by http_client."""
+
+    async with semaphore:
+        try:
+            response = await http_client.aget(
+                client, url, params={"pmids": ",".join(pmids), "concepts": "none"}
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as error:
+            print(f"❗ Request for {len(pmids)} PMIDs starting with {pmids[0]} failed: {error}")
+            return {}
+
+    return parse_pubtator_abstracts(response.text)
+
+
+async def fetch_abstracts(pmids, url=PUBTATOR_URL, batch_size=BATCH_SIZE):
+    """Request abstracts for a list of PMIDs from PubTator, in concurrent batches,
+    return a PMID: abstract dictionary."""
+
+    batches = [pmids[i : i + batch_size] for i in range(0, len(pmids), batch_size)]
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    abstracts = {}
+
+    async with http_client.new_async_client() as client:
+        tasks = [
+            fetch_abstract_batch(client, semaphore, url, batch)
+            for batch in batches
+        ]
+        for counter, task in enumerate(asyncio.as_completed(tasks), start=1):
+            abstracts.update(await task)
+            print(f"Getting {counter} of {len(batches)} batches of abstracts...")
+
+    return abstracts
+
+
+def get_abstracts(
+    pmid_list,
+    pubs_df,
+    cache_path=DEFAULT_CACHE,
+    url=PUBTATOR_URL,
+    batch_size=BATCH_SIZE,
+    refresh=None,
+):
+    """Add abstracts to the publications data frame.
+    Only PMIDs without an abstract in the table or the cache are requested from PubTator,
+    unless refresh is set. Fetched abstracts are added to the cache."""
+
+    cache = load_abstract_cache(cache_path)
+    pmid_keys = pubs_df["pubMedId"].map(normalize_pmid)
+    has_abstract = pubs_df["abstract"].astype(str).str.strip() != ""
+
+    requested = {normalize_pmid(pmid) for pmid in pmid_list} - {""}
+    if refresh:
+        to_fetch = sorted(requested)
+    else:
+        in_table = set(pmid_keys[has_abstract])
+        to_fetch = sorted(
+            pmid for pmid in requested if pmid not in in_table and not cache.get(pmid)
+        )
+
+    print(f"Requesting {len(to_fetch)} of {len(requested)} total abstracts...")
+    if to_fetch:
+        fetched = asyncio.run(fetch_abstracts(to_fetch, url, batch_size))
+        cache.update({pmid: abstract for pmid, abstract in fetched.items() if abstract})
+        write_abstract_cache(cache, cache_path)
+        print(f"Got {len([pmid for pmid in to_fetch if fetched.get(pmid)])} abstracts from PubTator")
+
+    # Add abstracts to publications data frame
+    cached = pmid_keys.map(cache).fillna("")
+    update = (cached != "") & pmid_keys.isin(requested)
+    if not refresh:
+        update &= ~has_abstract
+    pubs_df.loc[update, "abstract"] = cached[update]
+    print(f"Added {int(update.sum())} abstracts to publications")
 
     return pubs_df
 
@@ -77,7 +212,9 @@ def main():
     args = get_args()
     pub_df = get_df(syn, args.table_id)
     pmids = get_pmids(pub_df)
-    pub_abstracts = get_abstracts(pmids, pub_df)
+    pub_abstracts = get_abstracts(
+        pmids, pub_df, args.cache, args.url, args.batch_size, args.refresh
+    )
 
     # Uncomment when ready
     store_edited_publications(syn, args.table_id, pub_abstracts)
@@ -0,0 +1,361 @@
+"""grant_catalog.py
+
+Local catalog of where each grant's manifests live on Synapse:
+grant number -> grantId (Synapse project) -> project name, typed folder IDs
+(folderIdPublication, folderIdDatasets, ...) and manifest table IDs.
+
+The catalog is stored as JSON (MC2_GRANT_CATALOG, default ~/.cache/mc2_grant_catalog.json)
+so routing a manifest, or finding a grant's table or project name, is a dictionary lookup.
+It is refreshed incrementally once it is older than MAX_AGE_HOURS: the grants table is
+queried again, names and tables are only looked up for projects not yet in the catalog,
+and folders are looked up again for projects missing any typed folder. A manifest table
+missing from the catalog is looked up when it is first requested, since schematic creates
+tables on first submit, and a table found to be deleted is dropped with forget_manifest_table.
+
+GRANT_OVERRIDES folders apply to their grant numbers only, not to every grant sharing
+the override project.
+
+Used by gen-mp-csv.py, upload_validation.py, schema_update.py and upload-manifests.py.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import synapseclient
+
+CATALOG_PATH = os.environ.get(
+    "MC2_GRANT_CATALOG", os.path.join(os.path.expanduser("~"), ".cache", "mc2_grant_catalog.json")
+)
+CATALOG_VERSION = 2  # increase when the catalog format changes
+MAX_AGE_HOURS = 24  # refresh the catalog after this many hours
+GRANT_TABLE = "syn21918972"  # Grants - Merged from CCKP database
+FILE_VIEW = "syn27210848"  # All Files V2 from CCKP database
+QUERY_BATCH_SIZE = 200  # project IDs per folder query
+HEADER_BATCH_SIZE = 50  # entity IDs per entity header request
+DEFAULT_WORKERS = 8  # projects listed at the same time
+
+# top-level project folder name: catalog folder column
+FOLDER_TYPES = {
+    "publications": "folderIdPublication",
+    "datasets": "folderIdDatasets",
+    "tools": "folderIdTools",
+    "education": "folderIdEducation",
+    "grants": "folderIdGrant",
+}
+
+# Grants whose manifests are stored outside their own project folders
+GRANT_OVERRIDES = {
+    "CA209997": {
+        "grantId": "syn7315802",
+        "folders": {
+            "folderIdPublication": "syn32698150",
+            "folderIdDatasets": "syn52744921",
+            "folderIdTools": "syn32698153",
+            "folderIdEducation": "syn53014160",
+        },
+    },
+    "CA209923": {
+        "grantId": "syn43447051",
+        "folders": {
+            "folderIdPublication": "syn43447063",
+            "folderIdDatasets": "syn43447065",
+            "folderIdTools": "syn43447067",
+            "folderIdEducation": "syn53014271",
+        },
+    },
+    "CAfiliatedNon-GrantAssociated": {
+        "grantId": "syn52963211",
+        "folders": {
+            "folderIdPublication": "syn52963310",
+            "folderIdDatasets": "syn52963225",
+            "folderIdTools": "syn52963223",
+            "folderIdEducation": "syn52963215",
+        },
+    },
+    "CA184898": {
+        "grantId": "syn9772917",
+        "folders": {
+            "folderIdPublication": "syn32698262",
+            "folderIdDatasets": "syn34577441",
+            "folderIdTools": "syn53478645",
+            "folderIdEducation": "syn53014135",
+        },
+    },
+}
+
+_catalog_lock = threading.Lock()
+
+
+def new_catalog() -> dict:
+    """Create an empty catalog."""
+
+    return {"version": CATALOG_VERSION, "refreshed": None, "grants": {}, "projects": {}}
+
+
+def load_catalog(catalog_path: str = CATALOG_PATH) -> dict:
+    """Read the catalog, or return an empty one if it is missing or from another version."""
+
+    try:
+        with open(catalog_path, "r", encoding="utf-8") as f:
+            catalog = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return new_catalog()
+
+    return catalog if catalog.get("version") == CATALOG_VERSION else new_catalog()
+
+
+def write_catalog(catalog: dict, catalog_path: str = CATALOG_PATH) -> None:
+    """Write the catalog to a JSON file."""
+
+    os.makedirs(os.path.dirname(os.path.abspath(catalog_path)), exist_ok=True)
+    temp_path = f"{catalog_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, indent=1, sort_keys=True)
+    os.replace(temp_path, catalog_path)
+
+
+def is_stale(catalog: dict, max_age_hours: float = MAX_AGE_HOURS) -> bool:
+    """Return True if the catalog was never refreshed, or was refreshed more than max_age_hours ago."""
+
+    if not catalog.get("refreshed"):
+        return True
+    age = datetime.datetime.now() - datetime.datetime.fromisoformat(catalog["refreshed"])
+
+    return age > datetime.timedelta(hours=max_age_hours)
+
+
+def new_project_entry() -> dict:
+    """Create the catalog entry for a project."""
+
+    return {"name": None, "folders": {}, "tables": {}}
+
+
+def query_grant_ids(syn) -> dict[str, str]:
+    """Return a grant number: grantId dictionary from the grants table."""
+
+    grants = syn.tableQuery(f'SELECT "grantNumber", "grantId" FROM {GRANT_TABLE}').asDataFrame().fillna("")
+
+    return {row.grantNumber: row.grantId for row in grants.itertuples() if row.grantNumber and row.grantId}
+
+
+def query_project_folders(syn, project_ids: list[str]) -> dict[str, dict]:
+    """Return a project ID: {folder column: folder ID} dictionary of the typed top-level folders of projects."""
+
+    folder_names = ", ".join(f"'{name}'" for name in FOLDER_TYPES)
+    folders = {}
+    for i in range(0, len(project_ids), QUERY_BATCH_SIZE):
+        batch = ", ".join(f"'{project_id}'" for project_id in project_ids[i : i + QUERY_BATCH_SIZE])
+        folder_table = syn.tableQuery(
+            f"SELECT id, name, projectId FROM {FILE_VIEW} "
+            f"WHERE parentId=projectId AND name IN ({folder_names}) AND projectId IN ({batch})"
+        ).asDataFrame()
+        for row in folder_table.itertuples():
+            folders.setdefault(str(row.projectId), {})[FOLDER_TYPES[row.name]] = str(row.id)
+
+    return folders
+
+
+def get_entity_names(syn, entity_ids: list[str]) -> dict[str, str]:
+    """Return an entity ID: name dictionary, requesting entity headers in batches."""
+
+    names = {}
+    for i in range(0, len(entity_ids), HEADER_BATCH_SIZE):
+        references = [{"targetId": entity_id} for entity_id in entity_ids[i : i + HEADER_BATCH_SIZE]]
+        headers = syn.restPOST("/entity/header", body=json.dumps({"references": references}))
+        names.update({header["id"]: header["name"] for header in headers["results"]})
+
+    return names
+
+
+def list_project_tables(syn, project_id: str) -> dict[str, str]:
+    """Return a table name: table ID dictionary of the tables in a project."""
+
+    return {child["name"]: child["id"] for child in syn.getChildren(project_id, includeTypes=["table"])}
+
+
+def refresh_catalog(syn, catalog: dict, full: bool = False, workers: int = DEFAULT_WORKERS) -> dict:
+    """Update the catalog from Synapse.
+    The grants table is always queried again. Folders, project names and tables are
+    looked up for projects not yet in the catalog, or for all projects if full is set."""
+
+    grants = query_grant_ids(syn)
+    grants.update({grant_number: override["grantId"] for grant_number, override in GRANT_OVERRIDES.items()})
+
+    projects = {} if full else catalog["projects"]
+    project_ids = set(grants.values())
+    new_ids = sorted(
+        project_id for project_id in project_ids
+        if project_id not in projects or projects[project_id].get("name") is None
+    )
+    # Folders may be created after a project is first cataloged
+    folder_ids = sorted(
+        project_id for project_id in project_ids
+        if project_id in new_ids or not set(FOLDER_TYPES.values()) <= set(projects[project_id]["folders"])
+    )
+    print(
+        f"Refreshing grant catalog: {len(grants)} grants, {len(new_ids)} new projects, "
+        f"{len(folder_ids)} projects with missing folders"
+    )
+
+    if new_ids:
+        names = get_entity_names(syn, new_ids)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            tables = dict(zip(new_ids, executor.map(lambda project_id: list_project_tables(syn, project_id), new_ids)))
+        for project_id in new_ids:
+            projects[project_id] = {"name": names.get(project_id), "folders": {}, "tables": tables[project_id]}
+
+    if folder_ids:
+        folders = query_project_folders(syn, folder_ids)
+        for project_id in folder_ids:
+            projects[project_id]["folders"] = folders.get(project_id, {})
+
+    catalog["grants"] = grants
+    catalog["projects"] = projects
+    catalog["refreshed"] = datetime.datetime.now().isoformat(timespec="seconds")
+
+    return catalog
+
+
+def get_catalog(syn=None, catalog_path: str = CATALOG_PATH, refresh: bool = False, max_age_hours: float = MAX_AGE_HOURS) -> dict:
+    """Return the catalog, refreshing it first if it is stale.
+    Logs in to Synapse only if a refresh is needed and no client is given.
+    With refresh, the catalog is rebuilt from Synapse."""
+
+    catalog = load_catalog(catalog_path)
+    if refresh or is_stale(catalog, max_age_hours):
+        syn = syn or synapseclient.login(silent=True)
+        catalog = refresh_catalog(syn, catalog, full=refresh)
+        write_catalog(catalog, catalog_path)
+
+    catalog["path"] = catalog_path
+
+    return catalog
+
+
+def save_catalog(catalog: dict) -> None:
+    """Write a catalog returned by get_catalog back to its file."""
+
+    write_catalog({key: value for key, value in catalog.items() if key != "path"}, catalog.get("path", CATALOG_PATH))
+
+
+def get_grant_id(catalog: dict, grant_number: str) -> str | None:
+    """Return the grantId (Synapse project ID) of a grant number."""
+
+    return catalog["grants"].get(grant_number)
+
+
+def get_folder_id(catalog: dict, grant_number: str, folder_column: str) -> str | None:
+    """Return the ID of a grant's typed folder, e.g. folder_column 'folderIdPublication'.
+    Folders in GRANT_OVERRIDES are used for their grant number."""
+
+    override_folders = GRANT_OVERRIDES.get(grant_number, {}).get("folders", {})
+    if folder_column in override_folders:
+        return override_folders[folder_column]
+
+    project = catalog["projects"].get(get_grant_id(catalog, grant_number) or "", {})
+
+    return project.get("folders", {}).get(folder_column)
+
+
+def get_project_name(catalog: dict, grant_id: str) -> str | None:
+    """Return the name of a grant's project."""
+
+    return catalog["projects"].get(grant_id, {}).get("name")
+
+
+def get_folder_project(catalog: dict, folder_id: str) -> str | None:
+    """Return the project ID a typed folder belongs to in the catalog.
+    Return None for GRANT_OVERRIDES folders, which may be stored outside their grant's project."""
+
+    if any(folder_id in override["folders"].values() for override in GRANT_OVERRIDES.values()):
+        return None
+
+    for project_id, project in catalog["projects"].items():
+        if folder_id in project["folders"].values():
+            return project_id
+
+    return None
+
+
+def get_manifest_table_id(syn, catalog: dict, grant_id: str, data_type: str) -> str | None:
+    """Return the ID of the table in a grant's project whose name starts with data_type,
+    e.g. 'PublicationView' for schematic's publicationview_synapse_storage_manifest_table.
+    If the catalog has no such table and a Synapse client is given, the project's tables
+    are listed again and the catalog is saved."""
+
+    prefix = data_type.lower()
+
+    def find_table(project):
+        return next((table_id for name, table_id in sorted(project["tables"].items()) if name.startswith(prefix)), None)
+
+    with _catalog_lock:
+        project = catalog["projects"].setdefault(grant_id, new_project_entry())
+        table_id = find_table(project)
+        if table_id is None and syn is not None:
+            project["tables"] = list_project_tables(syn, grant_id)
+            table_id = find_table(project)
+            save_catalog(catalog)
+
+    return table_id
+
+
+def forget_manifest_table(catalog: dict, grant_id: str, table_id: str) -> None:
+    """Drop a table found to be missing from Synapse from a grant's project and save the catalog,
+    so the next get_manifest_table_id call lists the project's tables again."""
+
+    with _catalog_lock:
+        tables = catalog["projects"].get(grant_id, {}).get("tables", {})
+        for name in [name for name, cached_id in tables.items() if cached_id == table_id]:
+            del tables[name]
+        save_catalog(catalog)
+
+
+def get_grant_folder_reference(catalog: dict, folder_column: str, grant_id_column: str = "grantId") -> list[dict]:
+    """Return one row per grant with its grant number, grantId and typed folder ID."""
+
+    return [
+        {
+            "grantNumber": grant_number,
+            grant_id_column: grant_id,
+            folder_column: get_folder_id(catalog, grant_number, folder_column) or "",
+        }
+        for grant_number, grant_id in sorted(catalog["grants"].items())
+    ]
+
+
+def get_args():
+    """Set up command-line interface and get arguments."""
+    parser = argparse.ArgumentParser(description="Refresh the local grant catalog and print a summary.")
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        default=None,
+        help="Rebuild the catalog from Synapse instead of refreshing it incrementally.",
+    )
+    parser.add_argument(
+        "-p",
+        "--path",
+        type=str,
+        default=CATALOG_PATH,
+        help=f"Path to the catalog JSON file. (Default: {CATALOG_PATH})",
+    )
+    return parser.parse_args()
+
+
+def main():
+
+    args = get_args()
+    catalog = get_catalog(catalog_path=args.path, refresh=args.refresh, max_age_hours=0)
+
+    print(
+        f"Grant catalog {args.path}: {len(catalog['grants'])} grants, {len(catalog['projects'])} projects, "
+        f"refreshed {catalog['refreshed']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""http_client.py
+
+Shared HTTP access for scripts that call external metadata APIs
+(PubTator, NIH RePORTER, Unpaywall) or download files such as JSON schemas
+and controlled vocabulary CSVs.
+
+All requests go through httpx clients that pool connections per host. Each
+host has a token bucket, so every request to a throttled API counts against
+the same limit (see HOST_RATE_LIMITS and set_rate_limit). Throttled requests
+(429), server errors (5xx) and connection failures are retried with
+exponential backoff and jitter, using Retry-After when the server sends it.
+
+GET requests made with cache=True are stored on disk (MC2_HTTP_CACHE, default
+~/.cache/mc2_http) together with their ETag/Last-Modified headers. Later
+requests for the same URL are sent as conditional requests, and a
+304 Not Modified reply is answered from the cache.
+
+Used by get_abstracts.py, reporter_project_query.py, check_publications_status.py,
+synapse_json_schema_bind.py, split_manifest_grants.py and edit_legacy_annotations.py.
+"""
+
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+DEFAULT_TIMEOUT = 60  # seconds
+MAX_ATTEMPTS = 5  # tries per request before the last reply or error is returned
+RETRY_STATUS = {429, 500, 502, 503, 504}  # status codes worth retrying
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 60
+MAX_KEEPALIVE_CONNECTIONS = 10  # idle connections kept open in the pool, across all hosts
+CACHE_DIR = os.environ.get("MC2_HTTP_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "mc2_http"))
+
+# host: (requests per second, burst size)
+HOST_RATE_LIMITS = {
+    "www.ncbi.nlm.nih.gov": (3, 1),  # NCBI limit for clients without an API key
+    "api.reporter.nih.gov": (1, 1),  # RePORTER asks for no more than one request per second
+    "api.unpaywall.org": (10, 10),
+}
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_client = None
+_client_lock = threading.Lock()
+
+
+def set_rate_limit(host: str, rate: float | None, burst: int = 1) -> None:
+    """Set the number of requests per second allowed to a host, shared by all threads and tasks.
+    A rate of None removes the limit."""
+
+    with _buckets_lock:
+        if rate:
+            HOST_RATE_LIMITS[host] = (rate, burst)
+        else:
+            HOST_RATE_LIMITS.pop(host, None)
+        _buckets.pop(host, None)
+
+
+def get_bucket(host: str) -> dict | None:
+    """Return the token bucket for a host, or None if requests to it are not limited."""
+
+    with _buckets_lock:
+        if host not in _buckets:
+            if host not in HOST_RATE_LIMITS:
+                return None
+            rate, burst = HOST_RATE_LIMITS[host]
+            _buckets[host] = {
+                "rate": rate,
+                "capacity": burst,
+                "tokens": burst,
+                "updated": time.monotonic(),
+                "lock": threading.Lock(),
+            }
+        return _buckets[host]
+
+
+def reserve_token(url: str) -> float:
+    """Take a token for the host of a URL, return the number of seconds to wait before using it."""
+
+    bucket = get_bucket(urlsplit(url).hostname)
+    if bucket is None:
+        return 0.0
+
+    with bucket["lock"]:
+        now = time.monotonic()
+        bucket["tokens"] = min(bucket["capacity"], bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+        bucket["updated"] = now
+        bucket["tokens"] -= 1
+
+        return max(0.0, -bucket["tokens"] / bucket["rate"])
+
+
+def get_retry_delay(attempt: int, response: httpx.Response | None = None) -> float:
+    """Return seconds to wait before retrying a request,
+    using Retry-After if the reply has it, otherwise exponential backoff with jitter."""
+
+    headers = response.headers if response is not None else {}
+    try:
+        return min(float(headers["Retry-After"]), BACKOFF_MAX_SECONDS)
+    except (KeyError, ValueError):
+        delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempt - 1), BACKOFF_MAX_SECONDS)
+        return delay * random.uniform(0.5, 1.5)
+
+
+def get_client_options() -> dict:
+    """Return options shared by sync and async clients."""
+
+    return {
+        "timeout": DEFAULT_TIMEOUT,
+        "follow_redirects": True,
+        "limits": httpx.Limits(max_connections=None, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS),
+    }
+
+
+def get_client() -> httpx.Client:
+    """Return the client shared by all threads of the process, creating it on first use."""
+
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(**get_client_options())
+            atexit.register(_client.close)
+        return _client
+
+
+def new_async_client() -> httpx.AsyncClient:
+    """Create an async client, to be used with 'async with' inside one event loop."""
+
+    return httpx.AsyncClient(**get_client_options())
+
+
+def get_cache_path(url: str, params: dict | None) -> str:
+    """Return the cache file path, without extension, for a GET request."""
+
+    request_url = str(httpx.URL(url, params=params))
+
+    return os.path.join(CACHE_DIR, hashlib.sha256(request_url.encode("utf-8")).hexdigest())
+
+
+def load_cached_response(url: str, params: dict | None) -> dict | None:
+    """Return the cached response for a GET request, or None if there is none."""
+
+    cache_path = get_cache_path(url, params)
+    try:
+        with open(f"{cache_path}.json", "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        with open(f"{cache_path}.body", "rb") as f:
+            cached["content"] = f.read()
+    except (OSError, json.JSONDecodeError):
+        return None
+
+    return cached
+
+
+def store_cached_response(url: str, params: dict | None, response: httpx.Response) -> None:
+    """Store a GET response on disk, if the server sent validators for conditional requests."""
+
+    validators = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    if not any(validators.values()):
+        return
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cache_path = get_cache_path(url, params)
+    suffix = f"{os.getpid()}.{threading.get_ident()}.tmp"
+    entry = {
+        "url": str(response.request.url),
+        "content_type": response.headers.get("Content-Type"),
+        **validators,
+    }
+    with open(f"{cache_path}.body.{suffix}", "wb") as f:
+        f.write(response.content)
+    os.replace(f"{cache_path}.body.{suffix}", f"{cache_path}.body")
+    with open(f"{cache_path}.json.{suffix}", "w", encoding="utf-8") as f:
+        json.dump(entry, f)
+    os.replace(f"{cache_path}.json.{suffix}", f"{cache_path}.json")
+
+
+def get_conditional_headers(cached: dict | None) -> dict:
+    """Return If-None-Match/If-Modified-Since headers for a cached response."""
+
+    if cached is None:
+        return {}
+    headers = {}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    return headers
+
+
+def finish_response(url: str, params: dict | None, response: httpx.Response, cached: dict | None, cache: bool) -> httpx.Response:
+    """Answer a 304 reply from the cache, and cache new successful GET replies."""
+
+    if response.status_code == 304 and cached is not None:
+        headers = {"Content-Type": cached["content_type"]} if cached.get("content_type") else {}
+        return httpx.Response(200, headers=headers, content=cached["content"], request=response.request)
+    if cache and response.status_code == 200:
+        store_cached_response(url, params, response)
+
+    return response
+
+
+def request(method: str, url: str, cache: bool = False, max_attempts: int = MAX_ATTEMPTS, **kwargs) -> httpx.Response:
+    """Send a request with the shared client, within the host's rate limit, retrying transient failures.
+    Keyword arguments are passed to httpx (params, headers, json, content, ...).
+    Return the reply, which may still be an error after max_attempts; raise the last connection error
+    if no reply was received.
+    Args:
+        method (str): HTTP method, e.g. "GET".
+        url (str): Request URL.
+        cache (bool): For GET requests, keep the reply on disk and revalidate it with conditional requests.
+        max_attempts (int): Maximum number of tries.
+    """
+
+    cache = cache and method.upper() == "GET"
+    params = kwargs.get("params")
+    cached = load_cached_response(url, params) if cache else None
+    kwargs["headers"] = {**(kwargs.get("headers") or {}), **get_conditional_headers(cached)}
+    client = get_client()
+
+    for attempt in range(1, max_attempts + 1):
+        time.sleep(reserve_token(url))
+        try:
+            response = client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            if attempt == max_attempts:
+                raise
+            time.sleep(get_retry_delay(attempt))
+            continue
+        if response.status_code not in RETRY_STATUS or attempt == max_attempts:
+            return finish_response(url, params, response, cached, cache)
+        time.sleep(get_retry_delay(attempt, response))
+
+
+async def arequest(client: httpx.AsyncClient, method: str, url: str, cache: bool = False, max_attempts: int = MAX_ATTEMPTS, **kwargs) -> httpx.Response:
+    """Async version of request, using a client created with new_async_client."""
+
+    cache = cache and method.upper() == "GET"
+    params = kwargs.get("params")
+    cached = load_cached_response(url, params) if cache else None
+    kwargs["headers"] = {**(kwargs.get("headers") or {}), **get_conditional_headers(cached)}
+
+    for attempt in range(1, max_attempts + 1):
+        await asyncio.sleep(reserve_token(url))
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            if attempt == max_attempts:
+                raise
+            await asyncio.sleep(get_retry_delay(attempt))
+            continue
+        if response.status_code not in RETRY_STATUS or attempt == max_attempts:
+            return finish_response(url, params, response, cached, cache)
+        await asyncio.sleep(get_retry_delay(attempt, response))
+
+
+def get(url: str, **kwargs) -> httpx.Response:
+    """Send a GET request, see request."""
+
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> httpx.Response:
+    """Send a POST request, see request."""
+
+    return request("POST", url, **kwargs)
+
+
+async def aget(client: httpx.AsyncClient, url: str, **kwargs) -> httpx.Response:
+    """Send a GET request with an async client, see request."""
+
+    return await arequest(client, "GET", url, **kwargs)
+
+
+def read_text(location: str, cache: bool = True) -> str:
+    """Return the text of a URL, fetched through the response cache, or of a local file."""
+
+    if urlsplit(location).scheme in ("http", "https"):
+        response = get(location, cache=cache)
+        response.raise_for_status()
+        return response.text
+
+    with open(location, "r", encoding="utf-8") as f:
+        return f.read()
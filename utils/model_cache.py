@@ -0,0 +1,314 @@
+"""
+model_cache.py
+
+Compiles a data model into a lightweight representation and caches it on disk, keyed by
+the hash of the model file and its file name, so tools working from the same model in one curation session
+parse it once.
+
+Supported inputs:
+  - schematic data model CSV (columns include Attribute and DependsOn)
+  - CRDC/GC data model TSV (columns include Node and Property)
+  - JSON schema (.json)
+  - any other CSV/TSV, treated as a metadata template whose columns are the attributes
+
+A compiled model is a dictionary with the keys:
+  source        path of the model file
+  hash          sha256 of the model file contents
+  format        one of 'schematic', 'crdc', 'json_schema', 'template'
+  components    component name: list of attribute keys
+  attributes    attribute key: {title, description, type, validation, valid_values, required}
+  edges         list of (source, target) dependency edges, component -> attribute and
+                attribute -> conditionally dependent attribute
+  table         the model as read, as a DataFrame of strings (None for JSON schemas)
+
+Compiled models are pickled to MODEL_CACHE_DIR (Default: ~/.cache/mc2_model_cache).
+
+usage: model_cache.py [-h] -m MODEL [MODEL ...] [-c CACHE_DIR] [-x]
+
+options:
+  -h, --help            show this help message and exit
+  -m MODEL [MODEL ...], --model MODEL [MODEL ...]
+                        Path to one or more data model or template files to compile
+  -c CACHE_DIR, --cache_dir CACHE_DIR
+                        Folder where compiled models are stored (Default: MODEL_CACHE_DIR or ~/.cache/mc2_model_cache)
+  -x, --clear           Boolean. Pass this flag to remove cached models before compiling (Default: None)
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import time
+from pathlib import Path
+
+import pandas as pd
+
+MODEL_CACHE_VERSION = 1  # increase when the compiled representation changes, to invalidate cached models
+DEFAULT_CACHE_DIR = os.environ.get(
+    "MODEL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "mc2_model_cache")
+)
+
+
+def get_args():
+    """Set up command-line interface and get arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-m",
+        "--model",
+        type=str,
+        nargs="+",
+        help="Path to one or more data model or template files to compile",
+        required=True,
+    )
+    parser.add_argument(
+        "-c",
+        "--cache_dir",
+        type=str,
+        help="Folder where compiled models are stored (Default: MODEL_CACHE_DIR or ~/.cache/mc2_model_cache)",
+        required=False,
+        default=DEFAULT_CACHE_DIR,
+    )
+    parser.add_argument(
+        "-x",
+        "--clear",
+        help="Boolean. Pass this flag to remove cached models before compiling (Default: None)",
+        action="store_true",
+        required=False,
+        default=None,
+    )
+    return parser.parse_args()
+
+
+def hash_file(path: str) -> str:
+    """Return the sha256 hex digest of a file's contents."""
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def read_model_table(path: str) -> pd.DataFrame:
+    """Read a tabular model or template as strings.
+    Files with a .csv suffix are read as comma-separated, all others as tab-separated."""
+
+    sep = "," if Path(path).suffix == ".csv" else "\t"
+
+    return pd.read_csv(path, header=0, keep_default_na=False, na_values="nan", sep=sep, dtype=str)
+
+
+def build_attribute(title, description="", type="", validation="", valid_values=(), required=False) -> dict:
+    """Build an attribute record for a compiled model."""
+
+    return {
+        "title": str(title),
+        "description": str(description),
+        "type": str(type),
+        "validation": str(validation),
+        "valid_values": tuple(valid_values),
+        "required": bool(required),
+    }
+
+
+def split_values(entry, sep: str = ", ") -> tuple[str, ...]:
+    """Split a delimited cell into a tuple of non-empty values."""
+
+    entry = "" if pd.isna(entry) else str(entry)
+
+    return tuple([value.strip() for value in entry.split(sep) if value.strip()])
+
+
+def compile_schematic_model(table: pd.DataFrame) -> tuple[dict, dict, list]:
+    """Compile a schematic data model CSV into components, attributes and dependency edges."""
+
+    table = table.fillna("")
+    components = {}
+    attributes = {}
+    edges = []
+    for row in table.to_dict("records"):
+        name = row["Attribute"]
+        depends_on = split_values(row["DependsOn"])
+        attributes[name] = build_attribute(
+            name,
+            row.get("Description", ""),
+            row.get("columnType", ""),
+            row.get("Validation Rules", ""),
+            split_values(row.get("Valid Values", "")),
+            str(row.get("Required", "")).strip().lower() == "true",
+        )
+        if "Component" in depends_on:
+            components[name] = [attribute for attribute in depends_on if attribute != "Component"]
+        edges.extend([(name, dependency) for dependency in depends_on if dependency != "Component"])
+
+    return components, attributes, edges
+
+
+def compile_crdc_model(table: pd.DataFrame) -> tuple[dict, dict, list]:
+    """Compile a CRDC/GC data model TSV into components, attributes and dependency edges.
+    Attribute keys are 'Node.Property', since property names repeat across nodes."""
+
+    table = table.fillna("")
+    components = {}
+    attributes = {}
+    edges = []
+    for row in table.to_dict("records"):
+        node, prop = row["Node"], row["Property"]
+        key = f"{node}.{prop}"
+        attributes[key] = build_attribute(
+            prop,
+            row.get("Description", ""),
+            row.get("Type", ""),
+            "",
+            split_values(row.get("Acceptable Values", ""), sep=","),
+            str(row.get("Required", "")).strip().lower() == "required",
+        )
+        components.setdefault(node, []).append(key)
+        edges.append((node, key))
+
+    return components, attributes, edges
+
+
+def compile_json_schema(schema_data: dict, name: str) -> tuple[dict, dict, list]:
+    """Compile a JSON schema into components, attributes and dependency edges.
+    The schema is treated as a single component; attribute keys are property names."""
+
+    component = schema_data.get("title", name)
+    required = set(schema_data.get("required", []))
+    attributes = {}
+    for property_name, property_data in schema_data.get("properties", {}).items():
+        if not isinstance(property_data, dict):
+            continue
+        items = property_data.get("items", {}) if isinstance(property_data.get("items"), dict) else {}
+        attributes[property_name] = build_attribute(
+            property_data.get("title", property_name),
+            property_data.get("description", ""),
+            property_data.get("type", ""),
+            property_data.get("pattern", ""),
+            [str(value) for value in property_data.get("enum", items.get("enum", []))],
+            property_name in required,
+        )
+    components = {component: list(attributes)}
+    edges = [(component, attribute) for attribute in attributes]
+
+    return components, attributes, edges
+
+
+def compile_model(path: str, file_hash: str | None = None) -> dict:
+    """Parse a data model, JSON schema or template file into a compiled model dictionary."""
+
+    file_hash = file_hash or hash_file(path)
+    name = Path(path).stem
+    table = None
+
+    if Path(path).suffix == ".json":
+        with open(path, "r", encoding="utf-8") as f:
+            schema_data = json.load(f)
+        model_format = "json_schema"
+        components, attributes, edges = compile_json_schema(schema_data, name)
+    else:
+        table = read_model_table(path)
+        if {"Attribute", "DependsOn"}.issubset(table.columns):
+            model_format = "schematic"
+            components, attributes, edges = compile_schematic_model(table)
+        elif {"Node", "Property"}.issubset(table.columns):
+            model_format = "crdc"
+            components, attributes, edges = compile_crdc_model(table)
+        else:
+            model_format = "template"
+            attributes = {column: build_attribute(column) for column in table.columns}
+            components = {name: list(attributes)}
+            edges = [(name, column) for column in attributes]
+
+    return {
+        "source": str(path),
+        "hash": file_hash,
+        "format": model_format,
+        "components": components,
+        "attributes": attributes,
+        "edges": edges,
+        "table": table,
+    }
+
+
+def get_cache_key(path: str, file_hash: str) -> str:
+    """Return the cache key for a model file.
+    The file name is part of the key, since its stem names template and JSON schema components
+    and its suffix chooses the separator the table is read with."""
+
+    name_hash = hashlib.sha256(Path(path).name.encode("utf-8")).hexdigest()[:16]
+
+    return f"{file_hash}_{name_hash}_v{MODEL_CACHE_VERSION}"
+
+
+def load_model(path: str, cache_dir: str = DEFAULT_CACHE_DIR) -> dict:
+    """Return the compiled model for a file, compiling and caching it if the file has not been seen before.
+    Args:
+        path (str): Path to a data model, JSON schema or template file.
+        cache_dir (str): Folder where compiled models are stored.
+    Returns:
+        dict: Compiled model, see the module docstring for its keys.
+    Raises:
+        FileNotFoundError: If the model file does not exist.
+        json.JSONDecodeError: If a JSON schema file is malformed."""
+
+    file_hash = hash_file(path)
+    cache_path = os.path.join(cache_dir, f"{get_cache_key(path, file_hash)}.pkl")
+
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                compiled = pickle.load(f)
+            compiled["source"] = str(path)
+            return compiled
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            print(f"Ignoring unreadable cached model {cache_path}: {e}")
+
+    compiled = compile_model(path, file_hash)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"Compiled model could not be cached in {cache_dir}: {e}")
+
+    return compiled
+
+
+def clear_cache(cache_dir: str = DEFAULT_CACHE_DIR) -> int:
+    """Remove all compiled models from the cache folder and return the number removed."""
+
+    if not os.path.isdir(cache_dir):
+        return 0
+    cached = [entry for entry in os.listdir(cache_dir) if entry.endswith(".pkl")]
+    for entry in cached:
+        os.remove(os.path.join(cache_dir, entry))
+
+    return len(cached)
+
+
+def main():
+
+    args = get_args()
+
+    if args.clear is not None:
+        removed = clear_cache(args.cache_dir)
+        print(f"{removed} cached models removed from {args.cache_dir}")
+
+    for model in args.model:
+        start = time.time()
+        compiled = load_model(model, args.cache_dir)
+        print(
+            f"{model} [{compiled['format']}]: {len(compiled['components'])} components, "
+            f"{len(compiled['attributes'])} attributes, {len(compiled['edges'])} edges "
+            f"({(time.time() - start) * 1000:.0f} ms)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,14 @@ arachne agent, as input.
 Returns a TSV file of General Commons metadata, built based on input CSV and
 the mapping JSON.
 
+The mapping is compiled into a plan so the input CSV is read once (or streamed
+in chunks with -c) for all targets, and target TSVs are written in parallel.
+
 author: orion.banks
 """
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import json
 import pandas as pd
 import os
@@ -25,6 +29,22 @@ def get_args():
         help="Path to mapping file generated by the arachne agent",
         required=True
     )
+	parser.add_argument(
+        "-c",
+		"--chunksize",
+        type=int,
+        help="Number of source rows to process at a time, for very large metadata CSVs (Default: None, read in one pass)",
+        required=False,
+		default=None
+    )
+	parser.add_argument(
+        "-w",
+		"--workers",
+        type=int,
+        help="Maximum number of target files written in parallel (Default: None, chosen by Python)",
+        required=False,
+		default=None
+    )
     
 	return parser.parse_args()
 
@@ -42,51 +62,119 @@ def build_mapping_config(mapping_file: str) -> dict:
 
 	return mapping
 
-def transform_csv_to_tsv(mapping_config):
-	"""Transform input CSV to TSV based on mapping configuration.
+def compile_transform_plan(mapping_config: dict) -> dict:
+	"""Compile a mapping configuration into an execution plan.
+	Each target is reduced to a list of column steps, and the source columns needed by all targets are collected,
+	so the source file can be read once for every target.
 	Args:
 		mapping_config (dict): Mapping configuration dictionary.
+	Returns:
+		dict: Plan with keys 'source_file', 'source_columns' and 'targets'.
+			Each target has an 'output_file' and 'steps', a list of (target column, operation, source column, value) tuples,
+			where operation is one of 'copy', 'map', 'constant' or 'empty'.
 	"""
-	source_file = mapping_config["source_file"]
+	source_columns = set()
+	targets = []
 	for target in mapping_config["targets"]:
-		output_file = target["output_file"].replace(".csv", ".tsv")
-		mappings = target["mappings"]
-		
-		# Read the input CSV file
-		df = pd.read_csv(source_file)
-		
-		# Prepare the output DataFrame
-		transformed_df = pd.DataFrame()
-		
-		for mapping in mappings:
+		steps = []
+		for mapping in target["mappings"]:
 			try:
 				source_col = mapping["source"]
 			except KeyError:
 				print(f"'source' key not found in mapping {mapping}. Assuming this will be a constant or empty.")
 				source_col = None
 			target_col = mapping["target"]
-			
+
 			if "value" in mapping:
-				if mapping["value"] is not None:
-					if "map" in mapping["value"]:
-						value_map = mapping["value"]["map"]
-						transformed_df[target_col] = df[source_col].map(value_map).fillna("")
-					else:
-						constant_value = mapping["value"]
-						transformed_df[target_col] = [constant_value] * df.shape[0]
+				value = mapping["value"]
+				if value is None:
+					steps.append((target_col, "empty", None, None))
+				elif isinstance(value, dict) and "map" in value:
+					steps.append((target_col, "map", source_col, value["map"]))
 				else:
-					transformed_df[target_col] = None
+					steps.append((target_col, "constant", None, value))
+			elif source_col is None:
+				steps.append((target_col, "empty", None, None))
 			else:
-				transformed_df[target_col] = df[source_col].fillna("")
+				steps.append((target_col, "copy", source_col, None))
+
+			if steps[-1][2] is not None:
+				source_columns.add(steps[-1][2])
+
+		targets.append({
+			"output_file": resolve_output_file(target["output_file"].replace(".csv", ".tsv")),
+			"steps": steps,
+		})
+
+	return {"source_file": mapping_config["source_file"], "source_columns": source_columns, "targets": targets}
+
+
+def resolve_output_file(output_file: str) -> str:
+	"""Create the folder for an output file, falling back to the 'mappings' folder if the path has no folder."""
+	try:
+		os.makedirs(os.path.dirname(output_file), exist_ok=True)
+	except FileNotFoundError:
+		os.makedirs("mappings", exist_ok=True)
+		output_file = "/".join(["mappings", output_file])
+
+	return output_file
+
+
+def apply_target_steps(df: pd.DataFrame, steps: list[tuple]) -> pd.DataFrame:
+	"""Build one target DataFrame from the source DataFrame using compiled column steps."""
+	columns = {}
+	for target_col, operation, source_col, value in steps:
+		if operation == "copy":
+			columns[target_col] = df[source_col].fillna("")
+		elif operation == "map":
+			columns[target_col] = df[source_col].map(value).fillna("")
+		elif operation == "constant":
+			columns[target_col] = pd.Series([value] * df.shape[0] if isinstance(value, (list, dict)) else value, index=df.index, dtype=object)
+		else:
+			columns[target_col] = pd.Series(None, index=df.index, dtype=object)
+
+	return pd.DataFrame(columns, index=df.index)
+
+
+def write_target_chunk(transformed_df: pd.DataFrame, output_file: str, first_chunk: bool) -> None:
+	"""Write, or append, transformed rows to a target TSV."""
+	transformed_df.to_csv(output_file, sep='\t', index=False, mode="w" if first_chunk else "a", header=first_chunk)
+
+
+def transform_csv_to_tsv(mapping_config, chunksize: int | None = None, workers: int | None = None):
+	"""Transform input CSV to TSV based on mapping configuration.
+	The source CSV is read once, or streamed in chunks, and every target is built from the same read.
+	Target files are written in parallel.
+	Args:
+		mapping_config (dict): Mapping configuration dictionary.
+		chunksize (int | None): Number of source rows to process at a time. If None, the source is read in one pass.
+		workers (int | None): Maximum number of target files written at the same time.
+	"""
+	plan = compile_transform_plan(mapping_config)
+	source_columns = plan["source_columns"]
+
+	# Read the input CSV file once, keeping only the columns used by a mapping
+	# Values are read as text, so a column is written the same way in every chunk
+	reader = pd.read_csv(
+		plan["source_file"],
+		usecols=lambda col: col in source_columns,
+		dtype=str,
+		keep_default_na=False,
+		chunksize=chunksize,
+	)
+	chunks = reader if chunksize else [reader]
+
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		for i, df in enumerate(chunks):
+			futures = [
+				executor.submit(write_target_chunk, apply_target_steps(df, target["steps"]), target["output_file"], i == 0)
+				for target in plan["targets"]
+			]
+			for future in futures:
+				future.result()
 
-		# Save the transformed DataFrame to TSV
-		try:
-			os.makedirs(os.path.dirname(output_file), exist_ok=True)
-		except FileNotFoundError:
-			os.makedirs("mappings", exist_ok=True)
-			output_file = "/".join(["mappings", output_file])
-		transformed_df.to_csv(output_file, sep='\t', index=False)
-		print(f"Transformed file saved to {output_file}")
+	for target in plan["targets"]:
+		print(f"Transformed file saved to {target['output_file']}")
 
 # Run the transformation
 def main():
@@ -95,7 +183,7 @@ def main():
     
 	mapping_config = build_mapping_config(args.mapping)
     
-	transform_csv_to_tsv(mapping_config)
+	transform_csv_to_tsv(mapping_config, args.chunksize, args.workers)
     
 if __name__ == "__main__":
 	main()
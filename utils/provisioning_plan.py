@@ -0,0 +1,252 @@
+"""provisioning_plan.py
+
+Plan/apply execution for scripts that make many Synapse changes in a row.
+
+A script first computes every change it intends to make into a plan, a JSON file listing
+operations. Each operation has:
+  id          unique name within the plan, e.g. "project:syn123"
+  action      name of the function that applies it, provided by the script as a handler
+  params      JSON parameters for the handler; {"$ref": [operation id, key]} is replaced with
+              a value returned by an earlier operation
+  depends_on  ids of operations that must be applied first
+
+The plan is then applied with a pool of threads. Each completed operation and its result are
+appended to a journal next to the plan (<plan>.journal.jsonl), so a run that fails or is
+interrupted can be resumed by applying the same plan again: operations already in the
+journal are skipped and their results are reused. Values chosen while planning, such as
+entity names, are fixed in the plan, so resuming does not create duplicates.
+
+Used by create_grant_projects.py, build_datasets.py, create_entity_links.py and create_id_folders.py.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+PLAN_VERSION = 1  # increase when the plan format changes
+DEFAULT_WORKERS = 8  # number of operations applied concurrently
+PROGRESS_INTERVAL = 50  # print progress after this many operations
+
+
+def new_operation(op_id: str, action: str, params: dict, depends_on: list[str] | None = None) -> dict:
+    """Build a plan operation."""
+
+    return {"id": op_id, "action": action, "params": params, "depends_on": list(depends_on or [])}
+
+
+def ref(op_id: str, key: str = "id") -> dict:
+    """Refer to a value returned by an earlier operation, to be used within operation params."""
+
+    return {"$ref": [op_id, key]}
+
+
+def hash_operations(operations: list[dict]) -> str:
+    """Return the sha256 hex digest of a list of operations."""
+
+    return hashlib.sha256(json.dumps(operations, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def build_plan(name: str, operations: list[dict], context: dict | None = None) -> dict:
+    """Build a plan from a list of operations.
+    Context holds any information the script needs after the plan is applied, e.g. to write output files."""
+
+    op_ids = [op["id"] for op in operations]
+    if len(set(op_ids)) != len(op_ids):
+        raise ValueError(f"Operation ids in plan '{name}' are not unique.")
+
+    return {
+        "name": name,
+        "version": PLAN_VERSION,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "hash": hash_operations(operations),
+        "context": context or {},
+        "operations": operations,
+    }
+
+
+def get_default_plan_path(name: str) -> str:
+    """Return a new plan file path in the current folder, named by plan name and time."""
+
+    return os.path.join(os.getcwd(), f"{name}_plan_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+
+
+def write_plan(plan: dict, plan_path: str) -> None:
+    """Write a plan to a JSON file."""
+
+    temp_path = f"{plan_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=2, default=str)
+    os.replace(temp_path, plan_path)
+
+    print(f"Plan with {len(plan['operations'])} operations written to {plan_path}")
+
+
+def load_plan(plan_path: str, name: str | None = None) -> dict:
+    """Read a plan from a JSON file, checking it was made for this script and version."""
+
+    with open(plan_path, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"Plan {plan_path} has version {plan.get('version')}, expected {PLAN_VERSION}.")
+    if name is not None and plan.get("name") != name:
+        raise ValueError(f"Plan {plan_path} was made by '{plan.get('name')}', not '{name}'.")
+
+    return plan
+
+
+def get_journal_path(plan_path: str) -> str:
+    """Return the journal path for a plan file."""
+
+    return f"{plan_path}.journal.jsonl"
+
+
+def load_journal(journal_path: str, plan_hash: str) -> dict[str, dict]:
+    """Read completed operations for a plan from its journal,
+    return an operation id: result dictionary.
+    Entries written for a different version of the plan, or left incomplete by a crash, are ignored."""
+
+    results = {}
+    if not os.path.exists(journal_path):
+        return results
+
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("plan") == plan_hash:
+                results[entry["id"]] = entry["result"]
+
+    return results
+
+
+def new_rate_limiter(max_rate: float | None) -> dict:
+    """Create a rate limiter shared by all threads applying a plan,
+    allowing at most max_rate operations to start per second (no limit if None)."""
+
+    return {"interval": 1 / max_rate if max_rate else 0.0, "next": 0.0, "lock": threading.Lock()}
+
+
+def wait_for_rate_limit(limiter: dict) -> None:
+    """Sleep until the rate limiter allows another operation to start."""
+
+    if not limiter["interval"]:
+        return
+    with limiter["lock"]:
+        now = time.monotonic()
+        start = max(now, limiter["next"])
+        limiter["next"] = start + limiter["interval"]
+    if start > now:
+        time.sleep(start - now)
+
+
+def resolve_params(params, results: dict[str, dict]):
+    """Replace references in operation params with results of earlier operations."""
+
+    if isinstance(params, dict):
+        if set(params) == {"$ref"}:
+            op_id, key = params["$ref"]
+            return results[op_id][key]
+        return {key: resolve_params(value, results) for key, value in params.items()}
+    if isinstance(params, list):
+        return [resolve_params(value, results) for value in params]
+
+    return params
+
+
+def apply_plan(syn, plan: dict, handlers: dict, journal_path: str, workers: int = DEFAULT_WORKERS, max_rate: float | None = None) -> tuple[dict, dict]:
+    """Apply plan operations concurrently, in dependency order, journaling each completed operation.
+    Operations already in the journal are not applied again.
+    Operations that fail, or depend on a failed operation, are reported and do not stop the others.
+    Args:
+        syn: Authenticated Synapse client instance.
+        plan (dict): Plan built with build_plan or read with load_plan.
+        handlers (dict): action name: function(syn, params) -> dict of JSON-serializable results.
+        journal_path (str): Path of the journal to resume from and append to.
+        workers (int): Maximum number of operations applied at the same time.
+        max_rate (float | None): Maximum number of operations started per second, across all threads.
+    Returns:
+        tuple[dict, dict]: operation id: result for completed operations, operation id: error message for failed operations.
+    """
+
+    results = load_journal(journal_path, plan["hash"])
+    resumed = len([op for op in plan["operations"] if op["id"] in results])
+    pending = {op["id"]: op for op in plan["operations"] if op["id"] not in results}
+    failed = {}
+    total = len(plan["operations"])
+    journal_lock = threading.Lock()
+    limiter = new_rate_limiter(max_rate)
+    start = time.time()
+
+    if resumed:
+        print(f"Resuming plan '{plan['name']}': {resumed}/{total} operations already applied")
+
+    def run_operation(op: dict) -> dict:
+        params = resolve_params(op["params"], results)
+        wait_for_rate_limit(limiter)
+        result = handlers[op["action"]](syn, params) or {}
+        with journal_lock:
+            with open(journal_path, "a", encoding="utf-8") as journal:
+                journal.write(json.dumps({"plan": plan["hash"], "id": op["id"], "result": result}, default=str) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        done_count = 0
+        while pending or running:
+            for op_id, op in list(pending.items()):
+                blocked_by = [dep for dep in op["depends_on"] if dep in failed]
+                if blocked_by:
+                    failed[op_id] = f"not applied, depends on failed operation {blocked_by[0]}"
+                    del pending[op_id]
+                elif all(dep in results for dep in op["depends_on"]):
+                    running[executor.submit(run_operation, op)] = op_id
+                    del pending[op_id]
+
+            if not running:
+                for op_id in pending:
+                    failed[op_id] = "not applied, depends on an operation missing from the plan"
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                op_id = running.pop(future)
+                try:
+                    results[op_id] = future.result()
+                except Exception as error:
+                    failed[op_id] = str(error)
+                    print(f"Operation {op_id} failed: {error}")
+                done_count += 1
+                if done_count % PROGRESS_INTERVAL == 0:
+                    print(f"--> {done_count + resumed}/{total} operations processed")
+
+    elapsed = time.time() - start
+    print(
+        f"Plan '{plan['name']}': {len(results) - resumed} operations applied, {resumed} resumed from journal, "
+        f"{len(failed)} failed ({elapsed:.1f} s)"
+    )
+
+    return results, failed
+
+
+def run_plan(syn, plan: dict, handlers: dict, plan_path: str, workers: int = DEFAULT_WORKERS, max_rate: float | None = None) -> tuple[dict, dict]:
+    """Write a plan, if it is not already stored at plan_path, and apply it.
+    If any operation fails, print how to resume the plan."""
+
+    if not os.path.exists(plan_path):
+        write_plan(plan, plan_path)
+
+    results, failed = apply_plan(syn, plan, handlers, get_journal_path(plan_path), workers, max_rate)
+
+    if failed:
+        print(f"❗ {len(failed)} operations were not applied. Run again with --apply {plan_path} to resume.")
+
+    return results, failed
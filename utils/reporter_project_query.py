@@ -1,10 +1,30 @@
 import json
 import argparse
-import requests
+import sys
 import numpy as np
 import math
+import time
 import pandas as pd
-from io import StringIO
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import http_client
+
+REPORTER_URL = "https://api.reporter.nih.gov/v2/projects/search"
+PAGE_SIZE = 500  # largest limit accepted by RePORTER
+MAX_RESULTS = 15000  # RePORTER does not accept offsets past 14999
+GRANTS_PER_REQUEST = 20  # grant numbers sent in one query
+DEFAULT_WORKERS = 4  # RePORTER requests in flight at the same time
+
+# RePORTER include field, report column, column dtype
+REPORT_FIELDS = [
+    ("ProjectTitle", "project_title", "string"),
+    ("ProjectNum", "project_num", "string"),
+    ("SubprojectId", "subproject_id", "string"),
+    ("FiscalYear", "fiscal_year", "Int64"),
+    ("ProjectEndDate", "project_end_date", "string"),
+]
+# RePORTER include field and column of the application ID, unique per result.
+# Pages are sorted on it so concurrent offset requests neither repeat nor skip results.
+KEY_FIELD = ("ApplId", "appl_id")
 
 
 def get_args():
@@ -23,123 +43,237 @@ def get_args():
         default=[],
         help="The list of years to use when searching for grant information.",
     )
-    parser.add_argument("-c", help="Path for CSV where converted JSON will be stored.")
+    parser.add_argument(
+        "-c",
+        default="reporter_results.csv",
+        help="Path for CSV where converted JSON will be stored. Paths ending in .parquet are written as Parquet, which requires pyarrow. (Default: reporter_results.csv)",
+    )
+    parser.add_argument(
+        "-w",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Number of RePORTER requests made at the same time (Default: {DEFAULT_WORKERS})",
+    )
 
     return parser.parse_args()
 
 
-def build_payload(grant_numbers, years, lim):
+def build_payload(grant_numbers, years, lim, offset=0):
 
     criteria_dict = dict(
         project_nums=grant_numbers, sub_project_only=True, fiscal_years=years
     )
 
-    include = [
-        "ProjectTitle",
-        "ProjectNum",
-        "SubprojectId",
-        "FiscalYear",
-        "ProjectEndDate",
-    ]
+    include = [field for field, _, _ in REPORT_FIELDS] + [KEY_FIELD[0]]
 
     payload = dict(
         criteria=criteria_dict,
         include_fields=include,
-        offset=0,
+        offset=offset,
         limit=lim,
-        sort_field="fiscal_year",
+        sort_field=KEY_FIELD[1],
         sort_order="desc",
     )
 
     json_payload = json.dumps(payload)
-    print(f"\n\nSUCCESS! Your query was converted to a valid JSON string")
 
     return json_payload
 
 
 def get_reporter_info(search_payload, header_content):
 
-    req = requests.post(
-        url="https://api.reporter.nih.gov/v2/projects/search",
+    req = http_client.post(
+        REPORTER_URL,
         headers=header_content,
-        data=search_payload,
+        content=search_payload,
     )
 
     return req
 
 
-def build_report(report_list, out_path):
+def get_reporter_page(grant_list, years, offset):
+    """Request one page of RePORTER results for a list of grants.
+    Requests are rate limited and transient failures retried by http_client.
+    Return the reply as a dictionary with 'meta' and 'results'."""
 
-    df_list = []
-    for report in report_list:
-        report_df = pd.read_json(StringIO(report), orient="records")
-        df_list.append(report_df)
+    query = build_payload(grant_numbers=grant_list, years=years, lim=PAGE_SIZE, offset=offset)
+    headers = {"content-type": "application/json"}
 
-    full_report = pd.concat(df_list).reset_index(drop=True)
+    report = get_reporter_info(query, headers)
+    if report.status_code != 200:
+        raise RuntimeError(
+            f"Reply included a {report.status_code} status code: {report.text}"
+        )
 
-    print(f"\n\nYour report is available at {out_path}.\n\n")
+    return report.json()
 
-    full_report.to_csv(out_path, index=False)
 
+def get_grant_chunks(grants):
+    """Split grant numbers into lists small enough for one RePORTER query."""
 
-def main():
+    grant_count = len(grants)
 
-    args = get_args()
+    if grant_count > GRANTS_PER_REQUEST:
+        split_count = math.ceil(grant_count / GRANTS_PER_REQUEST)
+        print(
+            f"Due to API restrictions, your query will be split into {split_count} parts"
+        )
+        return [g.tolist() for g in np.array_split(grants, split_count)]
 
-    in_grants, in_years, csvPath = args.g, args.y, args.c
+    return [grants]
 
-    grants = []
 
-    years = []
+def new_report_writer(out_path):
+    """Create the state for writing report pages to a CSV or Parquet file as they arrive."""
 
-    grants = [g + "*" for g in in_grants]
+    return {"path": out_path, "parquet": out_path.endswith(".parquet"), "writer": None, "rows": 0, "seen": set()}
 
-    years = [int(y) for y in in_years]
 
-    headers = {"content-type": "application/json"}
+def check_parquet_support():
+    """Return True if pyarrow, needed to write .parquet reports, is installed."""
 
-    max_request_length = int(400)
-    grant_count = int(len(grants))
-    req_per_grant = int(20)
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
 
-    if grant_count > max_request_length / req_per_grant:
-        split_count = math.ceil(grant_count / req_per_grant) + 1
-        print(
-            f"Due to API restrictions, your query will be split into {split_count} parts"
-        )
-        grant_chunks = [g.tolist() for g in np.array_split(grants, split_count)]
+    return True
 
-    else:
-        grant_chunks = [grants]
 
-    all_reports = []
+def build_page_df(records):
+    """Build a data frame with the report columns from a page of RePORTER results."""
+
+    page_df = pd.DataFrame.from_records(
+        records, columns=[column for _, column, _ in REPORT_FIELDS]
+    )
+
+    return page_df.astype({column: dtype for _, column, dtype in REPORT_FIELDS})
 
-    for grant_list in grant_chunks:
 
-        print(f"Building your RePORTER query...")
-        query = build_payload(
-            grant_numbers=grant_list, years=years, lim=max_request_length
+def write_report_page(report_writer, records):
+    """Append a page of RePORTER results to the report file.
+    Results already written from an earlier page, by application ID, are skipped."""
+
+    new_records = []
+    for record in records:
+        key = record.get(KEY_FIELD[1])
+        if key is None or key not in report_writer["seen"]:
+            report_writer["seen"].add(key)
+            new_records.append(record)
+
+    page_df = build_page_df(new_records)
+
+    if report_writer["parquet"]:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        page_table = pa.Table.from_pandas(page_df, preserve_index=False)
+        if report_writer["writer"] is None:
+            report_writer["writer"] = pq.ParquetWriter(report_writer["path"], page_table.schema)
+        report_writer["writer"].write_table(page_table)
+    else:
+        first_page = report_writer["writer"] is None
+        page_df.to_csv(
+            report_writer["path"], index=False, mode="w" if first_page else "a", header=first_page
         )
+        report_writer["writer"] = "csv"
+
+    report_writer["rows"] += len(page_df)
+
+
+def close_report_writer(report_writer):
+    """Finish the report file, writing an empty report if no results were returned."""
+
+    if report_writer["writer"] is None:
+        write_report_page(report_writer, [])
+    if report_writer["parquet"]:
+        report_writer["writer"].close()
+
+
+def query_reporter(grant_chunks, years, out_path, workers=DEFAULT_WORKERS):
+    """Query RePORTER for each list of grants, paging through all results,
+    and stream the results into the report file.
+    Pages are requested concurrently, within the RePORTER rate limit set in http_client.
+    Return a list of (query part, offset) pairs for pages that could not be retrieved."""
+
+    report_writer = new_report_writer(out_path)
+    failed = []
+    start = time.time()
+
+    print(f"\n\nSubmitting your query to RePORTER...")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {
+            executor.submit(get_reporter_page, grant_list, years, 0): (i, 0)
+            for i, grant_list in enumerate(grant_chunks)
+        }
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                chunk_index, offset = running.pop(future)
+                try:
+                    reply = future.result()
+                except Exception as error:
+                    failed.append((chunk_index + 1, offset))
+                    print(f"Not quite! Query part {chunk_index + 1}, offset {offset} failed: {error}")
+                    continue
+
+                write_report_page(report_writer, reply["results"])
+
+                if offset == 0:
+                    total = reply["meta"]["total"]
+                    print(
+                        f"Query part {chunk_index + 1} of {len(grant_chunks)} has {total} results"
+                    )
+                    if total > MAX_RESULTS:
+                        print(
+                            f"❗ RePORTER only returns the first {MAX_RESULTS} results, "
+                            f"split query part {chunk_index + 1} into smaller parts to get the rest"
+                        )
+                    for next_offset in range(PAGE_SIZE, min(total, MAX_RESULTS), PAGE_SIZE):
+                        running[
+                            executor.submit(
+                                get_reporter_page,
+                                grant_chunks[chunk_index],
+                                years,
+                                next_offset,
+                            )
+                        ] = (chunk_index, next_offset)
+
+    close_report_writer(report_writer)
+
+    print(
+        f"\n\nYour report with {report_writer['rows']} results is available at {out_path} "
+        f"({time.time() - start:.1f} s)."
+    )
+    if failed:
+        print(f"❗ {len(failed)} pages could not be retrieved, the report is incomplete:")
+        for chunk_number, offset in sorted(failed):
+            print(f"  query part {chunk_number}, offset {offset}: {' '.join(grant_chunks[chunk_number - 1])}")
+        print("\n")
+
+    return failed
+
+
+def main():
+
+    args = get_args()
+
+    in_grants, in_years, csvPath = args.g, args.y, args.c
+
+    if csvPath.endswith(".parquet") and not check_parquet_support():
+        print("❗ Writing a .parquet report requires pyarrow. Install it with 'pip install pyarrow', or use a .csv path.")
+        sys.exit(1)
+
+    grants = [g + "*" for g in in_grants]
+
+    years = [int(y) for y in in_years]
+
+    grant_chunks = get_grant_chunks(grants)
+
+    failed = query_reporter(grant_chunks, years, csvPath, args.w)
 
-        print(f"\n\nSubmitting your query to RePORTER...")
-        report = get_reporter_info(query, headers)
-        status = report.status_code
-        
-        if status == 200:
-            print(
-                f"\n\nSUCCESS! Reply included a {report.status_code} status code!\n\nBuilding report from results..."
-            )
-            json_report = report.json()
-            json_report = json.dumps(json_report["results"])
-            all_reports.append(json_report)
-
-        else:
-            print(
-                f"Not quite! Reply included a {report.status_code} status code. Please review the response to diagnose the error.\n\n"
-            )
-            print(json_report)
-
-    build_report(all_reports, csvPath)
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
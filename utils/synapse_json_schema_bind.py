@@ -12,8 +12,8 @@ author: orion.banks
 import synapseclient
 import argparse
 import pandas as pd
-import requests
 import json
+import http_client
 
 
 def get_args():
@@ -180,7 +180,8 @@ def get_schema_from_url(url: str, path: str, version: str = None) -> tuple[any,
     if url or path is not None:
         if url is not None:
             schema = url
-            source_schema = requests.get(url)
+            source_schema = http_client.get(url, cache=True)
+            source_schema.raise_for_status()
             schema_json = source_schema.json()
         else:
             schema = path
@@ -2,27 +2,44 @@
 
 This script will query a Synapse table for metadata and apply it to an entity as annotations.
 
-usage: table_to_annotations.py [-h] -t T [-v V] [-f F] [-s S] [-i I] [-m M] [-g G]
+usage: table_to_annotations.py [-h] -t T [T ...] [-v V] [-f F] [-s S] [-i I] [-m M] [-g G] [-w W]
 
 options:
   -h, --help  show this help message and exit
-  -t T        Synapse Id of a dataset with files to annotate
+  -t T [T ...]
+              Synapse Id of one or more datasets with files to annotate. Source tables are queried once for all datasets.
   -v V        Synapse Id of a table containing DatasetView metadata
   -f F        Synapse Id of a table containing File View metadata.
   -s S        Synapse Id of a table containing Biospecimen metadata.
   -i I        Synapse Id of a table containing Individual metadata.
   -m M        Synapse Id of a table containing Model metadata.
   -g G        Synapse Id of a table containing ADA-PSI Study metadata.
+  -w W        Number of entities annotated concurrently. (Default: 8)
 author: orion.banks
 """
 
 import synapseclient
 import argparse
 import pandas as pd
+import random
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from synapseclient.models import RecordSet
 
+DEFAULT_WORKERS = 8  # number of concurrent annotation writers
+MAX_WRITE_ATTEMPTS = 6  # attempts per entity before it is reported as failed
+WRITE_RETRY_STATUS = {429, 500, 502, 503, 504}  # throttled or server error, retry after backing off
+WRITE_CONFLICT_STATUS = 412  # etag conflict, annotations changed since they were retrieved
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 60.0
+PROGRESS_INTERVAL = 100  # print progress after this many entities
+QUOTED_VALUE_PATTERN = re.compile(r'"(.*?)"')  # values within RecordSet list literal cells
+QUERY_BATCH_SIZE = 500  # keys per WHERE ... IN (...) clause
+QUERY_PAGE_SIZE = 50000  # rows per page of a filtered table query
+
 
 def get_args():
     """Set up command-line interface and get arguments."""
@@ -30,7 +47,8 @@ def get_args():
     parser.add_argument(
         "-t",
         type=str,
-        help="Synapse Id of a dataset with files to annotate",
+        nargs="+",
+        help="Synapse Id of one or more datasets with files to annotate. Source tables are queried once for all datasets.",
         required=True,
     )
     parser.add_argument(
@@ -75,9 +93,42 @@ def get_args():
         required=False,
         default=None,
     )
+    parser.add_argument(
+        "-w",
+        type=int,
+        help=f"Number of entities annotated concurrently. (Default: {DEFAULT_WORKERS})",
+        required=False,
+        default=DEFAULT_WORKERS,
+    )
     return parser.parse_args()
 
 
+def parse_quoted_values(column: pd.Series) -> pd.Series:
+    """Parse RecordSet list literal cells in a column, e.g. '["a", "b"]', into lists of their quoted values.
+    Cells without quoted values, or that are not strings, are kept as they are.
+    Each distinct cell value is parsed once, since RecordSet columns repeat values across rows."""
+
+    if column.dtype != object:
+        return column
+
+    parsed_values = {}
+    for value in column.dropna().unique():
+        entry = QUOTED_VALUE_PATTERN.findall(value) if isinstance(value, str) else []
+        parsed_values[value] = entry if len(entry) > 0 else value
+
+    # Missing values are not in parsed_values, since separate NaN objects do not match as keys
+    return pd.Series([parsed_values.get(value, value) for value in column], index=column.index, dtype=object)
+
+
+def parse_record_set_columns(table: pd.DataFrame, cols: list | None = None) -> pd.DataFrame:
+    """Select columns from a RecordSet Dataframe, if provided,
+    and parse list literal cells in each column into lists of values."""
+
+    table = table[cols if cols is not None else table.columns.tolist()]
+
+    return pd.DataFrame({col: parse_quoted_values(table[col]) for col in table.columns}, index=table.index)
+
+
 def get_table(syn, source_id: str, cols: str | list = "*", is_record_set: bool = False) -> pd.DataFrame:
     """Collect columns from a Synapse table entity and return as a Dataframe."""
 
@@ -87,12 +138,7 @@ def get_table(syn, source_id: str, cols: str | list = "*", is_record_set: bool =
     if is_record_set:
         file = RecordSet(source_id).get()
         data = file.path
-        table = pd.read_csv(data, header=0).fillna("")
-        table = table[cols]
-        for _, row in table.iterrows():
-            for col in cols:
-                entry = re.findall(r'"(.*?)"', row[col])
-                table.at[_, col] = entry if len(entry) > 0 else row[col]
+        table = parse_record_set_columns(pd.read_csv(data, header=0).fillna(""), cols)
     else:
         query = f"SELECT {cols} FROM {source_id}"
         table = syn.tableQuery(query).asDataFrame().fillna("")
@@ -102,141 +148,337 @@ def get_table(syn, source_id: str, cols: str | list = "*", is_record_set: bool =
     return table
 
 
-def collect_fileview_annotations(syn, files: list, fileview_id: str) -> dict:
-    """Collect all Biospecimen and File identifiers from a File View metadata table,
+def quote_value(value) -> str:
+    """Quote a value for use in a Synapse table query."""
+
+    return "".join(["'", str(value).replace("'", "''"), "'"])
+
+
+def iter_table_rows(
+    syn,
+    source_id: str,
+    cols: list[str],
+    key_column: str,
+    keys,
+    batch_size: int = QUERY_BATCH_SIZE,
+    page_size: int = QUERY_PAGE_SIZE,
+):
+    """Query rows of a Synapse table whose key_column value is in keys,
+    using WHERE ... IN (...) clauses of at most batch_size keys, each read in pages of page_size rows.
+    Pages are ordered by ROW_ID, so rows are neither repeated nor skipped between pages.
+    Yield each page as a Dataframe, so results can be processed without holding the full table."""
+
+    keys = sorted({str(key) for key in keys if key != ""})
+    col_string = ", ".join(["".join(['"', col, '"']) for col in cols])
+
+    for start in range(0, len(keys), batch_size):
+        key_string = ", ".join([quote_value(key) for key in keys[start:start + batch_size]])
+        offset = 0
+        while True:
+            query = (
+                f'SELECT {col_string} FROM {source_id} WHERE "{key_column}" IN ({key_string}) '
+                f"ORDER BY ROW_ID LIMIT {page_size} OFFSET {offset}"
+            )
+            page = syn.tableQuery(query).asDataFrame().fillna("")
+            if len(page) > 0:
+                yield page
+            if len(page) < page_size:
+                break
+            offset += page_size
+
+
+def get_filtered_table(syn, source_id: str, cols: list[str], key_column: str, keys) -> pd.DataFrame:
+    """Collect columns from the rows of a Synapse table whose key_column value is in keys and return as a Dataframe."""
+
+    pages = list(iter_table_rows(syn, source_id, cols, key_column, keys))
+    table = pd.concat(pages, ignore_index=True) if pages else pd.DataFrame(columns=cols)
+
+    print(f"Data acquired from Synapse table {source_id} ({len(table)} matching rows)")
+
+    return table
+
+
+def index_fileview(syn, fileview_id: str, files) -> dict:
+    """Collect Biospecimen and File identifiers for the given files from a File View metadata table,
     return a File Synapse Id: Biospecimen Key dictionary"""
 
     fileview_columns = ["FileView_id", "Biospecimen Key"]
 
-    fileview_table = get_table(syn, fileview_id, fileview_columns)
+    file_biospecimen_index = {}
+    for page in iter_table_rows(syn, fileview_id, fileview_columns, "FileView_id", files):
+        file_biospecimen_index.update(zip(page["FileView_id"], page["Biospecimen Key"]))
+
+    print(f"Data acquired from Synapse table {fileview_id} ({len(file_biospecimen_index)} matching files)")
+
+    return file_biospecimen_index
+
+
+def collect_fileview_annotations(file_biospecimen_index: dict, files: list) -> dict:
+    """Select File View entries for the files in a dataset,
+    return a File Synapse Id: Biospecimen Key dictionary"""
 
-    file_biospecimen_mapping = {
-        row["FileView_id"]: row["Biospecimen Key"]
-        for _, row in fileview_table.iterrows()
-        if row["FileView_id"] in files
+    return {
+        file_id: file_biospecimen_index[file_id]
+        for file_id in files
+        if file_id in file_biospecimen_index
     }
 
-    return file_biospecimen_mapping
 
+def get_record_annotations(table: pd.DataFrame, key_column: str) -> dict[str, list[tuple[str, str]]]:
+    """Index a metadata table by its primary key,
+    return a Key: [(column name, value), ...] dictionary.
+    If a key appears more than once, the first entry is used."""
 
-def collect_biospecimen_annotations(
+    table = table.drop_duplicates(subset=key_column, keep="first").set_index(key_column)
+    columns = table.columns.tolist()
+
+    return {
+        key: list(zip(columns, values))
+        for key, values in zip(table.index, table.itertuples(index=False, name=None))
+    }
+
+
+def load_file_annotation_sources(
     syn,
-    file_biospecimen_dict: dict,
     specimen_info_tuple: tuple[str, str, list[str]],
-    keys_to_drop: list[str],
-) -> tuple[dict, dict, dict]:
-    """Collect all entries from a Biospecimen metadata table,
-    select entries where Biospecimen_id is present in Biospecimen Keys associated with files,
-    match Biospecimen metadata with column names to create key:value pairs,
-    apply annotations to each file,
-    return File Id: Individual Key and File Id: Model Key dictionaries
-    """
-
-    individual_dict = {}
-    model_dict = {}
-
-    component, table_id, column_list = specimen_info_tuple
-    data_table = get_table(syn, table_id, column_list).set_index("Biospecimen_id")
-    column_list.pop(0)  # remove Biospecimen_id from list of columns, since it is now the index
-    biospecimen_ids = set(file_biospecimen_dict.values())
-    filtered_metadata = data_table[data_table.index.isin(biospecimen_ids)]
-    count = 0
-    for file_id, biospecimen_key in file_biospecimen_dict.items():
-        if biospecimen_key in filtered_metadata.index:
-            metadata = filtered_metadata.loc[biospecimen_key]
-            individual_id = metadata["Individual Key"]
-            model_id = metadata["Model Key"]
-            individual_dict[file_id] = individual_id
-            model_dict[file_id] = model_id
-            biospecimen_annotations = list(zip(column_list, metadata.tolist()))
-            apply_annotations_to_entity(
-                syn, component, file_id, biospecimen_annotations, keys_to_drop
-            )
-            count += 1
-        else:
-            print(f"Metadata not found for: {biospecimen_key}")
+    record_info_tuples: list[tuple[str, str, list[str]]],
+    biospecimen_keys,
+) -> tuple[pd.DataFrame, list[tuple[str, dict]]]:
+    """Query Biospecimen and record (e.g. Individual, Model) metadata tables once and index them by key,
+    return the Biospecimen link keys and a list of (link column, Key: annotations dictionary) tuples,
+    ordered Biospecimen first, then records in the order provided.
+    Only Biospecimen entries in biospecimen_keys, and records they link to, are queried."""
+
+    _, specimen_table_id, specimen_columns = specimen_info_tuple
+    specimen_table = get_filtered_table(syn, specimen_table_id, specimen_columns, "Biospecimen_id", biospecimen_keys)
+
+    specimen_keys = specimen_table[["Biospecimen_id", "Individual Key", "Model Key"]].drop_duplicates(
+        subset="Biospecimen_id", keep="first"
+    )
 
-    print(f"Biospecimen annotations applied to {count} entities")
-    return individual_dict, model_dict
+    annotation_sources = [
+        ("Biospecimen Key", get_record_annotations(specimen_table, "Biospecimen_id"))
+    ]
+    for component, table_id, column_list in record_info_tuples:
+        record_table = get_filtered_table(
+            syn, table_id, column_list, f"{component}_id", specimen_table[f"{component} Key"].unique()
+        )
+        annotation_sources.append(
+            (f"{component} Key", get_record_annotations(record_table, f"{component}_id"))
+        )
 
+    return specimen_keys, annotation_sources
 
-def collect_record_annotations(
-    syn,
-    info_tuple: tuple[str, str, list[str]],
-    tuple_dict: dict,
-    keys_to_drop: list[str],
-):
-    """Collect all entries from a Synapse table,
-    select entries where primary key (e.g. Individual_id) matches foreign key (e.g. Individual Key),
-    based on dictionary output from collect_biospecimen_annotations,
-    apply annotations to each file"""
 
-    component, table_id, column_list = info_tuple
-    key_column = f"{component}_id" 
-    data_table = get_table(syn, table_id, column_list).set_index(key_column)
-    column_list.pop(0)  # remove Component_id from list of columns, since it is now the index
-    table_keys = set(tuple_dict.values())
-    filtered_metadata = data_table[data_table.index.isin(table_keys)]
-    count = 0
-    for file_id, table_key in tuple_dict.items():
-        if table_key in filtered_metadata.index:
-            metadata = filtered_metadata.loc[table_key]
-            annotations = list(zip(column_list, metadata.tolist()))
-            apply_annotations_to_entity(
-                syn, component, file_id, annotations, keys_to_drop
-            )
-            count += 1
+def collect_file_annotations(
+    file_biospecimen_dict: dict,
+    specimen_keys: pd.DataFrame,
+    annotation_sources: list[tuple[str, dict]],
+) -> dict[str, list[tuple[str, str]]]:
+    """Join File View, Biospecimen and record (e.g. Individual, Model) metadata,
+    return a File Synapse Id: annotations dictionary with one combined list of annotations per file.
+    Annotations are ordered Biospecimen first, then records in the order provided,
+    so later sources take precedence for shared columns, as when each table was applied separately."""
+
+    file_links = pd.DataFrame(
+        list(file_biospecimen_dict.items()), columns=["FileView_id", "Biospecimen Key"]
+    )
+    file_links = file_links.merge(
+        specimen_keys, how="left", left_on="Biospecimen Key", right_on="Biospecimen_id", indicator=True
+    )
 
-    print(f"{component} annotations applied to {count} entities")
+    for biospecimen_key in file_links.loc[file_links["_merge"] == "left_only", "Biospecimen Key"]:
+        print(f"Metadata not found for: {biospecimen_key}")
+    file_links = file_links[file_links["_merge"] == "both"]
 
+    file_annotations = {}
+    for link in file_links.to_dict("records"):
+        annotations = []
+        for link_column, record_annotations in annotation_sources:
+            annotations.extend(record_annotations.get(link[link_column], []))
+        file_annotations[link["FileView_id"]] = annotations
 
-def collect_database_annotations(
-    syn, target_id: str, info_tuple: tuple[str, str, list[str]], keys_to_drop: list[str], is_record_set: bool = False
-):
-    """Collect all entries from a Synapse table or RecordSet,
-    select entry where input table Synapse Id matches Component_id,
-    apply annotations to the Dataset"""
+    return file_annotations
+
+
+def load_database_annotations(
+    syn, info_tuple: tuple[str, str, list[str]], is_record_set: bool = False
+) -> dict[str, list[tuple[str, str]]]:
+    """Collect all entries from a Synapse table or RecordSet once,
+    return a target Synapse Id: annotations dictionary.
+    DatasetView entries are keyed by DatasetView_id, Study entries by StudyProjectIdentifier."""
 
     component, table_id, column_list = info_tuple
-    
+
     data_table = get_table(syn, table_id, column_list, is_record_set)
-    
-    if component == "DatasetView":
-        key_column = f"{component}_id"
-        data_table.set_index(key_column, inplace=True)
-        if target_id in data_table.index:
-            metadata = data_table.loc[target_id]
+
     if component == "Study":
-        key_column = f"{component.lower()}Id"
         data_table["StudyProjectIdentifier"] = data_table["StudyProjectIdentifier"].apply(lambda x: "".join(x) if isinstance(x, list) else x)
-        data_table.set_index(key_column, inplace=True)
-        metadata = data_table.loc[data_table["StudyProjectIdentifier"] == target_id].to_numpy()
-    
-    column_list.pop(0)  # remove id from list of columns, since it is now the index
-    annotations = list(zip(column_list, metadata.tolist()))
-    apply_annotations_to_entity(syn, component, target_id, annotations, keys_to_drop)
+        return get_record_annotations(data_table.drop(columns=f"{component.lower()}Id"), "StudyProjectIdentifier")
+
+    return get_record_annotations(data_table, f"{component}_id")
+
+
+def collect_database_annotations(
+    component: str, targets: list[str], database_annotations: dict[str, list[tuple[str, str]]]
+) -> dict[str, list[tuple[str, str]]]:
+    """Select the entries matching each target Synapse Id from indexed table or RecordSet annotations,
+    return a target Synapse Id: annotations dictionary"""
+
+    target_annotations = {}
+    for target_id in targets:
+        if target_id in database_annotations:
+            target_annotations[target_id] = database_annotations[target_id]
+        else:
+            print(f"{component} metadata not found for: {target_id}")
+
+    return target_annotations
+
+
+def annotation_matches(current, new) -> bool:
+    """Check if an existing annotation value already equals a new value.
+    Synapse returns annotation values as lists, so single values are compared as one-item lists."""
+
+    current_values = current if isinstance(current, list) else [current]
+    new_values = new if isinstance(new, list) else [new]
+
+    return [str(value) for value in current_values] == [str(value) for value in new_values]
+
+
+def build_annotation_updates(new_annotations: list[tuple[str, str]], keys_to_drop: list) -> dict:
+    """Filter out empty annotations and keys in keys_to_drop,
+    return a key: value dictionary with spaces removed from keys."""
+
+    keys_to_drop = keys_to_drop or []
+
+    return {
+        key.replace(" ", ""): annot
+        for key, annot in new_annotations
+        if len(annot) > 0 and key not in keys_to_drop
+    }
+
+
+def get_status_code(error) -> int | None:
+    """Return the HTTP status code of a Synapse error, if it has one."""
+
+    return getattr(getattr(error, "response", None), "status_code", None)
 
-def apply_annotations_to_entity(
+
+def new_backoff() -> dict:
+    """Create the backoff state shared by all writer threads."""
+
+    return {"delay": 0.0, "lock": threading.Lock()}
+
+
+def slow_down(backoff: dict, error) -> None:
+    """Increase the shared delay between requests after a throttled or failed request.
+    A Retry-After header sent with the error is used if it asks for a longer wait."""
+
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        retry_after = float(headers.get("Retry-After", 0))
+    except ValueError:
+        retry_after = 0.0
+    with backoff["lock"]:
+        backoff["delay"] = min(max(backoff["delay"] * 2, BACKOFF_BASE_SECONDS, retry_after), BACKOFF_MAX_SECONDS)
+
+
+def speed_up(backoff: dict) -> None:
+    """Decrease the shared delay between requests after a successful request."""
+
+    with backoff["lock"]:
+        backoff["delay"] = backoff["delay"] / 2 if backoff["delay"] > BACKOFF_BASE_SECONDS else 0.0
+
+
+def wait_for_backoff(backoff: dict) -> None:
+    """Sleep for the current shared delay, with jitter so threads do not retry in step."""
+
+    delay = backoff["delay"]
+    if delay > 0:
+        time.sleep(delay * random.uniform(0.5, 1.5))
+
+
+def write_annotations(syn, entity_id: str, updates: dict, backoff: dict | None = None) -> bool:
+    """Retrieve current annotations for a Synapse entity, merge updates into them and store them.
+    Requests are retried on throttling (429) and server errors (5xx), slowing down all writers sharing backoff.
+    If the entity's annotations changed since they were retrieved (412, etag conflict),
+    they are retrieved again and the updates are reapplied.
+    Return True if annotations were stored, False if all annotations already matched."""
+
+    backoff = backoff or new_backoff()
+    for attempt in range(1, MAX_WRITE_ATTEMPTS + 1):
+        wait_for_backoff(backoff)
+        try:
+            entity_annotations = syn.get_annotations(entity_id)
+            if all(
+                key in entity_annotations and annotation_matches(entity_annotations[key], annot)
+                for key, annot in updates.items()
+            ):
+                speed_up(backoff)
+                return False
+            for key, annot in updates.items():
+                entity_annotations[key] = annot
+            syn.set_annotations(entity_annotations)
+            speed_up(backoff)
+            return True
+        except synapseclient.core.exceptions.SynapseHTTPError as error:
+            status = get_status_code(error)
+            if attempt == MAX_WRITE_ATTEMPTS:
+                raise
+            if status == WRITE_CONFLICT_STATUS:
+                continue
+            if status in WRITE_RETRY_STATUS:
+                slow_down(backoff, error)
+                continue
+            raise
+
+
+def apply_annotations_concurrently(
     syn,
     component: str,
-    entity_id: str,
-    new_annotations: list[tuple[str, str]],
+    entity_annotations: dict[str, list[tuple[str, str]]],
     keys_to_drop: list,
-):
-    """Apply annotations to a Synapse entity by:
-    retrieving current annotations,
-    filtering to remove empty annotations,
-    filtering to remove keys in keys_to_drop,
-    converting new_annotations tuple to key:value pairs within the retrieved annotation object,
-    storing modified annotation object in Synapse."""
-
-    entity_annotations = syn.get_annotations(entity_id)
-    filtered_annotations = [tup for tup in new_annotations if len(tup[1]) > 0]
-    for key, annot in filtered_annotations:
-        if key not in keys_to_drop:
-            entity_annotations[key.replace(" ", "")] = annot
-    syn.set_annotations(entity_annotations)
-    print(f"{component} annotations applied to Synapse entity: {entity_id}\n")
+    workers: int = DEFAULT_WORKERS,
+) -> dict[str, list[str]]:
+    """Apply annotations to many Synapse entities with a bounded pool of writer threads.
+    All writers share one backoff state, so throttling seen by one slows down all of them.
+    Progress is printed every PROGRESS_INTERVAL entities, followed by a throughput summary.
+    Entities that still fail after retrying are reported and do not stop the job.
+    Return a dictionary of Synapse Ids by outcome: 'applied', 'up to date' and 'failed'."""
+
+    backoff = new_backoff()
+    outcomes = {"applied": [], "up to date": [], "failed": []}
+    total = len(entity_annotations)
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                write_annotations, syn, entity_id, build_annotation_updates(annotations, keys_to_drop), backoff
+            ): entity_id
+            for entity_id, annotations in entity_annotations.items()
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            entity_id = futures[future]
+            try:
+                outcomes["applied" if future.result() else "up to date"].append(entity_id)
+            except Exception as error:
+                outcomes["failed"].append(entity_id)
+                print(f"{component} annotations could not be applied to Synapse entity {entity_id}: {error}")
+            if done % PROGRESS_INTERVAL == 0 and done < total:
+                elapsed = time.time() - start
+                print(f"{component} annotations: {done}/{total} entities processed ({done / elapsed:.1f} entities/s)")
+
+    elapsed = time.time() - start
+    print(
+        f"{component} annotations applied to {len(outcomes['applied'])} entities, "
+        f"{len(outcomes['up to date'])} already up to date, {len(outcomes['failed'])} failed "
+        f"({total} entities in {elapsed:.1f} s, {total / elapsed if elapsed > 0 else 0:.1f} entities/s)"
+    )
+    if outcomes["failed"]:
+        print(f"Failed entities: {', '.join(outcomes['failed'])}")
+
+    return outcomes
 
 
 def main():
@@ -246,13 +488,14 @@ def main():
     args = get_args()
 
     (
-        target,
+        targets,
         datasetview_table,
         file_table, specimen_table,
         individual_table,
         model_table,
         ada_psi_study_table,
-    ) = (args.t, args.v, args.f, args.s, args.i, args.m, args.g)
+        workers,
+    ) = (args.t, args.v, args.f, args.s, args.i, args.m, args.g, args.w)
 
     duo_only = True
 
@@ -432,31 +675,41 @@ def main():
     duo_ada_psi_study_info_tuple = ("Study", ada_psi_study_table, study_duo_only_columns)
     keys_to_drop = ["Study Key", "StudyProjectIdentifier"]
 
-    if file_table is not None:
-        files = get_table(syn, target, cols="id")["id"].tolist()
-        file_view_out = collect_fileview_annotations(syn, files, file_table)
-
-        if specimen_table is not None:
-            ind_dict, model_dict = collect_biospecimen_annotations(
-                syn, file_view_out, specimen_info_tuple, keys_to_drop
-            )
-
-        if individual_table is not None:
-            collect_record_annotations(
-                syn, individual_info_tuple, ind_dict, keys_to_drop
-            )
-
-        if model_table is not None:
-            collect_record_annotations(syn, model_info_tuple, model_dict, keys_to_drop)
+    if file_table is not None and specimen_table is not None:
+        target_files = {target: get_table(syn, target, cols="id")["id"].tolist() for target in targets}
+        file_biospecimen_index = index_fileview(
+            syn, file_table, {file_id for files in target_files.values() for file_id in files}
+        )
+        record_info_tuples = [
+            info_tuple
+            for info_tuple in [individual_info_tuple, model_info_tuple]
+            if info_tuple[1] is not None
+        ]
+        specimen_keys, annotation_sources = load_file_annotation_sources(
+            syn, specimen_info_tuple, record_info_tuples, set(file_biospecimen_index.values())
+        )
+
+        file_annotations = {}
+        for target, files in target_files.items():
+            file_view_out = collect_fileview_annotations(file_biospecimen_index, files)
+            target_annotations = collect_file_annotations(file_view_out, specimen_keys, annotation_sources)
+            print(f"Biospecimen metadata found for {len(target_annotations)} files in {target}")
+            file_annotations.update(target_annotations)
+
+        apply_annotations_concurrently(syn, "File", file_annotations, keys_to_drop, workers)
 
     if datasetview_table is not None:
-        collect_database_annotations(syn, target, dataset_info_tuple, keys_to_drop=None)
+        dataset_annotations = collect_database_annotations(
+            "DatasetView", targets, load_database_annotations(syn, dataset_info_tuple)
+        )
+        apply_annotations_concurrently(syn, "DatasetView", dataset_annotations, None, workers)
     
     if ada_psi_study_table is not None:
-        if duo_only is True:
-            collect_database_annotations(syn, target, duo_ada_psi_study_info_tuple, keys_to_drop, is_record_set=True)
-        else:
-            collect_database_annotations(syn, target, ada_psi_study_info_tuple, keys_to_drop, is_record_set=True)
+        study_info_tuple = duo_ada_psi_study_info_tuple if duo_only is True else ada_psi_study_info_tuple
+        study_annotations = collect_database_annotations(
+            "Study", targets, load_database_annotations(syn, study_info_tuple, is_record_set=True)
+        )
+        apply_annotations_concurrently(syn, "Study", study_annotations, keys_to_drop, workers)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,145 @@
+"""
+test_crdc_golden.py
+
+Golden-output check for the CRDC model conversion in csv_to_ttl.py.
+
+A synthetic CRDC data model TSV with 10,000 properties is generated, converted with
+convert_crdc_model_to_ttl_format and written with build_ttl_entry, and the resulting TTL
+is compared with the committed golden file (golden/crdc_synthetic_10k.ttl.gz).
+The model covers each column type, enum, requirement, key and CDE variant the conversion handles.
+
+usage:
+  python -m pytest utils/tests/test_crdc_golden.py
+  python utils/tests/test_crdc_golden.py [--update]
+
+Run with --update to rewrite the golden file after an intended change to the TTL output.
+"""
+
+import argparse
+import gzip
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from csv_to_ttl import build_ttl_entry, convert_crdc_model_to_ttl_format  # noqa: E402
+from model_cache import read_model_table  # noqa: E402
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden", "crdc_synthetic_10k.ttl.gz")
+PROPERTY_COUNT = 10000
+ORG_NAME = "GC"
+BASE_TAG = "http://syn.org"
+BASE_REF = "syn"
+
+NODES = ["study", "Participant", "diagnosis", "10x Sample", "genomic info", "file"]
+TYPES = ["string", "list", "integer", "number", "boolean", '{"pattern":"^[A-Z]+$"}', '{"value_type":"number","units":["mg"]}']
+ACCEPTABLE_VALUES = ["", "single", "a,b,c", '["x","y"]', "[low],[high]"]
+REQUIRED = ["required", "preferred", ""]
+CDE_CODES = ["", "TBD", "1234567.0", "7654321"]
+
+
+def build_synthetic_model(property_count: int = PROPERTY_COUNT) -> pd.DataFrame:
+    """Build a deterministic CRDC data model with property_count properties."""
+
+    rows = []
+    for i in range(property_count):
+        cde_code = CDE_CODES[i % len(CDE_CODES)]
+        rows.append({
+            "Node": NODES[i % len(NODES)],
+            "Property": f"10x_property {i}" if i % 97 == 0 else f"property_{i}",
+            "Description": "" if i % 13 == 0 else f'Property {i} "quoted" description',
+            "Type": TYPES[i % len(TYPES)],
+            "Acceptable Values": ACCEPTABLE_VALUES[i % len(ACCEPTABLE_VALUES)],
+            "Required": REQUIRED[i % len(REQUIRED)],
+            "Key Property": "True" if i % 50 == 0 else "FALSE",
+            "CDEFullName": f"CDE name {i}" if cde_code not in ["", "TBD"] else "",
+            "CDECode": cde_code,
+        })
+
+    return pd.DataFrame(rows)
+
+
+def render_model_ttl(model_df: pd.DataFrame) -> str:
+    """Convert a CRDC model to TTL statements, preceded by its prefix lines in sorted order."""
+
+    tag_dict = {
+        "label": ("rdfs", "<http://www.w3.org/2000/01/rdf-schema#>"),
+        "description": ("purl", "<http://purl.org/dc/terms/>"),
+        "node": (BASE_REF, f"<{BASE_TAG}/>"),
+        "type": (BASE_REF, f"<{BASE_TAG}/>"),
+        "requiredBy": (BASE_REF, f"<{BASE_TAG}/>"),
+        "isKey": (BASE_REF, f"<{BASE_TAG}/>"),
+        "acceptableValues": (BASE_REF, f"<{BASE_TAG}/>"),
+        "DUO_": ("obo", "<http://purl.obolibrary.org/obo/>"),
+        "CDE": (BASE_REF, f"<{BASE_TAG}/>"),
+    }
+    ttl_df, _ = convert_crdc_model_to_ttl_format(model_df, ORG_NAME)
+    entries = [build_ttl_entry(row, tag_dict) for row in ttl_df.to_dict("records")]
+    prefixes = sorted({f"@prefix {tag_dict[prefix][0]}: {tag_dict[prefix][1]} .\n" for _, tags in entries for prefix in tags})
+
+    return "".join(prefixes) + "".join([entry for entry, _ in entries])
+
+
+def build_synthetic_ttl() -> str:
+    """Write the synthetic model to a TSV, read it as csv_to_ttl.py does and return its TTL."""
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        model_path = os.path.join(temp_dir, "synthetic_crdc_model.tsv")
+        build_synthetic_model().to_csv(model_path, sep="\t", index=False)
+        model_df = read_model_table(model_path)
+
+    return render_model_ttl(model_df)
+
+
+def read_golden() -> str:
+
+    with gzip.open(GOLDEN_PATH, "rt", encoding="utf-8") as f:
+        return f.read()
+
+
+def write_golden(ttl: str) -> None:
+
+    os.makedirs(os.path.dirname(GOLDEN_PATH), exist_ok=True)
+    with gzip.GzipFile(GOLDEN_PATH, "wb", mtime=0) as f:
+        f.write(ttl.encode("utf-8"))
+
+
+def test_crdc_conversion_matches_golden():
+
+    ttl = build_synthetic_ttl()
+    golden = read_golden()
+
+    if ttl != golden:
+        ttl_lines, golden_lines = ttl.splitlines(), golden.splitlines()
+        line = next((i for i, (a, b) in enumerate(zip(ttl_lines, golden_lines)) if a != b), min(len(ttl_lines), len(golden_lines)))
+        raise AssertionError(
+            f"TTL differs from {GOLDEN_PATH} at line {line + 1}:\n"
+            f"  expected: {golden_lines[line] if line < len(golden_lines) else '<end of file>'}\n"
+            f"  actual:   {ttl_lines[line] if line < len(ttl_lines) else '<end of file>'}"
+        )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare CRDC model conversion output with the golden TTL.")
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        default=None,
+        help="Boolean. Pass this flag to rewrite the golden TTL from the current output (Default: None)",
+    )
+    args = parser.parse_args()
+
+    if args.update is not None:
+        write_golden(build_synthetic_ttl())
+        print(f"Golden TTL written to {GOLDEN_PATH}")
+        return
+
+    test_crdc_conversion_matches_golden()
+    print(f"CRDC conversion matches {GOLDEN_PATH} ✅")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,8 @@ import pandas as pd
 import synapseclient
 from synapseclient import Dataset
 
+from dataset_items import drop_dataset_items, get_dataset_items, reconcile_dataset_items
+
 
 def get_args():
     """Set up command-line interface and get arguments."""
@@ -43,11 +45,9 @@ def remove_files_from_dataset(syn, dataset: str, files: list[str]) -> tuple[str,
     """Get files in dataset and remove if in input list of file Synapse IDs"""
 
     dataset_entity = syn.get(dataset, downloadFile=False)
-    dataset_files = pd.DataFrame(dataset_entity.properties.datasetItems)
-    files_to_remove = [file for file in files if file in dataset_files["entityId"].to_list()]
-    for file in files_to_remove:
-        dataset_entity.remove_item(file)
-    syn.store(dataset_entity)
+    desired_items = drop_dataset_items(get_dataset_items(dataset_entity), files)
+    _, removed_items = reconcile_dataset_items(syn, dataset_entity, desired_items)
+    files_to_remove = [item["entityId"] for item in removed_items]
 
     return dataset_entity.id, files_to_remove
 